@@ -2,6 +2,9 @@
 from __future__ import annotations
 import  os
 import json, requests, traceback
+# (base_url, token) -> (ETag, payload) của /api/student/data; dùng chung cho mọi APIClient
+_student_cache = {}
+
 class APIClient:
     def __init__(self, base_url=None, token_getter=None):
         self.base_url = base_url or os.environ.get("API_BASE_URL","http://127.0.0.1:5000")
@@ -19,9 +22,20 @@ class APIClient:
 
     def fetch_student_data(self, token):
         url = f"{self.base_url}/api/student/data"
+        key = (self.base_url, token)
+        headers = {"Authorization": f"Bearer {token}"}
+        cached = _student_cache.get(key)
+        if cached and cached[0]:
+            headers["If-None-Match"] = cached[0]
         try:
-            r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=15)
-            if r.ok: return True, r.json()
+            r = requests.get(url, headers=headers, timeout=15)
+            if r.status_code == 304 and cached:
+                return True, cached[1]
+            if r.ok:
+                data = r.json()
+                _student_cache.clear()  # chỉ giữ phiên đăng nhập hiện tại
+                _student_cache[key] = (r.headers.get("ETag"), data)
+                return True, data
             try: return False, r.json().get("message")
             except Exception: return False, r.text
         except Exception as e:
@@ -185,9 +185,10 @@ class ShellView(ctk.CTkFrame):
         self.app.show_view("login")
 
     def on_show(self):
-        if getattr(self.app, "app_state", None) and self.app.app_state.token and self._payload_cache is None:
+        # Luôn hỏi lại server: dữ liệu không đổi thì nhận 304 và client trả về đúng payload cũ
+        if getattr(self.app, "app_state", None) and self.app.app_state.token:
             ok, data = self.app.api_client.fetch_student_data(self.app.app_state.token)
-            if ok and isinstance(data, dict):
+            if ok and isinstance(data, dict) and data is not self._payload_cache:
                 self._payload_cache = data
                 self.switch_tab(self._current or "overview")
 
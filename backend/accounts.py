@@ -0,0 +1,91 @@
+# backend/accounts.py
+from __future__ import annotations
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from flask import current_app
+from passlib.hash import bcrypt
+
+from .models import db, NguoiDung
+from .utils_import import chunked
+
+
+# Mật khẩu ban đầu của tài khoản sinh viên chính là MaSV. Ở chế độ "deferred"
+# chỉ ghi marker này, việc băm bcrypt dời sang lần đăng nhập đầu (xem app.login).
+DEFERRED_HASH = "!initial"
+
+HASH_MODE_DEFERRED = "deferred"
+HASH_MODE_POOL = "pool"
+HASH_MODE_SERIAL = "serial"
+
+_POOL_MIN_BATCH = 8
+
+
+def is_deferred(stored: Optional[str]) -> bool:
+    return (stored or "") == DEFERRED_HASH
+
+
+def _hash_one(secret: str) -> str:
+    return bcrypt.hash(secret)
+
+
+def hash_passwords(secrets: List[str], *, workers: Optional[int] = None) -> List[str]:
+    if not secrets:
+        return []
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(secrets) < _POOL_MIN_BATCH:
+        return [_hash_one(s) for s in secrets]
+    chunk = max(1, len(secrets) // (workers * 4))
+    # spawn: fork từ worker đang giữ luồng nền (audit, job) và kết nối CSDL dễ treo tiến trình con
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as ex:
+        return list(ex.map(_hash_one, secrets, chunksize=chunk))
+
+
+def _hash_mode() -> str:
+    try:
+        mode = current_app.config.get("ACCOUNT_HASH_MODE", HASH_MODE_DEFERRED)
+    except RuntimeError:
+        mode = HASH_MODE_DEFERRED
+    return (mode or HASH_MODE_DEFERRED).strip().lower()
+
+
+def provision_student_users(masvs: Iterable[str], *, email_domain: str, role_id: Optional[int],
+                            mode: Optional[str] = None) -> Dict[str, int]:
+    wanted = list(dict.fromkeys(m for m in masvs if m))
+    if not wanted:
+        return {}
+
+    ids: Dict[str, int] = {}
+    for part in chunked(wanted, 500):
+        rows = (db.session.query(NguoiDung.TenDangNhap, NguoiDung.MaNguoiDung)
+                .filter(NguoiDung.TenDangNhap.in_(part)).all())
+        ids.update({name: uid for name, uid in rows})
+
+    missing = [m for m in wanted if m not in ids]
+    if not missing:
+        return ids
+
+    mode = (mode or _hash_mode()).strip().lower()
+    if mode == HASH_MODE_POOL:
+        hashes = hash_passwords(missing)
+    elif mode == HASH_MODE_SERIAL:
+        hashes = hash_passwords(missing, workers=1)
+    else:
+        hashes = [DEFERRED_HASH] * len(missing)
+
+    users = [
+        NguoiDung(
+            TenDangNhap=masv,
+            MatKhauMaHoa=pw,
+            Email=f"{masv}@{email_domain}".lower(),
+            TrangThai="Hoạt động",
+            MaVaiTro=role_id,
+        )
+        for masv, pw in zip(missing, hashes)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    ids.update({u.TenDangNhap: u.MaNguoiDung for u in users})
+    return ids
@@ -7,7 +7,7 @@ from io import BytesIO
 from typing import Any, Dict
 
 import sqlalchemy as sa
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, current_app, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from passlib.hash import bcrypt
 
@@ -17,8 +17,16 @@ from .models import (
     NganhHoc, LopHoc,
     NguoiDung, SystemConfig,
     WarningRule, WarningCase,
-    ImportLog,
+    ImportLog, SubjectAlias, StudentAggregate, Job,
 )
+from . import jobs, config_cache, exporter
+from .config_cache import settings
+from .services.student_aggregate import refresh_students, refresh_courses, students_taking
+from .services.analytics_cache import dashboard_cache
+from .services.student_search import list_students
+from .services import grade_snapshot
+from .warning_scan import mark_all_dirty
+from .grade_writer import ket_qua
 
 try:
     from . import importer as _importer
@@ -54,8 +62,7 @@ def json_body() -> Dict[str, Any]:
     return request.get_json(silent=True) or {}
 
 def _email_domain() -> str:
-    row = db.session.get(SystemConfig, "EMAIL_DOMAIN")
-    return (row.ConfigValue if row else "vui.edu.vn")
+    return settings().email_domain
 
 @bp.get("/api/auth/me")
 @jwt_required()
@@ -76,27 +83,46 @@ def auth_me():
 @bp.get("/api/admin/dashboard-analytics")
 @jwt_required()
 def dashboard_analytics():
-    total_students = db.session.scalar(sa.select(sa.func.count()).select_from(SinhVien)) or 0
-    total_courses  = db.session.scalar(sa.select(sa.func.count()).select_from(HocPhan)) or 0
-
-    total_kq = db.session.scalar(sa.select(sa.func.count()).select_from(KetQuaHocTap)) or 0
-    pass_kq = 0
-    conds = [
-        getattr(KetQuaHocTap, "DiemHe10") >= 4.0
-    ]
-    if hasattr(KetQuaHocTap, "KetQua"):
-        conds.append(getattr(KetQuaHocTap, "KetQua").in_(["Đạt", "Pass"]))
-    if hasattr(KetQuaHocTap, "DiemChu"):
-        conds.append(getattr(KetQuaHocTap, "DiemChu").in_(["A","B","C","D","P"]))
-    pass_kq = db.session.scalar(
-        sa.select(sa.func.count()).select_from(KetQuaHocTap).where(sa.or_(*conds))
-    ) or 0
-
-    return jsonify({"kpi": {
-        "total_students": int(total_students),
-        "total_courses": int(total_courses),
-        "pass_rate": round((pass_kq/total_kq) if total_kq else 0.0, 4),
-    }})
+    return dashboard_cache(current_app).response("admin-kpi")
+
+# ---- Snapshot Parquet của kho điểm (services/grade_snapshot.py): tổng hợp không qua CSDL ----
+def _snapshot(fn, **kw):
+    try:
+        return jsonify(fn(**kw))
+    except grade_snapshot.SnapshotUnavailable as e:
+        return bad(str(e), 503)
+    except ValueError as e:
+        return bad(str(e))
+
+def _run_snapshot_refresh():
+    full = str(request.args.get("full") or "").lower() in ("1", "true", "yes", "y")
+    return _snapshot(grade_snapshot.refresh, full=full)
+
+@bp.post("/api/admin/snapshot/refresh")
+@roles_required("Admin")
+def snapshot_refresh():
+    return _run_snapshot_refresh()
+
+@bp.get("/api/analytics/snapshot")
+@roles_required("Admin", "Cán bộ đào tạo")
+def snapshot_status():
+    return _snapshot(grade_snapshot.status)
+
+@bp.get("/api/analytics/snapshot/gpa-distribution")
+@roles_required("Admin", "Cán bộ đào tạo")
+def snapshot_gpa_distribution():
+    a = request.args
+    return _snapshot(grade_snapshot.gpa_distribution, by=a.get("by") or "NamTuyenSinh",
+                     ma_nganh=a.get("MaNganh"), hoc_ky=a.get("HocKy"), ma_lop=a.get("MaLop"),
+                     bins=a.get("bins", 8, type=int))
+
+@bp.get("/api/analytics/snapshot/fail-rates")
+@roles_required("Admin", "Cán bộ đào tạo")
+def snapshot_fail_rates():
+    a = request.args
+    return _snapshot(grade_snapshot.fail_rates, ma_nganh=a.get("MaNganh"), hoc_ky=a.get("HocKy"),
+                     ma_lop=a.get("MaLop"), ma_hp=a.get("MaHP"), min_n=a.get("min_n", 1, type=int),
+                     limit=a.get("limit", 50, type=int))
 
 @bp.get("/api/admin/users")
 @jwt_required()
@@ -173,20 +199,8 @@ def classes_update(ma):
         return ok({"message": "Không có thay đổi"})
 
     it.TenLop = new_name
-
-    import time
-    tries = 3
-    for i in range(tries):
-        try:
-            db.session.commit()
-            return ok()
-        except sa.exc.OperationalError as e:
-            msg = str(e).lower()
-            db.session.rollback()
-            if "database is locked" in msg and i < tries - 1:
-                time.sleep(0.25 * (2 ** i))  # backoff: 250ms, 500ms
-                continue
-            return bad("CSDL đang bận (database is locked). Thử lại sau giây lát.", 503)
+    db.session.commit()
+    return ok()
 
 @bp.delete("/api/admin/classes/<ma>")
 @roles_required("Admin")
@@ -227,8 +241,11 @@ def courses_update(ma):
     if not it: return bad("Không tìm thấy học phần", 404)
     d = json_body()
     if "TenHP" in d: it.TenHP = d["TenHP"]
+    credits_changed = "SoTinChi" in d and int(d["SoTinChi"] or 0) != it.SoTinChi
     if "SoTinChi" in d: it.SoTinChi = int(d["SoTinChi"] or 0)
     if "TinhDiemTichLuy" in d: it.TinhDiemTichLuy = bool(d["TinhDiemTichLuy"])
+    if credits_changed:
+        refresh_courses([ma])
     db.session.commit(); return ok()
 
 @bp.delete("/api/admin/courses/<ma>")
@@ -236,6 +253,35 @@ def courses_update(ma):
 def courses_delete(ma):
     it = HocPhan.query.get(ma)
     if not it: return bad("Không tìm thấy học phần", 404)
+    affected = students_taking([ma])
+    db.session.delete(it); db.session.flush()
+    refresh_students(affected)
+    db.session.commit(); return ok()
+
+@bp.get("/api/admin/subject-aliases")
+@jwt_required()
+def subject_aliases_list():
+    rows = (db.session.query(SubjectAlias, HocPhan.TenHP)
+            .join(HocPhan, HocPhan.MaHP == SubjectAlias.MaHP, isouter=True)
+            .order_by(SubjectAlias.Alias).all())
+    return jsonify({"items": [{
+        "Alias": a.Alias, "MaHP": a.MaHP, "TenHP": ten, "Source": a.Source, "Score": a.Score,
+        "CreatedAt": a.CreatedAt.isoformat(timespec="seconds") if a.CreatedAt else None,
+    } for a, ten in rows]})
+
+@bp.put("/api/admin/subject-aliases/<path:alias>")
+@roles_required("Admin", "Cán bộ đào tạo")
+def subject_aliases_put(alias):
+    mahp = (json_body().get("MaHP") or "").strip()
+    if not db.session.get(HocPhan, mahp): return bad("Không tìm thấy học phần", 404)
+    db.session.merge(SubjectAlias(Alias=alias, MaHP=mahp, Source="manual", Score=None))
+    db.session.commit(); return ok()
+
+@bp.delete("/api/admin/subject-aliases/<path:alias>")
+@roles_required("Admin", "Cán bộ đào tạo")
+def subject_aliases_delete(alias):
+    it = db.session.get(SubjectAlias, alias)
+    if not it: return bad("Không tìm thấy alias", 404)
     db.session.delete(it); db.session.commit(); return ok()
 
 def _sv_dict(sv) -> Dict[str, Any]:
@@ -246,30 +292,23 @@ def _sv_dict(sv) -> Dict[str, Any]:
         "Email": getattr(getattr(sv, "nguoi_dung_rel", None), "Email", None)
     }
 
+# ?cursor=<next_cursor của trang trước> (keyset); ?page= vẫn nhận để tương thích.
+# ?count=estimate|exact|none; total_exact=false nghĩa là total chỉ là ước lượng / chặn trên.
 @bp.get("/api/admin/students")
 @jwt_required()
 def students_list():
     qstr = (request.args.get("q") or "").strip()
     lop  = (request.args.get("lop") or "").strip()
+    cursor = (request.args.get("cursor") or "").strip() or None
     page = max(int(request.args.get("page", 1)), 1)
     limit= max(min(int(request.args.get("page_size", 50)), 200), 1)
+    count = (request.args.get("count") or "estimate").strip().lower()
 
-    q = db.session.query(SinhVien)
-    if lop:
-        if hasattr(SinhVien, "Lop"):
-            q = q.filter(SinhVien.Lop == lop)
-        else:
-            q = q.filter(SinhVien.MaLop == lop)
-    if qstr:
-        conds = []
-        conds.append(SinhVien.MaSV.ilike(f"%{qstr}%"))
-        conds.append(SinhVien.HoTen.ilike(f"%{qstr}%"))
-        q = q.filter(sa.or_(*conds))
-
-    total = q.count()
-    q = q.order_by(SinhVien.MaSV).offset((page-1)*limit).limit(limit)
-    items = [_sv_dict(x) for x in q.all()]
-    return jsonify({"items": items, "total": total, "page": page, "page_size": limit})
+    res = list_students(qstr, lop, cursor=cursor, limit=limit, page=None if cursor else page,
+                        count=count if count in ("estimate", "exact", "none") else "estimate")
+    items = [_sv_dict(x) for x in res["rows"]]
+    return jsonify({"items": items, "total": res["total"], "total_exact": res["total_exact"],
+                    "next_cursor": res["next_cursor"], "page": page, "page_size": limit})
 
 @bp.get("/api/admin/students/<masv>")
 @jwt_required()
@@ -285,7 +324,8 @@ def students_transcript(masv):
     rows = [{
         "MaHP": r.MaHP, "TenHP": getattr(r.hoc_phan_rel, "TenHP", None),
         "SoTinChi": getattr(r.hoc_phan_rel, "SoTinChi", None),
-        "DiemHe10": r.DiemHe10, "DiemChu": r.DiemChu, "KetQua": getattr(r, "KetQua", None)
+        "DiemHe10": r.DiemHe10, "DiemChu": r.DiemChu,
+        "KetQua": r.KetQua or ket_qua(r.DiemHe10, r.DiemChu),   # NULL khi migration 0002 chưa backfill xong
     } for r in q.all()]
     return jsonify({"items": rows})
 
@@ -321,8 +361,7 @@ def students_update(masv):
     if not sv: return bad("Không tìm thấy sinh viên", 404)
     d = json_body()
     if "HoTen" in d: sv.HoTen = d["HoTen"]
-    if "Lop" in d and hasattr(sv, "Lop"): sv.Lop = d["Lop"]
-    if "MaLop" in d and hasattr(sv, "MaLop"): sv.MaLop = d["MaLop"]
+    if "MaLop" in d or "Lop" in d: sv.MaLop = d.get("MaLop", d.get("Lop")) or None
     db.session.commit(); return ok()
 
 @bp.delete("/api/admin/students/<masv>")
@@ -330,15 +369,15 @@ def students_update(masv):
 def students_delete(masv):
     sv = db.session.get(SinhVien, masv)
     if not sv: return bad("Không tìm thấy sinh viên", 404)
-    db.session.delete(sv); db.session.commit(); return ok()
+    db.session.delete(sv)
+    db.session.query(StudentAggregate).filter(StudentAggregate.MaSV == masv).delete(synchronize_session=False)
+    db.session.commit(); return ok()
 
 @bp.get("/api/admin/configs")
 @jwt_required()
 def configs_get():
-    rows = db.session.query(SystemConfig).all()
-    values = {x.ConfigKey: x.ConfigValue for x in rows}
-    meta   = {x.ConfigKey: x.Description or "" for x in rows}
-    return jsonify({"values": values, "meta": meta})
+    s = settings()
+    return jsonify({"values": dict(s.values), "meta": dict(s.descriptions)})
 
 @bp.put("/api/admin/configs")
 @roles_required("Admin")
@@ -350,7 +389,7 @@ def configs_put():
             db.session.add(SystemConfig(ConfigKey=k, ConfigValue=str(v)))
         else:
             row.ConfigValue = str(v)
-    db.session.commit(); return ok()
+    db.session.commit(); config_cache.invalidate(); return ok()
 
 @bp.get("/api/admin/warning/rules")
 @jwt_required()
@@ -364,7 +403,7 @@ def warning_rules():
 def warning_rules_create():
     d = json_body()
     it = WarningRule(Code=d.get("Code"), Name=d.get("Name") or d.get("Code"), Threshold=d.get("Threshold") or 0.0)
-    db.session.add(it); db.session.commit(); return ok()
+    db.session.add(it); mark_all_dirty(); db.session.commit(); return ok()
 
 @bp.get("/api/admin/warning/cases")
 @jwt_required()
@@ -385,13 +424,15 @@ def warning_cases():
         })
     return jsonify({"items": items})
 
+def _run_warning_scan():
+    from .warning_scan import scan_all_warnings
+    return jsonify(scan_all_warnings(incremental=(request.args.get("mode", "incremental") != "full")))
+
 @bp.post("/api/admin/warning/scan")
 @roles_required("Admin")
 def warning_scan_run():
-    from .warning_scan import scan_all_warnings
     try:
-        res = scan_all_warnings()
-        return jsonify(res)
+        return _run_warning_scan()
     except Exception as e:
         return bad(f"Lỗi quét cảnh báo: {e}")
 
@@ -402,21 +443,28 @@ def _import_resp(summary=None, preview=None, warnings=None):
         "warnings": warnings or []
     })
 
-@bp.post("/api/admin/import/grades")
-@roles_required("Admin")
-def import_grades():
+def _run_import_grades():
     if _importer and hasattr(_importer, "import_grades"):
         return _importer.import_grades(  # type: ignore
             preview=(request.args.get("preview", "1") == "1"),
             allow_update=(request.args.get("allow_update", "0") == "1"),
             hoc_ky_default=request.args.get("hocky"),
-            retake_policy=request.args.get("retake_policy") or "keep-latest",
+            retake_policy=request.args.get("retake_policy"),
         )
     return _import_resp()
 
-@bp.post("/api/admin/import/class-roster")
-@roles_required("Admin")
-def import_roster():
+def _run_import_grades_batch():
+    if _importer and hasattr(_importer, "import_grades"):
+        from .batch_import import import_grades_batch
+        return import_grades_batch(
+            preview=(request.args.get("preview", "1") == "1"),
+            allow_update=(request.args.get("allow_update", "0") == "1"),
+            hoc_ky_default=request.args.get("hocky"),
+            retake_policy=request.args.get("retake_policy"),
+        )
+    return _import_resp()
+
+def _run_import_roster():
     if _importer and hasattr(_importer, "import_class_roster"):
         return _importer.import_class_roster(  # type: ignore
             preview=(request.args.get("preview", "1") == "1"),
@@ -424,15 +472,75 @@ def import_roster():
         )
     return _import_resp()
 
-@bp.post("/api/admin/import/curriculum")
-@roles_required("Admin")
-def import_curriculum():
+def _run_import_curriculum():
     if _importer and hasattr(_importer, "import_curriculum"):
         return _importer.import_curriculum(  # type: ignore
             preview=(request.args.get("preview", "1") == "1")
         )
     return _import_resp()
 
+@bp.post("/api/admin/import/grades")
+@roles_required("Admin")
+def import_grades():
+    return _run_import_grades()
+
+# Nhiều file/ZIP, mỗi file một lớp, mỗi sheet một học kỳ (xem batch_import.py)
+@bp.post("/api/admin/import/grades/batch")
+@roles_required("Admin")
+def import_grades_batch():
+    return _run_import_grades_batch()
+
+@bp.post("/api/admin/import/class-roster")
+@roles_required("Admin")
+def import_roster():
+    return _run_import_roster()
+
+@bp.post("/api/admin/import/curriculum")
+@roles_required("Admin")
+def import_curriculum():
+    return _run_import_curriculum()
+
+jobs.register("import-grades", "/api/admin/import/grades", _run_import_grades)
+jobs.register("import-grades-batch", "/api/admin/import/grades/batch", _run_import_grades_batch)
+jobs.register("import-roster", "/api/admin/import/class-roster", _run_import_roster)
+jobs.register("import-curriculum", "/api/admin/import/curriculum", _run_import_curriculum)
+jobs.register("warning-scan", "/api/admin/warning/scan", _run_warning_scan)
+jobs.register(grade_snapshot.JOB_KIND, "/api/admin/snapshot/refresh", _run_snapshot_refresh)
+
+# ---- Tác vụ nền: nộp job, xem trạng thái/tiến độ, lấy kết quả ----
+@bp.post("/api/admin/jobs/<kind>")
+@roles_required("Admin")
+def jobs_submit(kind: str):
+    if kind not in jobs.kinds():
+        return bad(f"Loại job không hỗ trợ: {kind}", 404)
+    uploads = request.files.getlist("files") + request.files.getlist("file")
+    if kind.startswith("import-") and not uploads:
+        return bad("Thiếu file upload (form field 'file').")
+    job = jobs.submit(kind, request.args.to_dict(), upload=uploads, actor=str(get_jwt_identity() or ""))
+    return jsonify(jobs.job_to_dict(job)), 202
+
+@bp.get("/api/admin/jobs")
+@roles_required("Admin")
+def jobs_list():
+    rows = db.session.query(Job).order_by(Job.Id.desc()).limit(50).all()
+    return jsonify({"items": [jobs.job_to_dict(j) for j in rows]})
+
+@bp.get("/api/admin/jobs/<int:job_id>")
+@roles_required("Admin")
+def jobs_status(job_id: int):
+    job = db.session.get(Job, job_id)
+    if not job: return bad("Không tìm thấy job", 404)
+    return jsonify(jobs.job_to_dict(job))
+
+@bp.get("/api/admin/jobs/<int:job_id>/result")
+@roles_required("Admin")
+def jobs_result(job_id: int):
+    job = db.session.get(Job, job_id)
+    if not job: return bad("Không tìm thấy job", 404)
+    if job.Status in ("queued", "running"):
+        return jsonify(jobs.job_to_dict(job)), 409
+    return jsonify(jobs.job_to_dict(job, with_result=True))
+
 @bp.get("/api/admin/templates/roster.csv")
 @jwt_required()
 def template_roster_csv():
@@ -457,5 +565,14 @@ def template_grades_xlsx():
 def import_logs():
     rows = db.session.query(ImportLog).order_by(ImportLog.When.desc()).limit(200).all()
     items = [{"At": str(r.When), "Actor": r.Actor, "Endpoint": r.Endpoint,
-              "Filename": r.Filename, "Summary": r.Summary} for r in rows]
+              "Filename": r.Filename, "Summary": r.Summary, "Status": r.Status, "Cursor": r.Cursor} for r in rows]
     return jsonify({"items": items})
+
+# Xuất theo luồng: students | grades | warning-cases | import-logs, dạng .csv hoặc .xlsx
+@bp.get("/api/admin/export/<name>.<any(csv, xlsx):fmt>")
+@roles_required("Admin", "Cán bộ đào tạo")
+def export_dataset(name, fmt):
+    try:
+        return exporter.export_response(name, fmt, request.args)
+    except exporter.ExportError as e:
+        return bad(str(e), 404 if name not in exporter.EXPORTS else 400)
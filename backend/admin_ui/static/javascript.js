@@ -150,6 +150,24 @@ async function apiJSON(url, options = {}) {
   return ensureJSON(r);
 }
 
+/* ============== Background jobs ============== */
+// Nộp job rồi hỏi trạng thái định kỳ; trả về payload giống endpoint đồng bộ.
+async function runJob(kind, query, body, onProgress) {
+  const job = await apiJSON(`/api/admin/jobs/${kind}${query ? `?${query}` : ""}`, { method: "POST", body });
+  for (;;) {
+    await new Promise(r => setTimeout(r, 1000));
+    const st = await apiJSON(`/api/admin/jobs/${job.Id}`);
+    if (onProgress) onProgress(st.Progress || {}, st);
+    if (st.Status !== "queued" && st.Status !== "running") break;
+  }
+  const done = await apiJSON(`/api/admin/jobs/${job.Id}/result`);
+  if (done.Status !== "done") {
+    const r = done.Result || {};
+    throw new Error(r.message || r.msg || (r.summary?.warnings || []).join("; ") || done.Error || `Job ${job.Id} lỗi`);
+  }
+  return done.Result || {};
+}
+
 /* ============== Common lists ============== */
 async function populateClasses(selectId) {
   const sel = $(selectId); if (!sel || sel._loaded) return;
@@ -184,18 +202,22 @@ function setupDropzone() {
   const dz = $("#dropzone"), file = $("#im_file"), btn = $("#pickFileBtn"), name = $("#pickedName");
   if (!dz || dz._wired) { return; } dz._wired = true;
 
-  const setName = f => { if (name) name.textContent = f ? `Đã chọn: ${f.name}` : ""; };
+  const setName = fs => { if (name) name.textContent = !fs?.length ? "" : fs.length > 1 ? `Đã chọn: ${fs.length} file` : `Đã chọn: ${fs[0].name}`; };
   on(btn, "click", () => file?.click());
-  on(file, "change", () => setName(file.files?.[0]));
+  on(file, "change", () => setName(file.files));
   ["dragenter", "dragover"].forEach(ev => on(dz, ev, (e) => { e.preventDefault(); dz.classList.add("dragover"); }));
   ["dragleave", "drop"].forEach(ev => on(dz, ev, (e) => { e.preventDefault(); dz.classList.remove("dragover"); }));
-  on(dz, "drop", (e) => { const f = e.dataTransfer?.files?.[0]; if (!f) return; file.files = e.dataTransfer.files; setName(f); });
+  on(dz, "drop", (e) => { const fs = e.dataTransfer?.files; if (!fs?.length) return; file.files = fs; setName(fs); });
 }
 
 function bindImportButtons() {
   const barWrap = $("#im_progress"), bar = $("#im_progress .progress-bar");
   const begin = () => { if (barWrap) barWrap.style.display = "block"; if (bar) bar.style.width = "30%"; };
-  const mid = () => { if (bar) bar.style.width = "70%"; };
+  const mid = (p) => {
+    if (!bar) return;
+    const pct = p && p.total ? Math.min(95, Math.round(100 * (p.processed || 0) / p.total)) : 70;
+    bar.style.width = `${Math.max(30, pct)}%`;
+  };
   const end = () => { if (bar) bar.style.width = "100%"; setTimeout(() => { if (barWrap) barWrap.style.display = "none"; }, 400); };
 
   const btnPrev = $("#btnPreview"), btnCommit = $("#btnCommit");
@@ -205,7 +227,7 @@ function bindImportButtons() {
   const handle = async (preview) => {
     if (busy) return;   // chống spam
     const kind = ($("#im_kind")?.value) || "grades";
-    const file = $("#im_file")?.files?.[0]; if (!file) return toast("Chưa chọn file", "warning");
+    const files = [...($("#im_file")?.files || [])]; if (!files.length) return toast("Chưa chọn file", "warning");
     const lop = $("#im_class")?.value?.trim() || "";
     const hocKy = $("#im_semester")?.value?.trim() || "";
     const policy = $("#im_policy")?.value || "";
@@ -213,22 +235,27 @@ function bindImportButtons() {
     const applyFuzzy = $("#im_apply_fuzzy")?.checked ? 1 : 0;
     const fuzzyTh = parseFloat($("#im_fuzzy_th")?.value || "0.78") || 0.78;
 
-    let url = "";
+    let jobKind = "", qs = "";
     if (kind === "roster") {
-      url = `/api/admin/import/class-roster?preview=${preview ? 1 : 0}${lop ? `&lop=${encodeURIComponent(lop)}` : ""}&allow_update=${allowUpdate}`;
+      jobKind = "import-roster";
+      qs = `preview=${preview ? 1 : 0}${lop ? `&lop=${encodeURIComponent(lop)}` : ""}&allow_update=${allowUpdate}`;
     } else if (kind === "curriculum") {
-      url = `/api/admin/import/curriculum?preview=${preview ? 1 : 0}`;
+      jobKind = "import-curriculum";
+      qs = `preview=${preview ? 1 : 0}`;
     } else {
-      url = `/api/admin/import/grades?preview=${preview ? 1 : 0}${lop ? `&lop=${encodeURIComponent(lop)}` : ""}${hocKy ? `&hocky=${encodeURIComponent(hocKy)}` : ""}${policy ? `&retake_policy=${encodeURIComponent(policy)}` : ""}&allow_update=${allowUpdate}&apply_fuzzy=${applyFuzzy}&fuzzy_threshold=${encodeURIComponent(fuzzyTh)}`;
+      // nhiều file (mỗi lớp một file) hoặc ZIP: import theo lô
+      jobKind = files.length > 1 || /\.zip$/i.test(files[0].name) ? "import-grades-batch" : "import-grades";
+      qs = `preview=${preview ? 1 : 0}${lop ? `&lop=${encodeURIComponent(lop)}` : ""}${hocKy ? `&hocky=${encodeURIComponent(hocKy)}` : ""}${policy ? `&retake_policy=${encodeURIComponent(policy)}` : ""}&allow_update=${allowUpdate}&apply_fuzzy=${applyFuzzy}&fuzzy_threshold=${encodeURIComponent(fuzzyTh)}`;
     }
-    if (kind !== "curriculum") url += `&create_missing_students=1`;
+    if (kind !== "curriculum") qs += `&create_missing_students=1`;
 
-    const fd = new FormData(); fd.append("file", file);
+    if (files.length > 1 && jobKind !== "import-grades-batch") return toast("Chỉ import điểm mới chọn được nhiều file", "warning");
+    const fd = new FormData(); files.forEach(f => fd.append(jobKind === "import-grades-batch" ? "files" : "file", f));
 
     try {
       setBusy(true); begin();
-      const data = await apiJSON(url, { method: "POST", body: fd });
-      mid(); end(); renderImportResult(data, preview);
+      const data = await runJob(jobKind, qs, fd, mid);
+      end(); renderImportResult(data, preview);
       if (!preview) {
         const s = data.summary || data.Summary || {};
         const created = s.created ?? 0, updated = s.updated ?? 0, skipped = s.skipped ?? 0;
@@ -272,13 +299,15 @@ async function initImportPage() {
 }
 
 /* ============== Students (CRUD + Detail) ============== */
-async function loadStudents(page = 1) {
+let STU_ITEMS = [];
+async function loadStudents(cursor = null) {
   const q = $("#stu_q")?.value?.trim() || ""; const lop = $("#stu_class")?.value?.trim() || "";
-  const url = `/api/admin/students?${q ? `q=${encodeURIComponent(q)}&` : ""}${lop ? `lop=${encodeURIComponent(lop)}&` : ""}page=${page}&page_size=50`;
+  const url = `/api/admin/students?${q ? `q=${encodeURIComponent(q)}&` : ""}${lop ? `lop=${encodeURIComponent(lop)}&` : ""}${cursor ? `cursor=${encodeURIComponent(cursor)}&` : ""}page_size=50`;
   const table = $("#stu_table"); if (!table) return;
   try {
     const data = await apiJSON(url);                      // ✅ fix: chỉ gọi 1 lần (trước đây gọi 2 lần)
-    const items = data.items || data.data || data || [];
+    const page = data.items || data.data || data || [];
+    const items = STU_ITEMS = cursor ? STU_ITEMS.concat(page) : page;   // cursor: nối trang kế tiếp (keyset)
     if (!Array.isArray(items) || !items.length) { table.innerHTML = `<div class="text-muted">Không có sinh viên.</div>`; return; }
     table.innerHTML = `<div class="table-responsive"><table class="table table-hover align-middle">
       <thead><tr><th>Mã SV</th><th>Họ tên</th><th>Lớp</th><th>Email</th><th></th></tr></thead>
@@ -292,7 +321,12 @@ async function loadStudents(page = 1) {
               <button class="btn btn-sm btn-outline-danger" data-action="del" data-masv="${masv}">Xóa</button>
             </td></tr>`;
     }).join("")}
-      </tbody></table></div>`;
+      </tbody></table></div>
+      <div class="d-flex justify-content-between align-items-center">
+        <small class="text-muted">${items.length} / ${data.total_exact === false ? "~" : ""}${data.total ?? "?"}</small>
+        ${data.next_cursor ? `<button id="stu_more" class="btn btn-sm btn-outline-primary">Tải thêm</button>` : ""}
+      </div>`;
+    on($("#stu_more"), "click", () => loadStudents(data.next_cursor));
     $$("#stu_table [data-action='detail']").forEach(btn => on(btn, "click", () => openStudentDetail(btn.dataset.masv)));
     $$("#stu_table [data-action='edit']").forEach(b => on(b, "click", () => openStudentEditor("edit", b.dataset.masv)));
     $$("#stu_table [data-action='del']").forEach(b => on(b, "click", () => deleteStudent(b.dataset.masv)));
@@ -423,8 +457,9 @@ async function loadWarningRules() {
     const btn = $("#warn_scan_btn");
     try {
       btn.disabled = true; btn.textContent = "Đang quét...";
-      const res = await apiJSON("/api/admin/warning/scan", { method: "POST" });
-      toast(`Đã quét xong. ${res.created || 0} cảnh báo mới.`, "success");
+      const res = await runJob("warning-scan", "", null,
+        p => { if (p.total) btn.textContent = `Đang quét... ${p.processed || 0}/${p.total}`; });
+      toast(`Đã quét xong ${res.scanned || 0} SV. ${res.created || 0} cảnh báo mới, ${res.closed || 0} đã đóng.`, "success");
       await loadWarningCases();
     } catch (e) { toast(e.message, "danger"); }
     finally { btn.disabled = false; btn.textContent = "Quét cảnh báo"; }
@@ -3,8 +3,6 @@ from __future__ import annotations
 import logging
 import traceback
 from functools import wraps
-import io
-import csv
 import json
 from datetime import datetime, timezone
 from pathlib import Path
@@ -26,10 +24,17 @@ from .models import (
     KetQuaHocTap,
     SystemConfig, ImportLog,
     WarningRule, WarningCase,ChuongTrinhDaoTao,
-    Khoa,
+    Khoa, StudentAggregate,
 )
 from .importer import import_curriculum, import_class_roster, import_grades
-from .services.analytics_service import get_dashboard_analytics
+from .accounts import is_deferred
+from . import jobs, data_version, config_cache, migrations, db_profile, write_gate, audit_sink, import_plan, import_runs, batch_import
+from .config_cache import settings, DEFAULTS as CONFIG_DEFAULTS
+from .query_budget import query_budget, init_app as query_budget_init
+from .services.student_payload import student_etag, payload_json
+from .warning_scan import mark_all_dirty
+from .services import analytics_cache, student_search, grade_snapshot
+from .services.analytics_cache import dashboard_cache
 from .admin_ui import bp as admin_ui_bp
 from .admin_crud import crud_bp, roles_required
 from sqlalchemy import event
@@ -57,6 +62,10 @@ CONFIG_META = {
     "RETAKE_POLICY_DEFAULT": "Chính sách thi lại mặc định (keep-latest|best)",
 }
 
+# /api/student/data: MaSV + phiên bản (2 câu, đủ cho 304), khi cache trượt thêm hồ sơ + kết quả + CTĐT
+# (3 câu; 7 khi CTĐT phải dùng hết các nhánh dự phòng)
+STUDENT_DATA_QUERY_BUDGET = 9
+
 RUN_DIR = Path(sys.executable).parent if getattr(sys, "frozen", False) else Path(__file__).parent
 BASE = Path(getattr(sys, "_MEIPASS", RUN_DIR))
 
@@ -131,22 +140,17 @@ def _actor_username() -> Optional[str]:
     except Exception:
         return None
 
-def _audit_db(endpoint: str, summary: Dict[str, Any], *, filename: Optional[str]=None, affected: Optional[str]=None):
-
+def _audit_db(endpoint: str, summary: Dict[str, Any], *, filename: Optional[str]=None, affected: Optional[str]=None,
+              actor: Optional[str]=None):
+    # Xếp hàng cho audit_sink, không ghi/commit trong request
     try:
-        db.session.add(ImportLog(
-            When = datetime.now(timezone.utc),  # tránh DeprecationWarning
-            Actor = _actor_username() or str(_actor_id() or ""),
-            Endpoint = endpoint,
-            Params = json.dumps({"q": request.args.to_dict(), "body": request.get_json(silent=True)}, ensure_ascii=False),
-            Filename = filename,
-            Summary = json.dumps(summary, ensure_ascii=False),
-            AffectedTable = affected,
-            InsertedIds = None,
-        ))
-        db.session.commit()
+        audit_sink.log_event(
+            endpoint, summary, filename=filename, affected=affected,
+            actor=actor if actor is not None else (_actor_username() or str(_actor_id() or "")),
+            params={"q": request.args.to_dict(), "body": request.get_json(silent=True)},
+        )
     except Exception:
-        db.session.rollback()
+        logging.getLogger(__name__).exception("audit failed")
 
 def _ensure_warning_rule(code: str, name: str, threshold: float) -> WarningRule:
     r = WarningRule.query.filter_by(Code=code).first()
@@ -190,23 +194,35 @@ def create_app() -> Flask:
     app = Flask(__name__)
 
     basedir = os.path.dirname(__file__)
-    db_path = os.path.join(basedir, "app.db")
-    app.config.setdefault("SQLALCHEMY_DATABASE_URI", f"sqlite:///{db_path}")
+    db_profile.configure(app, os.path.join(basedir, "app.db"))
     app.config.setdefault("SQLALCHEMY_TRACK_MODIFICATIONS", False)
     app.config.setdefault("SECRET_KEY", os.getenv("SECRET_KEY", "dev-secret"))
     app.config.setdefault("JWT_SECRET_KEY", os.getenv("JWT_SECRET_KEY", "dev-jwt"))
     app.config.setdefault("MAX_CONTENT_LENGTH", 50 * 1024 * 1024)
-    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"].setdefault("connect_args", {})
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"].update({"timeout": 30})
+    app.config.setdefault("ACCOUNT_HASH_MODE", os.getenv("ACCOUNT_HASH_MODE", "deferred"))
     app.register_blueprint(admin_ui_bp)
     app.register_blueprint(crud_bp)
     CORS(app, supports_credentials=True)
     db.init_app(app)
+    write_gate.init_app(app)
+    jobs.init_app(app)
+    query_budget_init(app)
+    data_version.init_app(app)
+    audit_sink.init_app(app)
+    import_plan.init_app(app)
+    import_runs.init_app(app)
+    batch_import.init_app(app)
+    config_cache.init_app(app)
+    analytics_cache.init_app(app)
+    grade_snapshot.init_app(app)
+    with app.app_context():
+        try:
+            db.create_all()  # bảng mới (SubjectAlias, ...) trên app.db cũ
+        except Exception as e:
+            app.logger.warning("create_all failed: %s", e)
+    migrations.init_app(app)
+    student_search.init_app(app)
     jwt = JWTManager(app)
-    RUN_DIR = Path(sys.executable).parent if getattr(sys, "frozen", False) else Path(__file__).parent
-    db_path = RUN_DIR / "app.db"
-    app.config.setdefault("SQLALCHEMY_DATABASE_URI", f"sqlite:///{db_path.as_posix()}")
 
     @app.post("/login")
     def login():
@@ -223,7 +239,12 @@ def create_app() -> Flask:
         ok = False
         stored = user.MatKhauMaHoa or ""
         try:
-            if stored and stored.startswith("$"):
+            if is_deferred(stored):
+                ok = (password == user.TenDangNhap)
+                if ok:
+                    user.MatKhauMaHoa = pwd_ctx.hash(password)
+                    db.session.commit()
+            elif stored and stored.startswith("$"):
                 ok = pwd_ctx.verify(password, stored)
             else:
                 ok = (password == stored)
@@ -241,7 +262,7 @@ def create_app() -> Flask:
         token = create_access_token(identity=str(user.MaNguoiDung),
                                     additional_claims={"username": username, "role": role})
 
-        _audit_db("POST /login", {"login": "ok"}, filename=None, affected="Auth")
+        _audit_db("POST /login", {"login": "ok"}, filename=None, affected="Auth", actor=username)
         return jsonify({"access_token": token, "user": {"username": username, "role": role}})
 
     @app.post("/api/auth/login")
@@ -264,16 +285,12 @@ def create_app() -> Flask:
     @app.get("/api/analytics/kpi")
     @jwt_required()
     def analytics_kpi():
-        ma_nganh = request.args.get("MaNganh")
-        data = get_dashboard_analytics(ma_nganh=ma_nganh)
-        return jsonify(data)
+        return dashboard_cache(app).response("kpi", request.args.get("MaNganh"))
 
     @app.get("/api/analytics/top-fails")
     @jwt_required()
     def analytics_top_fails():
-        ma_nganh = request.args.get("MaNganh")
-        data = get_dashboard_analytics(ma_nganh=ma_nganh) or {}
-        return jsonify({"items": data.get("top_failing_courses", [])})
+        return dashboard_cache(app).response("top-fails")
 
     @app.get("/api/admin/dashboard-analytics")
     @roles_required("Admin", "Cán bộ đào tạo")
@@ -323,7 +340,8 @@ def create_app() -> Flask:
     @app.get("/api/admin/configs")
     @jwt_required()
     def api_get_configs():
-        values = {k: (db.session.get(SystemConfig, k).ConfigValue if db.session.get(SystemConfig, k) else "") for k in ALLOWED_CONFIG_KEYS}
+        cur = settings().values
+        values = {k: cur.get(k, "") for k in ALLOWED_CONFIG_KEYS}
         return jsonify({"values": values, "meta": CONFIG_META})
 
     @app.put("/api/admin/configs")
@@ -342,6 +360,7 @@ def create_app() -> Flask:
                 row.ConfigValue = str(v)
             changed[k] = str(v)
         db.session.commit()
+        config_cache.invalidate()
         _audit_db("PUT /api/admin/configs", {"changed": changed}, affected="SystemConfig")
         return jsonify({"msg": "OK", "changed": changed})
 
@@ -355,37 +374,24 @@ def create_app() -> Flask:
             "Actor": r.Actor, "Endpoint": r.Endpoint,
             "Params": r.Params, "Filename": r.Filename,
             "Summary": r.Summary, "AffectedTable": r.AffectedTable,
-            "InsertedIds": r.InsertedIds
+            "InsertedIds": r.InsertedIds, "Status": r.Status, "Cursor": r.Cursor
         } for r in rows]
         return jsonify({"items": items})
 
     @app.post("/api/admin/warning/scan")
     @jwt_required()
     def warning_scan():
-        cfg = {c.ConfigKey: c.ConfigValue for c in SystemConfig.query.all()}
-        gpa_th = float(cfg.get("GPA_TRUNGBINH_THRESHOLD", 2.0))
-        debt_th = float(cfg.get("TINCHI_NO_CANHCAO_THRESHOLD", 10))
+        cfg = settings()
+        gpa_th, debt_th = cfg.gpa_warn, cfg.debt_warn
 
         r_gpa = _ensure_warning_rule("GPA_BELOW", "GPA dưới ngưỡng", gpa_th)
         r_debt = _ensure_warning_rule("DEBT_OVER", "Nợ tín chỉ vượt ngưỡng", debt_th)
 
-        sub = (db.session.query(
-                    KetQuaHocTap.MaSV.label("MaSV"),
-                    func.sum((KetQuaHocTap.DiemHe4 * (case((HocPhan.SoTinChi != None, HocPhan.SoTinChi), else_=0)))).label("S"),
-                    func.sum(case((HocPhan.SoTinChi != None, HocPhan.SoTinChi), else_=0)).label("W"),
-                    func.sum(case((KetQuaHocTap.DiemHe4 < 1.0, HocPhan.SoTinChi), else_=0)).label("DebtTC"),
-                )
-                .join(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP, isouter=True)
-                .filter(KetQuaHocTap.LaDiemCuoiCung.is_(True))
-                .group_by(KetQuaHocTap.MaSV)
-                ).subquery()
-
         q = (db.session.query(
                 SinhVien.MaSV, SinhVien.HoTen,
-                (sub.c.S / func.nullif(sub.c.W, 0)).label("GPA4"),
-                sub.c.DebtTC
+                StudentAggregate.GPA4, StudentAggregate.CreditsDebt
             )
-            .join(sub, sub.c.MaSV == SinhVien.MaSV, isouter=True))
+            .join(StudentAggregate, StudentAggregate.MaSV == SinhVien.MaSV, isouter=True))
 
         ma_lop = request.args.get("MaLop")
         if ma_lop:
@@ -457,7 +463,7 @@ def create_app() -> Flask:
         if WarningRule.query.filter_by(Code=code).first():
             return jsonify({"msg": "Code đã tồn tại"}), 409
         r = WarningRule(Code=code, Name=name, Threshold=th, Active=True)
-        db.session.add(r); db.session.commit()
+        db.session.add(r); mark_all_dirty(); db.session.commit()
         _audit_db("POST /api/admin/warning/rules", {"inserted": code}, affected="WarningRule")
         return jsonify({"msg": "OK", "Id": r.Id}), 201
 
@@ -471,21 +477,6 @@ def create_app() -> Flask:
         _audit_db("DELETE /api/admin/warning/rules/<id>", {"deleted": rid}, affected="WarningRule")
         return jsonify({"msg": "OK"})
 
-    @app.get("/api/admin/export/students.csv")
-    @jwt_required()
-    def export_students_csv():
-        q = (db.session.query(SinhVien.MaSV, SinhVien.HoTen, LopHoc.TenLop, NganhHoc.TenNganh)
-             .join(LopHoc, LopHoc.MaLop == SinhVien.MaLop, isouter=True)
-             .join(NganhHoc, NganhHoc.MaNganh == LopHoc.MaNganh, isouter=True))
-        buf = io.StringIO()
-        w = csv.writer(buf)
-        w.writerow(["MaSV","HoTen","Lop","Nganh"])
-        for msv, ht, lop, nganh in q.all():
-            w.writerow([msv, ht, lop or "", nganh or ""])
-        from flask import Response
-        return Response(buf.getvalue(), mimetype="text/csv",
-                        headers={"Content-Disposition": "attachment; filename=students.csv"})
-
     @app.get("/healthz")
     def healthz():
         return jsonify({"status": "ok"})
@@ -497,150 +488,23 @@ def create_app() -> Flask:
 
     @app.get("/api/student/data")
     @jwt_required()
+    @query_budget(STUDENT_DATA_QUERY_BUDGET)
     def student_data_compat():
-        from sqlalchemy import func, or_
-
         uid = _actor_id()
-        u = db.session.get(NguoiDung, uid) if uid else None
-
-        sv = None
-        try:
-            if u and hasattr(u, "sinh_vien_rel") and u.sinh_vien_rel:
-                sv = u.sinh_vien_rel
-        except Exception:
-            pass
-        if not sv and hasattr(SinhVien, "MaNguoiDung"):
-            try:
-                sv = db.session.query(SinhVien).filter_by(MaNguoiDung=uid).first()
-            except Exception:
-                sv = None
-        if not sv and u and getattr(u, "TenDangNhap", None):
-            try:
-                sv = db.session.get(SinhVien, u.TenDangNhap)
-            except Exception:
-                sv = None
-        if not sv:
+        hit = student_etag(uid)
+        if hit is None:
             return jsonify({"msg": "Không tìm thấy thông tin sinh viên"}), 404
-
-        masv = getattr(sv, "MaSV", None) or getattr(sv, "id", None)
-
-        ma_lop = getattr(sv, "MaLop", None) or getattr(sv, "Lop", None)
-        lop = db.session.get(LopHoc, ma_lop) if ma_lop else None
-        nganh = db.session.get(NganhHoc, getattr(lop, "MaNganh", None)) if lop else None
-
-        kq_list = db.session.query(KetQuaHocTap).filter_by(MaSV=masv).all()
-
-        def _row(kq):
-            mahp = getattr(kq, "MaHP", None)
-            hp = db.session.get(HocPhan, mahp) if mahp else None
-            return {
-                "HocKy": getattr(kq, "HocKy", None),
-                "MaHP": mahp,
-                "TenHP": getattr(hp, "TenHP", None) or getattr(kq, "TenHP", None),
-                "SoTinChi": getattr(hp, "SoTinChi", None) or getattr(kq, "SoTinChi", 0),
-                "DiemHe10": getattr(kq, "DiemHe10", None),
-                "DiemHe4": getattr(kq, "DiemHe4", None),
-                "DiemChu": getattr(kq, "DiemChu", None),
-                "TinhDiemTichLuy": (bool(getattr(hp, "TinhDiemTichLuy", True)) if hp
-                                    else bool(getattr(kq, "TinhDiemTichLuy", True))),
-                "LaDiemCuoiCung": getattr(kq, "LaDiemCuoiCung", None),
-            }
-
-        items = [_row(kq) for kq in kq_list]
-
-        def _digits_to_int(v):
-            if v is None: return None
-            s = str(v).strip()
-            dg = "".join(ch for ch in s if ch.isdigit())
-            return int(dg) if dg else None
-
-        plan = []
-
-        CTDT = ChuongTrinhDaoTao
-        if CTDT and hasattr(CTDT, "MaNganh") and hasattr(CTDT, "HocKy"):
-            q = db.session.query(CTDT)
-            rows = []
-            ma_nganh = getattr(lop, "MaNganh", None)
-            if ma_nganh:
-                rows = (q.filter(CTDT.MaNganh == ma_nganh)
-                        .order_by(CTDT.HocKy, CTDT.MaHP).all())
-            if not rows and ma_nganh:
-                prefix = str(ma_nganh)[:5]
-                rows = (q.filter(CTDT.MaNganh.like(f"{prefix}%"))
-                        .order_by(CTDT.HocKy, CTDT.MaHP).all())
-            if not rows:
-                rows = q.order_by(CTDT.HocKy, CTDT.MaHP).all()
-
-            for r in rows:
-                hp = db.session.get(HocPhan, getattr(r, "MaHP", None))
-                plan.append({
-                    "HocKy": _digits_to_int(getattr(r, "HocKy", None)),
-                    "MaHP": getattr(r, "MaHP", None),
-                    "TenHP": getattr(hp, "TenHP", None) or getattr(r, "hoc_phan_rel", None).TenHP if hasattr(r,
-                                                                                                             "hoc_phan_rel") and r.hoc_phan_rel else None,
-                    "SoTinChi": (getattr(hp, "SoTinChi", 0) if hp else 0) or getattr(r, "SoTinChi", 0),
-                })
-
-        if not plan:
-            hk_map_kq = dict(db.session.query(
-                KetQuaHocTap.MaHP, func.min(KetQuaHocTap.HocKy)
-            ).group_by(KetQuaHocTap.MaHP).all())
-
-            hps = (db.session.query(HocPhan)
-                   .filter(or_(HocPhan.TinhDiemTichLuy == True, HocPhan.TinhDiemTichLuy.is_(None)))
-                   .order_by(HocPhan.MaHP).all())
-
-            for hp in hps:
-                hk = hk_map_kq.get(hp.MaHP)
-                hk_int = _digits_to_int(hk)
-                plan.append({
-                    "HocKy": hk_int,
-                    "MaHP": hp.MaHP,
-                    "TenHP": hp.TenHP,
-                    "SoTinChi": hp.SoTinChi or 0,
-                })
-        khoa_name = None
-        try:
-            k = getattr(nganh, "khoa", None)
-            if k:
-                khoa_name = getattr(k, "TenKhoa", None) or getattr(k, "Name", None)
-        except Exception:
-            pass
-        if not khoa_name:
-            try:
-                mk = getattr(nganh, "MaKhoa", None)
-                if mk:
-                    k = db.session.get(Khoa, mk)
-                    if k:
-                        khoa_name = getattr(k, "TenKhoa", None) or getattr(k, "Name", None)
-            except Exception:
-                pass
-
-        email = getattr(u, "Email", None)
-        if not email:
-            try:
-                email = getattr(getattr(sv, "nguoi_dung_rel", None), "Email", None)
-            except Exception:
-                email = None
-        def _hk_key(x):
-            try:
-                return int(x.get("HocKy") or 0)
-            except:
-                return 0
-
-        plan.sort(key=lambda x: (_hk_key(x), str(x.get("MaHP") or "")))
-
-        return jsonify({
-            "MaSV": masv,
-            "HoTen": getattr(sv, "HoTen", None),
-            "NgaySinh": (getattr(sv, "NgaySinh", None).strftime("%d/%m/%Y")if getattr(sv, "NgaySinh", None) else None),
-            "Lop": getattr(lop, "TenLop", None) or ma_lop,
-            "Nganh": getattr(nganh, "TenNganh", None),
-            "Khoa": khoa_name,
-            "Email":email,
-            "KetQuaHocTap": items,
-            "ChuongTrinhDaoTao": plan
-        })
+        masv, etag = hit
+        if request.if_none_match.contains(etag):
+            resp = app.response_class(status=304)
+        else:
+            body = payload_json(uid, masv, etag)
+            if body is None:
+                return jsonify({"msg": "Không tìm thấy thông tin sinh viên"}), 404
+            resp = app.response_class(body, mimetype="application/json")
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
 
     @app.get("/api/admin/classes")
     @roles_required("Admin", "Cán bộ đào tạo")
@@ -710,20 +574,13 @@ def create_app() -> Flask:
 
 
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()       # process pool của batch import trong bản exe
     app = create_app()
     with app.app_context():
         db.create_all()
         if SystemConfig.query.count() == 0:
-            defaults = {
-                "EMAIL_DOMAIN": "vui.edu.vn",
-                "DEFAULT_MAJOR": "CNTT",
-                "GPA_GIOI_THRESHOLD": "3.2",
-                "GPA_KHA_THRESHOLD": "2.5",
-                "GPA_TRUNGBINH_THRESHOLD": "2.0",
-                "TINCHI_NO_CANHCAO_THRESHOLD": "10",
-                "RETAKE_POLICY_DEFAULT": "keep-latest",
-            }
-            for k, v in defaults.items():
+            for k, v in CONFIG_DEFAULTS.items():
                 db.session.add(SystemConfig(ConfigKey=k, ConfigValue=str(v)))
             db.session.commit()
     app.run(debug=True, port=5000, use_reloader=False, threaded=False)
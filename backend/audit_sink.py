@@ -0,0 +1,300 @@
+# backend/audit_sink.py
+# Ghi nhật ký không chặn request: bản ghi ImportLog/AuditLog được dựng trong luồng request (cần actor, IP,
+# User-Agent) rồi xếp vào hàng đợi trong bộ nhớ; một luồng nền gom tối đa AUDIT_BATCH bản ghi (chờ thêm
+# tối đa AUDIT_LINGER giây sau bản ghi đầu) và ghi cả lô trong một transaction. Trước đây mỗi request
+# được audit (kể cả /login) tốn thêm một transaction ghi và tranh khoá ghi SQLite.
+#   - hàng đợi giới hạn AUDIT_QUEUE_SIZE: đầy thì bỏ bản ghi (đếm ở dropped) chứ không chặn request;
+#   - tiến trình thoát (atexit) thì ghi nốt phần còn lại, tối đa AUDIT_CLOSE_TIMEOUT giây;
+#   - AuditLog: mỗi sự kiện log_event() một dòng, cộng thay đổi ORM trên các bảng quản trị (_AUDITED) với
+#     Before/After là các cột đã đổi, chỉ ghi sau khi commit. Một transaction đổi quá MAX_ROWS đối tượng
+#     (vd. import tạo hàng nghìn sinh viên) thì ghi gộp mỗi (hành động, bảng) một dòng kèm số lượng.
+# Mật khẩu/token trong Params và cột MatKhauMaHoa không bao giờ được ghi.
+from __future__ import annotations
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import Flask, current_app, g, has_request_context, request
+from sqlalchemy import event, insert, inspect
+
+from .models import (
+    db, ImportLog, AuditLog, Khoa, NganhHoc, LopHoc, HocPhan, ChuongTrinhDaoTao, SinhVien, NguoiDung, VaiTro,
+    SystemConfig, WarningRule, WarningCase, SubjectAlias,
+)
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+BATCH = 500
+LINGER = 0.5
+CLOSE_TIMEOUT = 5.0
+MAX_ROWS = 50
+_AUDITED = (Khoa, NganhHoc, LopHoc, HocPhan, ChuongTrinhDaoTao, SinhVien, NguoiDung, VaiTro,
+            SystemConfig, WarningRule, WarningCase, SubjectAlias)
+_SECRET_COLUMNS = {"MatKhauMaHoa"}
+_SECRET_KEYS = re.compile(r"pass|mat_?khau|token|secret", re.I)
+_KEY = "audit_changes"
+
+
+class AuditSink:
+    def __init__(self, app: Flask, maxsize: int = QUEUE_SIZE, batch: int = BATCH, linger: float = LINGER):
+        self.app = app
+        self.batch = batch
+        self.linger = linger
+        self.q: "queue.Queue[Tuple[Any, Dict[str, Any]]]" = queue.Queue(maxsize)
+        self.written = self.dropped = self.failed = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="audit-sink", daemon=True)
+                self._thread.start()
+
+    # Không bao giờ chặn: hàng đợi đầy thì bỏ bản ghi
+    def put(self, table, row: Dict[str, Any]) -> bool:
+        self.start()
+        try:
+            self.q.put_nowait((table, row))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                log.warning("hàng đợi audit đầy, đã bỏ %d bản ghi", self.dropped)
+            return False
+
+    def _collect(self) -> List[Tuple[Any, Dict[str, Any]]]:
+        try:
+            items = [self.q.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        until = time.monotonic() + self.linger
+        while len(items) < self.batch:
+            left = until - time.monotonic()
+            if left <= 0 or self._stop.is_set():
+                break
+            try:
+                items.append(self.q.get(timeout=left))
+            except queue.Empty:
+                break
+        while len(items) < self.batch:
+            try:
+                items.append(self.q.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items: List[Tuple[Any, Dict[str, Any]]]):
+        by_table: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+        for table, row in items:
+            by_table[table].append(row)
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    for table, rows in by_table.items():
+                        conn.execute(insert(table), rows)
+            self.written += len(items)
+        except Exception:
+            self.failed += len(items)
+            log.exception("không ghi được %d bản ghi audit", len(items))
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            if items:
+                self._write(items)
+                for _ in items:
+                    self.q.task_done()
+            elif self._stop.is_set():
+                return
+
+    # Chờ ghi hết những gì đã xếp hàng (test, CLI, lúc tắt)
+    def flush(self, timeout: float = CLOSE_TIMEOUT) -> bool:
+        deadline = time.monotonic() + timeout
+        with self.q.all_tasks_done:
+            while self.q.unfinished_tasks:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self.q.all_tasks_done.wait(left)
+        return True
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        if self._thread is None:
+            return
+        ok = self.flush(timeout)
+        self._stop.set()
+        if not ok:
+            log.warning("tắt tiến trình: còn %d bản ghi audit chưa ghi", self.q.qsize())
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.q.qsize(), "written": self.written, "dropped": self.dropped, "failed": self.failed}
+
+
+def sink(app: Optional[Flask] = None) -> Optional[AuditSink]:
+    app = app or current_app
+    return app.extensions.get("audit_sink")
+
+
+def _plain(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, bytes):
+        return None
+    return v
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {k: ("***" if _SECRET_KEYS.search(str(k)) else redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+
+# Danh sách -> số phần tử: warnings của import có thể dài hàng nghìn dòng
+def _brief(summary: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: (len(v) if isinstance(v, (list, tuple)) else v) for k, v in (summary or {}).items()}
+
+
+def _request_meta() -> Dict[str, Optional[str]]:
+    if not has_request_context():
+        return {"ClientIP": None, "UA": None}
+    ua = request.headers.get("User-Agent") or ""
+    return {"ClientIP": (request.remote_addr or "")[:48] or None, "UA": ua[:256] or None}
+
+
+def _actor() -> Optional[str]:
+    if not has_request_context():
+        return None
+    if g.get("job_actor_name") is not None:
+        return g.job_actor_name or None
+    try:
+        from flask_jwt_extended import get_jwt
+        claims = get_jwt() or {}
+        return claims.get("username") or (str(claims["sub"]) if claims.get("sub") else None)
+    except Exception:
+        return None
+
+
+# Một sự kiện nghiệp vụ (import, quét cảnh báo, đăng nhập...): một dòng ImportLog + một dòng AuditLog.
+# import_log=False: dòng ImportLog đã được ghi đồng bộ (run import, xem import_runs.py)
+def log_event(endpoint: str, summary: Dict[str, Any], *, filename: Optional[str] = None,
+              affected: Optional[str] = None, actor: Optional[str] = None, params: Any = None,
+              import_log: bool = True) -> bool:
+    s = sink()
+    if s is None:
+        return False
+    now = datetime.utcnow()
+    actor = actor if actor is not None else (_actor() or "")
+    if params is None and has_request_context():
+        params = request.args.to_dict()
+    if import_log:
+        s.put(ImportLog.__table__, {
+            "When": now, "Actor": str(actor), "Endpoint": endpoint,
+            "Params": json.dumps(redact(params), ensure_ascii=False, default=str) if params is not None else None,
+            "Filename": filename, "Summary": json.dumps(summary, ensure_ascii=False, default=str),
+            "AffectedTable": affected, "InsertedIds": None,
+        })
+    return s.put(AuditLog.__table__, {
+        "At": now, "Actor": str(actor)[:64] or None, "Action": endpoint[:64],
+        "Resource": (affected or "")[:64] or None, "ResourceId": filename[:64] if filename else None,
+        "Before": None, "After": json.loads(json.dumps(_brief(summary), default=str)), **_request_meta(),
+    })
+
+
+def _columns(obj) -> Dict[str, Any]:
+    return {a.key: ("***" if a.key in _SECRET_COLUMNS else _plain(getattr(obj, a.key)))
+            for a in inspect(obj).mapper.column_attrs}
+
+
+def _changed(obj) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    before, after = {}, {}
+    st = inspect(obj)
+    for a in st.mapper.column_attrs:
+        h = st.attrs[a.key].history
+        if not h.has_changes():
+            continue
+        secret = a.key in _SECRET_COLUMNS
+        before[a.key] = "***" if secret else _plain(h.deleted[0] if h.deleted else None)
+        after[a.key] = "***" if secret else _plain(h.added[0] if h.added else None)
+    return before, after
+
+
+def _ident(obj) -> str:
+    pk = inspect(obj).mapper.primary_key_from_instance(obj)
+    return "/".join("" if v is None else str(v) for v in pk)[:64]
+
+
+def _after_flush(session, _ctx):
+    if not has_request_context():
+        return
+    changes = session.info.setdefault(_KEY, {"rows": [], "counts": Counter()})
+
+    def add(action, obj, before, after):
+        resource = obj.__tablename__
+        changes["counts"][(action, resource)] += 1
+        if len(changes["rows"]) < MAX_ROWS:
+            changes["rows"].append((action, resource, _ident(obj), before, after))
+
+    for obj in session.new:
+        if isinstance(obj, _AUDITED):
+            add("create", obj, None, _columns(obj))
+    for obj in session.dirty:
+        if isinstance(obj, _AUDITED) and session.is_modified(obj, include_collections=False):
+            before, after = _changed(obj)
+            if after:
+                add("update", obj, before, after)
+    for obj in session.deleted:
+        if isinstance(obj, _AUDITED):
+            add("delete", obj, _columns(obj), None)
+
+
+def _after_commit(session):
+    changes = session.info.pop(_KEY, None)
+    s = sink() if changes and has_request_context() else None
+    if s is None:
+        return
+    now, actor, meta = datetime.utcnow(), (_actor() or None), _request_meta()
+    counts = changes["counts"]
+    if sum(counts.values()) > len(changes["rows"]):
+        rows = [(action, resource, None, None, {"count": n}) for (action, resource), n in counts.items()]
+    else:
+        rows = changes["rows"]
+    for action, resource, ident, before, after in rows:
+        s.put(AuditLog.__table__, {"At": now, "Actor": actor, "Action": action, "Resource": resource,
+                                   "ResourceId": ident, "Before": before, "After": after, **meta})
+
+
+def _after_rollback(session):
+    session.info.pop(_KEY, None)
+
+
+def init_app(app: Flask):
+    app.config.setdefault("AUDIT_QUEUE_SIZE", int(os.getenv("AUDIT_QUEUE_SIZE", QUEUE_SIZE)))
+    app.config.setdefault("AUDIT_BATCH", int(os.getenv("AUDIT_BATCH", BATCH)))
+    app.config.setdefault("AUDIT_LINGER", float(os.getenv("AUDIT_LINGER", LINGER)))
+    app.config.setdefault("AUDIT_CLOSE_TIMEOUT", float(os.getenv("AUDIT_CLOSE_TIMEOUT", CLOSE_TIMEOUT)))
+    if "audit_sink" not in app.extensions:
+        s = AuditSink(app, app.config["AUDIT_QUEUE_SIZE"], app.config["AUDIT_BATCH"], app.config["AUDIT_LINGER"])
+        app.extensions["audit_sink"] = s
+        atexit.register(s.close, app.config["AUDIT_CLOSE_TIMEOUT"])
+    for name, fn in (("after_flush", _after_flush), ("after_commit", _after_commit),
+                     ("after_rollback", _after_rollback)):
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
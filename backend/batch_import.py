@@ -0,0 +1,196 @@
+# backend/batch_import.py
+# Import điểm nhiều file một lần: POST /api/admin/import/grades/batch nhận nhiều field 'files' (hoặc
+# 'file'), mỗi lớp một file XLSX/CSV, mỗi sheet một học kỳ, hoặc file ZIP chứa các file đó.
+#   - đọc file (openpyxl/pandas, tốn CPU) chạy song song trong process pool IMPORT_BATCH_WORKERS tiến
+#     trình (spawn, dùng lại giữa các request); 0 = đọc tuần tự trong tiến trình này (mặc định ở bản exe);
+#   - mỗi sheet có dữ liệu được import bằng import_grades như một upload riêng (ParsedSheet): cùng một
+#     luồng ghi (upsert_grades theo lô, commit theo checkpoint, chống import trùng theo SHA-256 của file +
+#     tên sheet). Ghi tuần tự theo thứ tự file/sheet gửi lên nên kết quả không phụ thuộc file nào đọc xong
+#     trước; trong lúc ghi, các file sau vẫn đang được đọc nên tổng thời gian ≈ file đọc lâu nhất + ghi;
+#   - lớp của file: ?lop nếu có, không thì tên file (bỏ đuôi) nếu trùng MaLop; học kỳ của sheet: ?hocky
+#     nếu có, không thì số trong tên sheet ("HK1", "Học kỳ 2") khi file có nhiều sheet.
+# Trả về summary từng file/sheet và tổng cộng. Chạy nền qua job "import-grades-batch" (POST
+# /api/admin/jobs/import-grades-batch, cùng các field file).
+from __future__ import annotations
+import atexit
+import multiprocessing as mp
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, current_app, jsonify, request
+from sqlalchemy import select
+
+from .jobs import report_progress
+from .models import db, LopHoc
+from .upload_stream import SpooledUpload, ParsedSheet, spool_upload, read_sheets, sheet_digest
+
+MAX_FILES = 200
+MAX_BYTES = 500 * 1024 * 1024          # tổng dung lượng giải nén của các file trong ZIP
+_EXT = (".xlsx", ".xlsm", ".xls", ".csv")
+_KEY = "batch_import_pool"
+_lock = threading.Lock()
+
+
+def pool(app: Optional[Flask] = None) -> Optional[ProcessPoolExecutor]:
+    app = app or current_app
+    workers = int(app.config.get("IMPORT_BATCH_WORKERS", 0))
+    if workers <= 0:
+        return None
+    ex = app.extensions.get(_KEY)
+    if ex is None:
+        with _lock:
+            ex = app.extensions.get(_KEY)
+            if ex is None:
+                # spawn: không fork tiến trình đang có luồng và kết nối CSDL mở
+                ex = ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"))
+                app.extensions[_KEY] = ex
+                atexit.register(ex.shutdown, wait=False, cancel_futures=True)
+    return ex
+
+
+def _copy(src, path: str, budget: int) -> int:
+    n = 0
+    with open(path, "wb") as fh:
+        for block in iter(lambda: src.read(1 << 20), b""):
+            n += len(block)
+            if n > budget:
+                raise ValueError("ZIP giải nén vượt quá giới hạn dung lượng")
+            fh.write(block)
+    return n
+
+
+# Các file trong ZIP ra file tạm; tên hiển thị "<zip>/<đường dẫn trong zip>"
+def _unzip(up: SpooledUpload, budget: int) -> List[SpooledUpload]:
+    out = []
+    with zipfile.ZipFile(up.path) as zf:
+        members = sorted((m for m in zf.infolist()
+                          if not m.is_dir() and os.path.splitext(m.filename)[1].lower() in _EXT
+                          and not os.path.basename(m.filename).startswith((".", "~$"))
+                          and not m.filename.startswith("__MACOSX/")), key=lambda m: m.filename)
+        try:
+            for m in members:
+                fd, path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(m.filename)[1])
+                os.close(fd)
+                out.append(SpooledUpload(path, f"{os.path.basename(up.filename)}/{m.filename}"))
+                with zf.open(m) as src:
+                    budget -= _copy(src, path, budget)
+        except Exception:
+            for x in out:
+                x.close()
+            raise
+    return out
+
+
+def _spool_files(files, max_files: int, max_bytes: int) -> List[SpooledUpload]:
+    out: List[SpooledUpload] = []
+    try:
+        for f in files:
+            up = spool_upload(f)
+            if up.ext == ".zip":
+                with up:
+                    out += _unzip(up, max_bytes)
+            elif up.ext in _EXT:
+                out.append(up)
+            else:
+                up.close()
+                raise ValueError(f"Định dạng không hỗ trợ: {up.filename}")
+            if len(out) > max_files:
+                raise ValueError(f"Quá {max_files} file trong một lần import")
+    except Exception:
+        for up in out:
+            up.close()
+        raise
+    return out
+
+
+def _sheet_term(name: str) -> Optional[str]:
+    m = re.search(r"\d+", name or "")
+    return (m.group(0).lstrip("0") or "0") if m else None
+
+
+def _lop_of(filename: str, classes) -> str:
+    stem = os.path.splitext(os.path.basename(filename))[0].strip().upper()
+    return stem if stem in classes else ""
+
+
+def import_grades_batch(*, preview: bool = True, allow_update: bool = True, hoc_ky_default: Optional[str] = None,
+                        retake_policy: Optional[str] = None):
+    from .importer import import_grades
+
+    files = request.files.getlist("files") + request.files.getlist("file")
+    if not files:
+        return jsonify({"msg": "Thiếu file (form field 'files')"}), 400
+    t0 = time.perf_counter()
+    cfg = current_app.config
+    try:
+        ups = _spool_files(files, int(cfg.get("IMPORT_BATCH_MAX_FILES", MAX_FILES)),
+                           int(cfg.get("IMPORT_BATCH_MAX_BYTES", MAX_BYTES)))
+    except Exception as e:
+        return jsonify({"msg": f"Lỗi đọc file: {e}"}), 400
+
+    lop_arg = (request.args.get("lop") or "").strip().upper()
+    classes = set() if lop_arg else set(db.session.execute(select(LopHoc.MaLop)).scalars())
+    ex = pool() if len(ups) > 1 else None
+    futures = [ex.submit(read_sheets, up.path, up.filename) for up in ups] if ex else [None] * len(ups)
+
+    items: List[Dict[str, Any]] = []
+    totals = {"total_rows": 0, "created": 0, "updated": 0, "skipped": 0}
+    try:
+        for done, (up, fut) in enumerate(zip(ups, futures)):
+            report_progress(files=len(ups), files_done=done)
+            try:
+                try:
+                    sheets = fut.result() if fut is not None else read_sheets(up.path, up.filename)
+                except BrokenProcessPool:
+                    current_app.extensions.pop(_KEY, None)
+                    sheets = read_sheets(up.path, up.filename)
+            except Exception as e:
+                items.append({"file": up.filename, "sheet": None, "status": 400, "summary": None,
+                              "warnings": [f"Lỗi đọc file: {e}"]})
+                continue
+            lop = lop_arg or _lop_of(up.filename, classes)
+            sheets = [(name, df) for name, df in sheets if len(df)]
+            if not sheets:
+                items.append({"file": up.filename, "sheet": None, "status": 400, "summary": None,
+                              "warnings": ["File không có dữ liệu"]})
+                continue
+            for name, df in sheets:
+                hk = hoc_ky_default or (_sheet_term(name) if len(sheets) > 1 else None)
+                src = ParsedSheet(df, f"{up.filename}#{name}" if name and len(sheets) > 1 else up.filename,
+                                  sheet_digest(up.digest, name))
+                resp, code = import_grades(preview=preview, allow_update=allow_update, hoc_ky_default=hk,
+                                           retake_policy=retake_policy, lop=lop, source=src)
+                body = resp.get_json() or {}
+                summary = body.get("summary") or {}
+                if code < 400 and not summary.get("duplicate_of"):
+                    for k in totals:
+                        totals[k] += int(summary.get(k) or 0)
+                items.append({"file": up.filename, "sheet": name or None, "lop": lop or None, "hocky": hk,
+                              "status": code, "summary": summary, "warnings": body.get("warnings") or []})
+        report_progress(files_done=len(ups))
+    finally:
+        for up in ups:
+            up.close()
+
+    failed = [i for i in items if i["status"] >= 400]
+    totals.update(files=len(ups), sheets=len(items), failed=len(failed),
+                  duplicates=sum(1 for i in items if (i["summary"] or {}).get("duplicate_of")),
+                  seconds=round(time.perf_counter() - t0, 3))
+    code = 400 if failed and len(failed) == len(items) else 200
+    return jsonify({"summary": totals, "files": items, "preview": preview}), code
+
+
+def init_app(app: Flask):
+    # Bản đóng gói (PyInstaller): mặc định đọc tuần tự, tiến trình con spawn phải chạy lại cả file exe
+    default = 0 if getattr(sys, "frozen", False) else min(4, os.cpu_count() or 1)
+    app.config.setdefault("IMPORT_BATCH_WORKERS", int(os.getenv("IMPORT_BATCH_WORKERS", default)))
+    app.config.setdefault("IMPORT_BATCH_MAX_FILES", int(os.getenv("IMPORT_BATCH_MAX_FILES", MAX_FILES)))
+    app.config.setdefault("IMPORT_BATCH_MAX_BYTES", int(os.getenv("IMPORT_BATCH_MAX_BYTES", MAX_BYTES)))
@@ -0,0 +1,138 @@
+# backend/bench_batch.py
+# Đo batch import điểm (backend/batch_import.py): --files file XLSX, mỗi file một lớp với --sheets sheet
+# học kỳ, import qua /api/admin/import/grades/batch trên CSDL SQLite tạm với từng số tiến trình đọc
+# (IMPORT_BATCH_WORKERS, 0 = đọc tuần tự). In thời gian đọc từng file (file chậm nhất / tổng) để so với
+# thời gian cả batch.
+#   python -m backend.bench_batch --files 8 --sheets 2 --students 2000 --workers 0,4
+from __future__ import annotations
+import argparse
+import io
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+N_HP = 12
+
+
+def _workbook(lop: str, sheets: int, students: int, seed: int) -> bytes:
+    import pandas as pd
+
+    rnd = random.Random(seed)
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf) as w:
+        for hk in range(1, sheets + 1):
+            rows = []
+            for s in range(students):
+                r = {"STT": s + 1, "Mã sinh viên": f"{lop}{s:04d}", "Họ và tên": f"Sinh Vien {s}",
+                     "Ngày sinh": "01/09/2004", "Nơi sinh": "Ha Noi"}
+                for i in range(N_HP):
+                    r[f"Học phần bench {i}"] = str(round(rnd.uniform(0, 10), 1))
+                rows.append(r)
+            pd.DataFrame(rows).to_excel(w, sheet_name=f"HK{hk}", index=False)
+    return buf.getvalue()
+
+
+def _parse_times(d: str, names: List[str]) -> List[float]:
+    from .upload_stream import read_sheets
+
+    out = []
+    for name in names:
+        t = time.perf_counter()
+        read_sheets(os.path.join(d, name), name)
+        out.append(time.perf_counter() - t)
+    return out
+
+
+# Mỗi cấu hình một tiến trình riêng (luồng nền audit/job của app không sống sang lần đo sau)
+def _run(workers: int, src: str, names: List[str], queue):
+    files = {}
+    for name in names:
+        with open(os.path.join(src, name), "rb") as fh:
+            files[name] = fh.read()
+    with tempfile.TemporaryDirectory(prefix="bench-batch-") as d:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(d, 'bench.db')}"
+        os.environ["IMPORT_BATCH_WORKERS"] = str(workers)
+        os.environ["MIGRATIONS_BACKFILL"] = "inline"
+        os.environ.setdefault("GEMINI_API_KEY", "bench")
+        from .app import create_app
+        from .models import db, Khoa, NganhHoc, LopHoc, HocPhan
+        from . import seed, batch_import
+
+        app = create_app()
+        with app.app_context():
+            for r in ("Admin", "Cán bộ đào tạo", "Sinh viên"):
+                seed.ensure_role(r)
+            seed.ensure_user("bench", "Admin", "bench@bench.vn", "bench123")
+            db.session.add(Khoa(MaKhoa="BK", TenKhoa="Bench"))
+            db.session.add(NganhHoc(MaNganh="BN", TenNganh="Bench", MaKhoa="BK"))
+            for name in files:
+                lop = os.path.splitext(name)[0]
+                db.session.add(LopHoc(MaLop=lop, TenLop=lop, MaNganh="BN"))
+            for i in range(N_HP):
+                db.session.add(HocPhan(MaHP=f"BHP{i}", TenHP=f"Học phần bench {i}", SoTinChi=3, TinhDiemTichLuy=True))
+            db.session.commit()
+        client = app.test_client()
+        tok = client.post("/login", json={"username": "bench", "password": "bench123"}).get_json()["access_token"]
+        if workers:
+            with app.app_context():
+                # khởi động tiến trình con trước khi đo (chi phí một lần mỗi worker gunicorn)
+                batch_import.pool(app).submit(os.getpid).result()
+        t = time.perf_counter()
+        resp = client.post("/api/admin/import/grades/batch?preview=0&allow_update=1",
+                           headers={"Authorization": f"Bearer {tok}"},
+                           data={"files": [(io.BytesIO(b), n) for n, b in files.items()]},
+                           content_type="multipart/form-data")
+        wall = time.perf_counter() - t
+        assert resp.status_code == 200, resp.get_data(as_text=True)[:300]
+        ex = app.extensions.pop(batch_import._KEY, None)
+        if ex is not None:
+            ex.shutdown()
+        # dừng luồng nền trước khi xoá CSDL tạm
+        if app.extensions.get("audit_sink") is not None:
+            app.extensions["audit_sink"].close()
+        r = app.extensions.get("job_runner")
+        if r is not None:
+            r.stop()
+            for th in r._threads:
+                th.join(5)
+        with app.app_context():
+            db.engine.dispose()
+        queue.put({"wall": wall, "summary": resp.get_json()["summary"]})
+
+
+def _report(w: int, res: Dict):
+    s = res["summary"]
+    print(f"workers={w}: {res['wall']:.2f}s for {s['files']} files / {s['sheets']} sheets, "
+          f"{s['total_rows']} rows, {s['created']} grades created, failed {s['failed']}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=8)
+    ap.add_argument("--sheets", type=int, default=2)
+    ap.add_argument("--students", type=int, default=2000)
+    ap.add_argument("--workers", default="0,4")
+    args = ap.parse_args()
+    ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench-batch-") as d:
+        names = []
+        for c in range(args.files):
+            names.append(f"BB{c:02d}.xlsx")
+            with open(os.path.join(d, names[-1]), "wb") as fh:
+                fh.write(_workbook(f"BB{c:02d}", args.sheets, args.students, c))
+        parse = _parse_times(d, names)
+        print(f"read: slowest file {max(parse):.2f}s, sum {sum(parse):.2f}s ({os.cpu_count()} CPU)")
+        for w in [int(x) for x in args.workers.split(",") if x.strip()]:
+            queue = ctx.Queue()
+            p = ctx.Process(target=_run, args=(w, d, names, queue))
+            p.start()
+            res = queue.get()
+            p.join()
+            _report(w, res)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# backend/bench_import.py
+# Đo tốc độ nhập danh sách lớp (rows/sec) trên roster tổng hợp.
+#   python -m backend.bench_import --rows 5000 --modes deferred,pool
+from __future__ import annotations
+import argparse
+import io
+import time
+
+from flask import Flask
+
+from . import config_cache
+from .models import db, Khoa, NganhHoc, LopHoc, SinhVien, NguoiDung
+
+
+def _make_app(mode: str) -> Flask:
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["ACCOUNT_HASH_MODE"] = mode
+    db.init_app(app)
+    config_cache.init_app(app)
+    return app
+
+
+def _roster_csv(rows: int) -> bytes:
+    lines = ["Mã sinh viên,Họ và tên,Ngày sinh,Nơi sinh"]
+    for i in range(rows):
+        lines.append(f"BENCH{i:06d},Sinh Vien {i},01/09/2004,Ha Noi")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def run(rows: int, mode: str) -> float:
+    from .importer import import_class_roster
+
+    app = _make_app(mode)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Khoa(MaKhoa="BK", TenKhoa="Bench"))
+        db.session.add(NganhHoc(MaNganh="BN", TenNganh="Bench", MaKhoa="BK"))
+        db.session.add(LopHoc(MaLop="BENCH", TenLop="BENCH", MaNganh="BN"))
+        db.session.commit()
+
+    payload = _roster_csv(rows)
+    with app.test_request_context("/api/admin/import/class-roster", method="POST",
+                                  query_string={"lop": "BENCH"},
+                                  data={"file": (io.BytesIO(payload), "roster.csv")}):
+        t0 = time.perf_counter()
+        resp, code = import_class_roster(preview=False)
+        elapsed = time.perf_counter() - t0
+        summary = resp.get_json()["summary"]
+        assert code == 200, summary
+        assert db.session.query(SinhVien).count() == rows
+        assert db.session.query(NguoiDung).count() == rows
+    return elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--modes", default="deferred,pool")
+    args = ap.parse_args()
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        elapsed = run(args.rows, mode)
+        print(f"{mode:>9}: {args.rows} rows in {elapsed:.2f}s -> {args.rows / elapsed:,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# backend/bench_snapshot.py
+# Đo snapshot Parquet của kho điểm (services/grade_snapshot.py) trên CSDL SQLite tạm: thời gian dựng toàn
+# bộ, làm mới tăng dần sau khi điểm một lớp đổi, và hai câu hỏi tổng hợp (tỉ lệ trượt theo học phần/học
+# kỳ, phân bố GPA theo khoá) tính qua ORM từng dòng so với đọc snapshot.
+#   python -m backend.bench_snapshot --majors 4 --classes 5 --students 40 --courses 10 --terms 8
+from __future__ import annotations
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Tuple
+
+from sqlalchemy import insert, update
+
+
+def _seed(majors: int, classes: int, students: int, courses: int, terms: int) -> int:
+    from .models import db, Khoa, NganhHoc, LopHoc, HocPhan, NguoiDung, SinhVien, KetQuaHocTap
+    from . import seed
+
+    rnd = random.Random(1)
+    role = seed.ensure_role("Sinh viên")
+    db.session.execute(insert(Khoa), [{"MaKhoa": "BK", "TenKhoa": "Bench"}])
+    db.session.execute(insert(NganhHoc), [{"MaNganh": f"N{m}", "TenNganh": f"Ngành {m}", "MaKhoa": "BK"}
+                                          for m in range(majors)])
+    db.session.execute(insert(LopHoc), [{"MaLop": f"N{m}L{c}", "TenLop": f"N{m}L{c}", "MaNganh": f"N{m}",
+                                         "NamTuyenSinh": 2020 + c % 4} for m in range(majors) for c in range(classes)])
+    db.session.execute(insert(HocPhan), [{"MaHP": f"HP{i}", "TenHP": f"Học phần {i}", "SoTinChi": 2 + i % 3,
+                                          "TinhDiemTichLuy": True} for i in range(courses)])
+    svs = [(f"N{m}L{c}S{s:03d}", f"N{m}L{c}") for m in range(majors) for c in range(classes) for s in range(students)]
+    db.session.execute(insert(NguoiDung), [{"MaNguoiDung": i + 1, "TenDangNhap": sv, "MatKhauMaHoa": "x",
+                                            "Email": f"{sv}@bench.vn", "MaVaiTro": role}
+                                           for i, (sv, _) in enumerate(svs)])
+    db.session.execute(insert(SinhVien), [{"MaSV": sv, "HoTen": sv, "MaLop": lop, "MaNguoiDung": i + 1}
+                                          for i, (sv, lop) in enumerate(svs)])
+    rows = []
+    for sv, _ in svs:
+        for t in range(1, terms + 1):
+            for i in range(courses):
+                d = round(min(10.0, max(0.0, rnd.gauss(6.0, 2.0))), 1)
+                rows.append({"MaSV": sv, "MaHP": f"HP{i}", "HocKy": str(t), "DiemHe10": d,
+                             "DiemHe4": round(d * 0.4, 1), "LaDiemCuoiCung": True, "TinhDiemTichLuy": True})
+        if len(rows) >= 20000:
+            db.session.execute(insert(KetQuaHocTap), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(KetQuaHocTap), rows)
+    db.session.commit()
+    return len(svs)
+
+
+def _timed(fn: Callable) -> Tuple[float, object]:
+    t = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t, out
+
+
+# Cách làm hiện tại: nạp đối tượng ORM từng dòng rồi cộng dồn bằng Python
+def _orm_fail_rates():
+    from .models import db, KetQuaHocTap, HocPhan
+
+    acc = defaultdict(lambda: [0, 0])
+    for kq, hp in (db.session.query(KetQuaHocTap, HocPhan).join(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP)
+                   .filter(KetQuaHocTap.LaDiemCuoiCung.is_(True), HocPhan.TinhDiemTichLuy.is_(True))):
+        a = acc[(kq.MaHP, kq.HocKy)]
+        a[0] += 1
+        a[1] += kq.DiemHe10 < 4.0 or (kq.DiemChu or "") == "F"
+    return acc
+
+
+def _orm_gpa():
+    from .models import db, KetQuaHocTap, HocPhan, SinhVien, LopHoc
+
+    acc = defaultdict(lambda: [0.0, 0.0])
+    for kq, hp, sv, lop in (db.session.query(KetQuaHocTap, HocPhan, SinhVien, LopHoc)
+                            .join(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP)
+                            .join(SinhVien, SinhVien.MaSV == KetQuaHocTap.MaSV)
+                            .join(LopHoc, LopHoc.MaLop == SinhVien.MaLop)
+                            .filter(KetQuaHocTap.LaDiemCuoiCung.is_(True))):
+        a = acc[(lop.NamTuyenSinh, kq.MaSV)]
+        a[0] += (kq.DiemHe4 or 0.0) * hp.SoTinChi
+        a[1] += hp.SoTinChi
+    return acc
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--majors", type=int, default=4)
+    ap.add_argument("--classes", type=int, default=5)
+    ap.add_argument("--students", type=int, default=40)
+    ap.add_argument("--courses", type=int, default=10)
+    ap.add_argument("--terms", type=int, default=8)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory(prefix="bench-snapshot-") as d:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(d, 'bench.db')}"
+        os.environ["GRADE_SNAPSHOT_DIR"] = os.path.join(d, "snapshot")
+        os.environ["GRADE_SNAPSHOT_OVERLAP"] = "0"
+        os.environ["MIGRATIONS_BACKFILL"] = "inline"
+        os.environ.setdefault("GEMINI_API_KEY", "bench")
+        from .app import create_app
+        from .models import db, KetQuaHocTap, SinhVien
+        from .data_version import bump, sv_scope
+        from .services import grade_snapshot as gs
+
+        app = create_app()
+        with app.app_context():
+            n_sv = _seed(args.majors, args.classes, args.students, args.courses, args.terms)
+            n_kq = n_sv * args.courses * args.terms
+            db.session.commit()
+            t, res = _timed(lambda: gs.refresh(full=True))
+            st = gs.status()
+            db_bytes = os.path.getsize(os.path.join(d, "bench.db"))
+            print(f"{n_sv} students, {n_kq} grades; full build {t:.2f}s, {st['partitions']} partitions, "
+                  f"{st['bytes'] / 1e6:.1f} MB parquet (SQLite file {db_bytes / 1e6:.1f} MB)")
+
+            for name, orm, snap in (
+                    ("fail rates", _orm_fail_rates, lambda: gs.fail_rates(limit=10 ** 6)),
+                    ("gpa distribution", _orm_gpa, lambda: gs.gpa_distribution(by="NamTuyenSinh"))):
+                t_orm, _ = _timed(orm)
+                db.session.rollback()
+                t_snap, _ = _timed(snap)
+                print(f"{name}: ORM {t_orm:.3f}s, snapshot {t_snap:.3f}s ({t_orm / max(t_snap, 1e-9):.1f}x)")
+
+            lop = "N0L0"
+            masvs = [m for (m,) in db.session.query(SinhVien.MaSV).filter(SinhVien.MaLop == lop)]
+            db.session.execute(update(KetQuaHocTap).where(KetQuaHocTap.MaSV.in_(masvs), KetQuaHocTap.HocKy == "1")
+                               .values(DiemHe10=KetQuaHocTap.DiemHe10 * 0.5))
+            bump(sv_scope(m) for m in masvs)
+            db.session.commit()
+            t, res = _timed(gs.refresh)
+            print(f"incremental after one class/term changed: {t:.3f}s, {res['partitions']} partitions, "
+                  f"{res['rows']} rows rewritten")
+            t, res = _timed(gs.refresh)
+            print(f"refresh with no changes: {t * 1000:.1f}ms ({res['mode']})")
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
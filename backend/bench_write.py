@@ -0,0 +1,194 @@
+# backend/bench_write.py
+# Đo tranh chấp ghi trên SQLite: --workers tiến trình (như worker gunicorn) x --threads luồng cùng import
+# điểm, sửa lớp/sinh viên, đổi cấu hình và quét cảnh báo trên một file SQLite tạm, với từng chế độ
+# WRITE_GATE. In số thao tác lỗi (lỗi "database is locked" tính riêng), độ trễ theo loại thao tác và
+# phân vị thời gian chờ khoá của câu ghi đầu mỗi transaction (xem backend/write_gate.py).
+#   python -m backend.bench_write --workers 2 --threads 4 --seconds 20 --modes off,retry,gate
+from __future__ import annotations
+import argparse
+import io
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Sequence, Tuple
+
+OPS = {"import": 1, "class": 3, "student": 3, "config": 1, "scan": 1}
+N_HP = 10
+
+
+def _env(db_path: str, mode: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["WRITE_GATE"] = mode
+    os.environ["MIGRATIONS_BACKFILL"] = "inline"
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+
+def _pct(values: Sequence[float], p: int) -> float:
+    if not values:
+        return 0.0
+    v = sorted(values)
+    return v[min(len(v) - 1, len(v) * p // 100)]
+
+
+def _grades_xlsx(lop: str, students: int, seed: int) -> bytes:
+    import pandas as pd
+
+    rnd = random.Random(seed)
+    rows = []
+    for s in range(students):
+        r = {"STT": s + 1, "Mã sinh viên": f"{lop}{s:04d}", "Họ và tên": f"Sinh Vien {s}",
+             "Ngày sinh": "01/09/2004", "Nơi sinh": "Ha Noi"}
+        for i in range(N_HP):
+            r[f"Học phần bench {i}"] = str(round(rnd.uniform(0, 10), 1))
+        rows.append(r)
+    buf = io.BytesIO()
+    pd.DataFrame(rows).to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def _login(client) -> Dict[str, str]:
+    tok = client.post("/login", json={"username": "bench", "password": "bench123"}).get_json()["access_token"]
+    return {"Authorization": f"Bearer {tok}"}
+
+
+def _seed(db_path: str, mode: str, classes: int, students: int):
+    _env(db_path, mode)
+    from .app import create_app
+    from .models import db, Khoa, NganhHoc, LopHoc, HocPhan
+    from . import seed
+
+    app = create_app()
+    with app.app_context():
+        for r in ("Admin", "Cán bộ đào tạo", "Sinh viên"):
+            seed.ensure_role(r)
+        seed.ensure_user("bench", "Admin", "bench@bench.vn", "bench123")
+        seed.ensure_config("EMAIL_DOMAIN", "bench.vn")
+        seed.ensure_config("GPA_KHA_THRESHOLD", "2.5")
+        seed.ensure_warning_rule("GPA_BELOW", "GPA", 2.0)
+        seed.ensure_warning_rule("DEBT_OVER", "Debt", 10)
+        db.session.add(Khoa(MaKhoa="BK", TenKhoa="Bench"))
+        db.session.add(NganhHoc(MaNganh="BN", TenNganh="Bench", MaKhoa="BK"))
+        for c in range(classes):
+            db.session.add(LopHoc(MaLop=f"BW{c:02d}", TenLop=f"BW{c:02d}", MaNganh="BN"))
+        for i in range(N_HP):
+            db.session.add(HocPhan(MaHP=f"BHP{i}", TenHP=f"Học phần bench {i}", SoTinChi=3, TinhDiemTichLuy=True))
+        db.session.commit()
+    client = app.test_client()
+    h = _login(client)
+    for c in range(classes):
+        lop = f"BW{c:02d}"
+        resp = client.post(f"/api/admin/import/grades?lop={lop}&preview=0&allow_update=1", headers=h,
+                           data={"file": (io.BytesIO(_grades_xlsx(lop, students, c)), "g.xlsx")},
+                           content_type="multipart/form-data")
+        assert resp.status_code == 200, resp.get_data(as_text=True)[:300]
+    with app.app_context():
+        db.engine.dispose()
+
+
+def _thread(app, stop_at: float, classes: int, students: int, files: List[bytes], seed: int, out: List):
+    client = app.test_client()
+    h = _login(client)
+    rnd = random.Random(seed)
+    ops, weights = list(OPS), list(OPS.values())
+    while time.monotonic() < stop_at:
+        op = rnd.choices(ops, weights)[0]
+        c = rnd.randrange(classes)
+        lop = f"BW{c:02d}"
+        t = time.perf_counter()
+        if op == "import":
+            # force=1: cùng file được tải lại nhiều lần, không để bước chống import trùng bỏ qua
+            resp = client.post(f"/api/admin/import/grades?lop={lop}&preview=0&allow_update=1&force=1", headers=h,
+                               data={"file": (io.BytesIO(rnd.choice(files)), "g.xlsx")},
+                               content_type="multipart/form-data")
+        elif op == "class":
+            resp = client.put(f"/api/admin/classes/{lop}", headers=h, json={"TenLop": f"{lop} {rnd.random():.6f}"})
+        elif op == "student":
+            masv = f"{lop}{rnd.randrange(students):04d}"
+            resp = client.put(f"/api/admin/students/{masv}", headers=h, json={"HoTen": f"Sinh Vien {rnd.random():.6f}"})
+        elif op == "config":
+            resp = client.put("/api/admin/configs", headers=h,
+                              json={"values": {"GPA_KHA_THRESHOLD": rnd.choice(["2.5", "2.6"])}})
+        else:
+            resp = client.post("/api/admin/warning/scan", headers=h)
+        body = resp.get_data(as_text=True)
+        ok = resp.status_code < 400 and "Lỗi commit DB" not in body
+        out.append((op, time.perf_counter() - t, ok, "locked" in body))
+
+
+def _worker(db_path: str, mode: str, seconds: float, threads: int, classes: int, students: int,
+            idx: int, queue):
+    import threading
+    _env(db_path, mode)
+    from .app import create_app
+    from . import write_gate
+
+    app = create_app()
+    files = [_grades_xlsx(f"BW{c:02d}", students, 100 + idx * 10 + c) for c in range(classes)]
+    stop_at = time.monotonic() + seconds
+    records: List[Tuple] = []
+    ts = [threading.Thread(target=_thread, args=(app, stop_at, classes, students, files, idx * 100 + i, records))
+          for i in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    co = write_gate.coordinator(app)
+    queue.put((records, list(co.waits) if co else [], co.retries if co else 0))
+
+
+def run(mode: str, workers: int, threads: int, seconds: float, classes: int, students: int) -> Dict:
+    ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench-write-") as d:
+        db_path = os.path.join(d, "bench.db")
+        p = ctx.Process(target=_seed, args=(db_path, mode, classes, students))
+        p.start(); p.join()
+        if p.exitcode != 0:
+            raise RuntimeError("seed lỗi")
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(db_path, mode, seconds, threads, classes, students, i, queue))
+                 for i in range(workers)]
+        for p in procs:
+            p.start()
+        records, waits, retries = [], [], 0
+        for _ in procs:
+            r, w, n = queue.get()
+            records += r; waits += w; retries += n
+        for p in procs:
+            p.join()
+    return {"records": records, "waits": waits, "retries": retries}
+
+
+def report(mode: str, res: Dict, seconds: float):
+    records, waits = res["records"], res["waits"]
+    failed = sum(1 for r in records if not r[2])
+    locked = sum(1 for r in records if not r[2] and r[3])
+    print(f"\n== WRITE_GATE={mode}: {len(records)} ops ({len(records) / seconds:.1f}/s), "
+          f"failed {failed} (database is locked: {locked}), retries {res['retries']}")
+    print(f"   {'op':<8} {'n':>6} {'fail':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for op in OPS:
+        lat = [r[1] for r in records if r[0] == op]
+        fails = sum(1 for r in records if r[0] == op and not r[2])
+        print(f"   {op:<8} {len(lat):>6} {fails:>5} " + " ".join(
+            f"{_pct(lat, p) * 1000:>8.1f}" for p in (50, 95, 99)) + f" {max(lat, default=0) * 1000:>8.1f}")
+    print(f"   lock wait (first write of {len(waits)} transactions): " + ", ".join(
+        f"p{p} {_pct(waits, p) * 1000:.1f}" for p in (50, 95, 99)) + f", max {max(waits, default=0) * 1000:.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--seconds", type=float, default=20)
+    ap.add_argument("--classes", type=int, default=4)
+    ap.add_argument("--students", type=int, default=200)
+    ap.add_argument("--modes", default="off,retry,gate")
+    args = ap.parse_args()
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        res = run(mode, args.workers, args.threads, args.seconds, args.classes, args.students)
+        report(mode, res, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# backend/config_cache.py
+# SystemConfig đọc một lần cho mỗi tiến trình và parse sẵn thành kiểu (ngưỡng float, chính sách
+# thi lại...). Endpoint PUT /api/admin/configs gọi invalidate() sau commit; worker khác thấy thay
+# đổi qua phiên bản "config" của DataVersion (kiểm tra tối đa mỗi CONFIG_VERSION_TTL giây).
+from __future__ import annotations
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from flask import Flask, current_app
+
+from .data_version import CONFIG, VersionWatch
+from .models import db, SystemConfig
+
+
+RETAKE_POLICIES = ("keep-latest", "best")
+
+DEFAULTS = {
+    "EMAIL_DOMAIN": "vui.edu.vn",
+    "DEFAULT_MAJOR": "CNTT",
+    "GPA_GIOI_THRESHOLD": "3.2",
+    "GPA_KHA_THRESHOLD": "2.5",
+    "GPA_TRUNGBINH_THRESHOLD": "2.0",
+    "TINCHI_NO_CANHCAO_THRESHOLD": "10",
+    "RETAKE_POLICY_DEFAULT": "keep-latest",
+}
+
+
+def _float(raw: Dict[str, str], key: str) -> float:
+    try:
+        return float(raw.get(key, DEFAULTS[key]))
+    except (TypeError, ValueError):
+        return float(DEFAULTS[key])
+
+
+@dataclass(frozen=True)
+class Settings:
+    values: Dict[str, str]           # ConfigKey -> ConfigValue như trong DB
+    descriptions: Dict[str, str]
+    email_domain: str
+    default_major: str
+    gpa_gioi: float
+    gpa_kha: float
+    gpa_warn: float                  # GPA_TRUNGBINH_THRESHOLD
+    debt_warn: float                 # TINCHI_NO_CANHCAO_THRESHOLD
+    retake_policy: str               # một trong RETAKE_POLICIES
+
+    @classmethod
+    def from_rows(cls, rows) -> "Settings":
+        raw = {k: v for k, v, _ in rows}
+        policy = (raw.get("RETAKE_POLICY_DEFAULT") or "").strip().lower()
+        return cls(
+            values=raw,
+            descriptions={k: d or "" for k, _, d in rows},
+            email_domain=(raw.get("EMAIL_DOMAIN") or DEFAULTS["EMAIL_DOMAIN"]).strip(),
+            default_major=(raw.get("DEFAULT_MAJOR") or DEFAULTS["DEFAULT_MAJOR"]).strip(),
+            gpa_gioi=_float(raw, "GPA_GIOI_THRESHOLD"),
+            gpa_kha=_float(raw, "GPA_KHA_THRESHOLD"),
+            gpa_warn=_float(raw, "GPA_TRUNGBINH_THRESHOLD"),
+            debt_warn=_float(raw, "TINCHI_NO_CANHCAO_THRESHOLD"),
+            retake_policy=policy if policy in RETAKE_POLICIES else DEFAULTS["RETAKE_POLICY_DEFAULT"],
+        )
+
+
+class ConfigCache:
+    def __init__(self, ttl: float = 1.0):
+        self.watch = VersionWatch(CONFIG, ttl)
+        self._snap: Optional[Tuple[int, Settings]] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Settings:
+        ver = self.watch.current()
+        snap = self._snap
+        if snap is None or snap[0] != ver:
+            with self._lock:
+                rows = db.session.query(SystemConfig.ConfigKey, SystemConfig.ConfigValue,
+                                        SystemConfig.Description).all()
+                snap = self._snap = (ver, Settings.from_rows(rows))
+        return snap[1]
+
+    def invalidate(self):
+        self._snap = None
+        self.watch.reset()
+
+
+def settings() -> Settings:
+    return current_app.extensions["config_cache"].get()
+
+
+def invalidate():
+    current_app.extensions["config_cache"].invalidate()
+
+
+def init_app(app: Flask):
+    app.config.setdefault("CONFIG_VERSION_TTL", float(os.getenv("CONFIG_VERSION_TTL", "1.0")))
+    app.extensions["config_cache"] = ConfigCache(ttl=app.config["CONFIG_VERSION_TTL"])
@@ -0,0 +1,153 @@
+# backend/data_version.py
+# Phiên bản dữ liệu theo phạm vi (bảng DataVersion), dùng chung giữa các worker:
+#   sv:<MaSV>          điểm / hồ sơ của một sinh viên
+#   user:<MaNguoiDung> tài khoản (Email)
+#   catalog            học phần, CTĐT, lớp, ngành, khoa
+#   config             SystemConfig
+#   global             tăng cùng mọi phạm vi khác (cache dữ liệu tổng hợp: dashboard...)
+# Ghi qua ORM được bắt tự động ở after_flush; đường ghi hàng loạt (insert/update Core,
+# query.delete) phải gọi bump() trong cùng transaction.
+from __future__ import annotations
+from datetime import datetime
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Set
+
+from flask import Flask
+from sqlalchemy import event, inspect, insert, select, update
+
+from .db_profile import upsert
+from .models import (
+    db, DataVersion, SinhVien, NguoiDung, KetQuaHocTap, HocPhan, ChuongTrinhDaoTao, LopHoc, NganhHoc, Khoa,
+    SystemConfig,
+)
+from .utils_import import chunked
+
+
+CATALOG = "catalog"
+CONFIG = "config"
+GLOBAL = "global"
+_CATALOG_MODELS = (HocPhan, ChuongTrinhDaoTao, LopHoc, NganhHoc, Khoa)
+_T = DataVersion.__table__
+
+
+def sv_scope(masv) -> str:
+    return f"sv:{masv}"
+
+
+def user_scope(uid) -> str:
+    return f"user:{uid}"
+
+
+# Số lần commit có tăng phiên bản trong tiến trình này; VersionWatch so với số này để thấy
+# ngay thay đổi của chính tiến trình mà không phải đọc DataVersion.
+_generation = 0
+_gen_lock = threading.Lock()
+_listeners: List[Callable[[], None]] = []
+
+
+# fn() chạy sau mỗi commit có tăng phiên bản (trong luồng đã commit): chỉ nên xếp việc, không truy vấn.
+def on_commit(fn: Callable[[], None]):
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def _bump(conn, scopes: Iterable[str]):
+    now = datetime.utcnow()
+    stmt = upsert(conn, _T, ["Scope"], set_={"Version": _T.c.Version + 1, "UpdatedAt": now})
+    for part in chunked(sorted(set(scopes) | {GLOBAL}), 500):
+        if stmt is not None:
+            conn.execute(stmt, [{"Scope": s, "Version": 1, "UpdatedAt": now} for s in part])
+            continue
+        conn.execute(update(_T).where(_T.c.Scope.in_(part))
+                     .values(Version=_T.c.Version + 1, UpdatedAt=now))
+        have = {s for (s,) in conn.execute(select(_T.c.Scope).where(_T.c.Scope.in_(part)))}
+        missing = [{"Scope": s, "Version": 1, "UpdatedAt": now} for s in part if s not in have]
+        if missing:
+            conn.execute(insert(_T), missing)
+
+
+# Gọi trong transaction ghi; không commit.
+def bump(scopes: Iterable[str]):
+    _bump(db.session.connection(), scopes)
+    db.session.info["dv_bumped"] = True
+
+
+# Phạm vi chưa từng thay đổi có phiên bản 0
+def versions(scopes: Iterable[str]) -> Dict[str, int]:
+    scopes = list(scopes)
+    out = dict.fromkeys(scopes, 0)
+    out.update(db.session.execute(
+        select(DataVersion.Scope, DataVersion.Version).where(DataVersion.Scope.in_(scopes))).all())
+    return out
+
+
+# Theo dõi phiên bản một phạm vi cho cache trong tiến trình: đọc lại DataVersion tối đa mỗi ttl giây
+# (thay đổi từ worker khác), hoặc ngay sau khi tiến trình này commit thay đổi.
+class VersionWatch:
+    def __init__(self, scope: str, ttl: float = 1.0):
+        self.scope = scope
+        self.ttl = ttl
+        self._state = (-1, -1, 0.0)        # (phiên bản, local_generation, lúc đọc)
+
+    def current(self) -> int:
+        v, gen, at = self._state
+        cur, now = _generation, time.monotonic()
+        if gen != cur or now - at > self.ttl:
+            v = versions([self.scope])[self.scope]
+            self._state = (v, cur, now)
+        return v
+
+    def reset(self):
+        self._state = (-1, -1, 0.0)
+
+
+def _scopes_of(obj, deleted: bool) -> Set[str]:
+    if isinstance(obj, (SinhVien, KetQuaHocTap)):
+        return {sv_scope(obj.MaSV)}
+    if isinstance(obj, _CATALOG_MODELS):
+        return {CATALOG}
+    if isinstance(obj, SystemConfig):
+        return {CONFIG}
+    if isinstance(obj, NguoiDung) and obj.MaNguoiDung is not None:
+        if deleted or inspect(obj).attrs.Email.history.has_changes():
+            return {user_scope(obj.MaNguoiDung)}
+    return set()
+
+
+def _after_flush(session, _ctx):
+    scopes: Set[str] = set()
+    for obj in session.new:
+        scopes |= _scopes_of(obj, False)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            scopes |= _scopes_of(obj, False)
+    for obj in session.deleted:
+        scopes |= _scopes_of(obj, True)
+    if scopes:
+        _bump(session.connection(), scopes)
+        session.info["dv_bumped"] = True
+
+
+def _after_commit(session):
+    global _generation
+    if not session.info.pop("dv_bumped", False):
+        return
+    with _gen_lock:
+        _generation += 1
+    for fn in list(_listeners):
+        try:
+            fn()
+        except Exception:
+            pass
+
+
+def _after_rollback(session):
+    session.info.pop("dv_bumped", None)
+
+
+def init_app(app: Flask):
+    for name, fn in (("after_flush", _after_flush), ("after_commit", _after_commit),
+                     ("after_rollback", _after_rollback)):
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
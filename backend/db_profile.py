@@ -0,0 +1,134 @@
+# backend/db_profile.py
+# Chọn CSDL theo môi trường: DATABASE_URL (vd. postgresql://user:pw@host:5432/qldiem) hoặc mặc định
+# SQLite backend/app.db (WAL, pragma đặt ở app._set_sqlite_pragmas). SQLALCHEMY_ENGINE_OPTIONS theo dialect:
+#   - sqlite:     connect_args timeout=30 (chờ khoá ghi thay vì lỗi ngay; write_gate hạ xuống khi có thử lại);
+#   - postgresql: pool DB_POOL_SIZE + DB_MAX_OVERFLOW kết nối, pool_pre_ping (bỏ kết nối chết sau khi
+#     server khởi động lại), pool_recycle, statement_timeout/lock_timeout cho mỗi phiên để một truy vấn
+#     hỏng không giữ kết nối và khoá vô hạn. Migration tạo chỉ mục tự tắt statement_timeout.
+# upsert(): INSERT ... ON CONFLICT của SQLite/PostgreSQL (một câu cho cả lô, không đua khi nhiều worker
+# cùng chèn một khoá); dialect khác trả None để nơi gọi dùng đường select-rồi-ghi.
+#   python -m backend.db_profile         (in cấu hình đang dùng và kiểm tra kết nối)
+from __future__ import annotations
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional
+
+import sqlalchemy as sa
+from flask import Flask
+from sqlalchemy.engine import make_url
+
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+POOL_TIMEOUT = 30
+POOL_RECYCLE = 1800
+STATEMENT_TIMEOUT_MS = 60_000
+LOCK_TIMEOUT_MS = 15_000
+APPLICATION_NAME = "score-management"
+
+
+def database_uri(default_path: str) -> str:
+    url = (os.getenv("DATABASE_URL") or "").strip()
+    if not url:
+        return f"sqlite:///{default_path}"
+    if url.startswith("postgres://"):              # dạng cũ của Heroku/Render, SQLAlchemy không nhận
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(uri: str, config) -> Dict[str, Any]:
+    backend = make_url(uri).get_backend_name()
+    if backend == "sqlite":
+        return {"connect_args": {"timeout": 30}}
+    if backend == "postgresql":
+        options = (f"-c statement_timeout={int(config['DB_STATEMENT_TIMEOUT_MS'])} "
+                   f"-c lock_timeout={int(config['DB_LOCK_TIMEOUT_MS'])}")
+        return {
+            "pool_size": int(config["DB_POOL_SIZE"]),
+            "max_overflow": int(config["DB_MAX_OVERFLOW"]),
+            "pool_timeout": POOL_TIMEOUT,
+            "pool_recycle": POOL_RECYCLE,
+            "pool_pre_ping": True,
+            "connect_args": {"options": options, "application_name": APPLICATION_NAME, "connect_timeout": 10},
+        }
+    return {"pool_pre_ping": True}
+
+
+# Gọi trước db.init_app; giá trị đã đặt sẵn trong app.config (vd. test, bench) được giữ nguyên
+def configure(app: Flask, default_path: str):
+    app.config.setdefault("SQLALCHEMY_DATABASE_URI", database_uri(default_path))
+    app.config.setdefault("DB_POOL_SIZE", int(os.getenv("DB_POOL_SIZE", POOL_SIZE)))
+    app.config.setdefault("DB_MAX_OVERFLOW", int(os.getenv("DB_MAX_OVERFLOW", MAX_OVERFLOW)))
+    app.config.setdefault("DB_STATEMENT_TIMEOUT_MS", int(os.getenv("DB_STATEMENT_TIMEOUT_MS", STATEMENT_TIMEOUT_MS)))
+    app.config.setdefault("DB_LOCK_TIMEOUT_MS", int(os.getenv("DB_LOCK_TIMEOUT_MS", LOCK_TIMEOUT_MS)))
+    opts = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    for k, v in engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config).items():
+        if k == "connect_args":
+            opts["connect_args"] = {**v, **opts.get("connect_args", {})}
+        else:
+            opts.setdefault(k, v)
+
+
+def _insert_for(bind):
+    name = bind.dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+# INSERT vào `table`; trùng `keys` (khoá chính hoặc chỉ mục unique) thì cập nhật các cột `update`
+# bằng giá trị mới (hoặc biểu thức trong `set_`), không có cột nào thì bỏ qua dòng trùng.
+# Thực thi bằng execute(stmt, rows). None nếu dialect không hỗ trợ.
+def upsert(bind, table: sa.Table, keys: Iterable[str], update: Iterable[str] = (),
+           set_: Optional[Dict[str, Any]] = None):
+    insert = _insert_for(bind)
+    if insert is None:
+        return None
+    stmt = insert(table)
+    values = {c: stmt.excluded[c] for c in update}
+    values.update(set_ or {})
+    if not values:
+        return stmt.on_conflict_do_nothing(index_elements=list(keys))
+    return stmt.on_conflict_do_update(index_elements=list(keys), set_=values)
+
+
+# Tắt statement_timeout trong transaction hiện tại (tạo chỉ mục trên bảng lớn...); chỉ PostgreSQL
+def no_statement_timeout(conn):
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET LOCAL statement_timeout = 0")
+
+
+def describe(engine) -> List[str]:
+    url = engine.url
+    out = [f"dialect: {engine.dialect.name}+{engine.driver}",
+           f"database: {url.render_as_string(hide_password=True)}",
+           f"pool: {engine.pool.status()}"]
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            out.append("server: " + conn.exec_driver_sql("SHOW server_version").scalar())
+            for name in ("statement_timeout", "lock_timeout"):
+                out.append(f"{name}: " + conn.exec_driver_sql(f"SHOW {name}").scalar())
+        elif engine.dialect.name == "sqlite":
+            out.append("server: SQLite " + conn.exec_driver_sql("SELECT sqlite_version()").scalar())
+            out.append("journal_mode: " + conn.exec_driver_sql("PRAGMA journal_mode").scalar())
+    out.append(f"upsert: {'ON CONFLICT' if _insert_for(engine) else 'select-then-write'}")
+    return out
+
+
+def main(argv: List[str]) -> int:
+    from .app import create_app
+    from .models import db
+
+    os.environ.setdefault("MIGRATIONS_BACKFILL", "off")
+    app = create_app()
+    with app.app_context():
+        for line in describe(db.engine):
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
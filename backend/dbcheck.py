@@ -0,0 +1,250 @@
+# backend/dbcheck.py
+# Chạy các đường ghi phụ thuộc dialect (INSERT ... ON CONFLICT, UPDATE ... FROM/RETURNING) trên CSDL thật,
+# mỗi dialect một CSDL tạm tạo mới rồi xoá, trong tiến trình con riêng (create_app đọc DATABASE_URL):
+#   - sqlite: file tạm;
+#   - postgresql: CREATE DATABASE dbcheck_<pid> trên server của URL (cần quyền CREATEDB), không đụng
+#     tới CSDL trong URL.
+# Các bước: upsert_grades (chèn, cập nhật, trùng khoá trong lô, allow_update=False), resolve_retakes
+# (HocKy "9"/"10", best, changed), bump DataVersion (kể cả nhiều luồng cùng bump một phạm vi mới),
+# WarningDirty (mark_dirty/mark_all_dirty), save_aliases (alias manual có sẵn được giữ).
+#   python -m backend.dbcheck                     (SQLite, thêm PostgreSQL nếu DATABASE_URL trỏ tới)
+#   python -m backend.dbcheck sqlite postgresql://user:pw@host:5432/qldiem
+# Mã thoát 1 nếu có bước không đạt.
+from __future__ import annotations
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+
+RACE_THREADS = 4
+RACE_BUMPS = 10
+
+
+def _expect(cond: bool, msg: str):
+    if not cond:
+        raise AssertionError(msg)
+
+
+def _seed():
+    from .models import db, Khoa, NganhHoc, LopHoc, HocPhan, NguoiDung, SinhVien
+    from . import seed
+
+    role = seed.ensure_role("Sinh viên")
+    db.session.add(Khoa(MaKhoa="K", TenKhoa="Khoa"))
+    db.session.add(NganhHoc(MaNganh="N", TenNganh="Ngành", MaKhoa="K"))
+    db.session.add(LopHoc(MaLop="L", TenLop="Lớp", MaNganh="N"))
+    for i, ten in enumerate(("Nhập môn lập trình", "Cấu trúc dữ liệu", "Cơ sở dữ liệu"), 1):
+        db.session.add(HocPhan(MaHP=f"HP{i}", TenHP=ten, SoTinChi=3, TinhDiemTichLuy=True))
+    db.session.flush()
+    for i in range(1, 4):
+        u = NguoiDung(TenDangNhap=f"SV{i}", MatKhauMaHoa="x", Email=f"sv{i}@dbcheck", MaVaiTro=role)
+        db.session.add(u)
+        db.session.flush()
+        db.session.add(SinhVien(MaSV=f"SV{i}", HoTen=f"Sinh viên {i}", MaLop="L", MaNguoiDung=u.MaNguoiDung))
+    db.session.commit()
+
+
+def _grade(masv: str, mahp: str, hoc_ky: str, d10: float):
+    return {"MaSV": masv, "MaHP": mahp, "HocKy": hoc_ky, "DiemHe10": d10, "DiemHe4": round(d10 * 0.4, 1),
+            "DiemChu": None, "TinhDiemTichLuy": True}
+
+
+def _rows(masv: str):
+    from .models import db, KetQuaHocTap
+
+    return {(k.MaHP, k.HocKy): k for k in db.session.query(KetQuaHocTap).filter(KetQuaHocTap.MaSV == masv)}
+
+
+def check_upsert_grades():
+    from .models import db
+    from .grade_writer import upsert_grades, PASSED, FAILED
+
+    res = upsert_grades([_grade("SV1", "HP1", "1", 5.0), _grade("SV1", "HP2", "1", 3.0),
+                         _grade("SV2", "HP1", "1", 7.0)])
+    db.session.commit()
+    _expect((res.inserted, res.updated, res.masvs) == (3, 0, {"SV1", "SV2"}), f"chèn mới: {res}")
+    # trùng khoá trong cùng lô: dòng sau thắng
+    upsert_grades([_grade("SV1", "HP1", "1", 8.0), _grade("SV1", "HP1", "1", 9.0), _grade("SV3", "HP1", "1", 6.0)])
+    db.session.commit()
+    db.session.expire_all()
+    sv1 = _rows("SV1")
+    _expect(len(sv1) == 2 and sv1[("HP1", "1")].DiemHe10 == 9.0, "cập nhật/trùng khoá trong lô")
+    _expect(sv1[("HP1", "1")].KetQua == PASSED and sv1[("HP2", "1")].KetQua == FAILED, "KetQua")
+    res = upsert_grades([_grade("SV1", "HP1", "1", 1.0), _grade("SV2", "HP2", "1", 4.0)], allow_update=False)
+    db.session.commit()
+    db.session.expire_all()
+    _expect((res.inserted, res.skipped) == (1, 1), f"allow_update=False: {res}")
+    _expect(_rows("SV1")[("HP1", "1")].DiemHe10 == 9.0, "allow_update=False vẫn ghi đè")
+
+
+def check_resolve_retakes():
+    from .models import db
+    from .grade_writer import upsert_grades, resolve_retakes
+
+    upsert_grades([_grade("SV3", "HP2", "9", 8.0), _grade("SV3", "HP2", "10", 5.0)])
+    db.session.commit()
+    changed = set()
+    n = resolve_retakes("keep-latest", ["SV3"], changed=changed)
+    db.session.commit()
+    db.session.expire_all()
+    rows = _rows("SV3")
+    _expect(n == 1 and changed == {"SV3"}, f"keep-latest: {n} dòng, {changed}")
+    _expect(rows[("HP2", "10")].LaDiemCuoiCung and not rows[("HP2", "9")].LaDiemCuoiCung, "HocKy 10 sau 9")
+    _expect(resolve_retakes("keep-latest", ["SV3"]) == 0, "chạy lại phải không đổi gì")
+    changed = set()
+    n = resolve_retakes("best", None, changed=changed)
+    db.session.commit()
+    db.session.expire_all()
+    rows = _rows("SV3")
+    _expect(n == 2 and changed == {"SV3"}, f"best (cả CSDL): {n} dòng, {changed}")
+    _expect(rows[("HP2", "9")].LaDiemCuoiCung and not rows[("HP2", "10")].LaDiemCuoiCung, "best chọn 8.0")
+
+
+def check_data_version():
+    from flask import current_app
+    from .models import db
+    from .data_version import GLOBAL, bump, sv_scope, versions
+
+    scopes = [sv_scope("SV1"), sv_scope("SV2"), "dbcheck:new", GLOBAL]
+    before = versions(scopes)
+    bump(scopes[:1])
+    db.session.commit()
+    bump(scopes[:3])
+    db.session.commit()
+    got = versions(scopes)
+    _expect([got[s] - before[s] for s in scopes] == [2, 1, 1, 2] and got["dbcheck:new"] == 1, f"bump: {got}")
+
+    # nhiều phiên cùng chèn một phạm vi chưa có: ON CONFLICT, không lỗi trùng khoá
+    app, errors = current_app._get_current_object(), []
+
+    def worker():
+        with app.app_context():
+            try:
+                for _ in range(RACE_BUMPS):
+                    bump(["dbcheck:race"])
+                    db.session.commit()
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(RACE_THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    got = versions(["dbcheck:race"])["dbcheck:race"]
+    _expect(not errors and got == RACE_THREADS * RACE_BUMPS, f"bump đồng thời: {got}, {errors[:2]}")
+
+
+def check_warning_dirty():
+    from .models import db, SinhVien, WarningDirty
+    from .warning_scan import mark_dirty, mark_all_dirty
+
+    mark_dirty(["SV1", "SV2"])
+    db.session.commit()
+    first = db.session.get(WarningDirty, "SV1").MarkedAt
+    mark_dirty(["SV1", None])
+    db.session.commit()
+    db.session.expire_all()
+    _expect(db.session.query(WarningDirty).count() == 2, "mark_dirty trùng MaSV")
+    _expect(db.session.get(WarningDirty, "SV1").MarkedAt >= first, "MarkedAt không được cập nhật")
+    mark_all_dirty()
+    db.session.commit()
+    _expect(db.session.query(WarningDirty).count() == db.session.query(SinhVien).count(), "mark_all_dirty")
+
+
+def check_save_aliases():
+    from .models import db, SubjectAlias
+    from .subject_resolver import save_aliases
+
+    now = datetime.utcnow()
+    db.session.add(SubjectAlias(Alias="nhap mon", MaHP="HP1", Source="manual", CreatedAt=now))
+    db.session.commit()
+    rows = [{"Alias": "nhap mon", "MaHP": "HP2", "Source": "fuzzy", "Score": 0.9, "CreatedAt": now},
+            {"Alias": "ctdl", "MaHP": "HP2", "Source": "fuzzy", "Score": 0.8, "CreatedAt": now}]
+    save_aliases(rows)
+    db.session.commit()
+    save_aliases(rows)
+    db.session.commit()
+    db.session.expire_all()
+    kept = db.session.get(SubjectAlias, "nhap mon")
+    _expect((kept.MaHP, kept.Source) == ("HP1", "manual"), "alias manual bị ghi đè")
+    _expect(db.session.get(SubjectAlias, "ctdl") is not None, "alias mới không được lưu")
+
+
+CHECKS: List[Tuple[str, Callable[[], None]]] = [
+    ("upsert_grades", check_upsert_grades),
+    ("resolve_retakes", check_resolve_retakes),
+    ("data_version", check_data_version),
+    ("warning_dirty", check_warning_dirty),
+    ("save_aliases", check_save_aliases),
+]
+
+
+# Tiến trình con: DATABASE_URL đã trỏ tới CSDL tạm
+def _run() -> int:
+    from .app import create_app
+    from .models import db
+    from .db_profile import describe
+
+    app = create_app()
+    failed = 0
+    with app.app_context():
+        print(describe(db.engine)[0])
+        _seed()
+        for name, fn in CHECKS:
+            try:
+                fn()
+                print(f"  ok   {name}")
+            except Exception as e:
+                db.session.rollback()
+                failed += 1
+                print(f"  FAIL {name}: {e}")
+        app.extensions["job_runner"].stop()
+        db.session.remove()
+        db.engine.dispose()
+    return 1 if failed else 0
+
+
+def _child(url: str) -> int:
+    env = dict(os.environ, DATABASE_URL=url, MIGRATIONS_BACKFILL="inline")
+    env.setdefault("GEMINI_API_KEY", "dbcheck")
+    return subprocess.run([sys.executable, "-m", __spec__.name, "--run"], env=env).returncode
+
+
+def check_target(target: str) -> int:
+    if target == "sqlite":
+        with tempfile.TemporaryDirectory(prefix="dbcheck-") as d:
+            return _child(f"sqlite:///{os.path.join(d, 'dbcheck.db')}")
+    url = make_url(target.replace("postgres://", "postgresql://", 1))
+    name = f"dbcheck_{os.getpid()}"
+    admin = sa.create_engine(url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.exec_driver_sql(f'CREATE DATABASE "{name}"')
+    try:
+        return _child(url.set(database=name).render_as_string(hide_password=False))
+    finally:
+        with admin.connect() as conn:
+            conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{name}"')
+        admin.dispose()
+
+
+def main(argv: List[str]) -> int:
+    if argv == ["--run"]:
+        return _run()
+    targets = argv or ["sqlite"]
+    url = (os.getenv("DATABASE_URL") or "").strip()
+    if not argv and url and not url.startswith("sqlite"):
+        targets.append(url)
+    failed = sum(check_target(t) != 0 for t in targets)
+    print(f"dbcheck: {len(targets) - failed}/{len(targets)} dialects ok")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,209 @@
+# backend/exporter.py
+# Xuất dữ liệu theo luồng: mỗi bộ dữ liệu (EXPORTS) là một câu select các cột + bộ lọc từ query string.
+# Dòng được đọc bằng yield_per (SQLite đọc dần theo cursor, CSDL khác dùng server-side cursor), không
+# nạp đối tượng ORM nên bộ nhớ không tăng theo số dòng:
+#   - CSV: generator trả từng khối ~FLUSH_ROWS dòng, gửi cho client ngay khi đọc;
+#   - XLSX: xlsx_stream nén sheet XML theo luồng, cũng gửi dần (openpyxl write_only phải ghi xong cả
+#     file mới gửi được byte đầu: ~7 phút với 2 triệu dòng điểm).
+from __future__ import annotations
+import csv
+import io
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Sequence, Tuple
+
+from flask import Response, stream_with_context
+from sqlalchemy import select
+
+from .xlsx_stream import iter_xlsx
+from .models import (
+    db, SinhVien, LopHoc, NganhHoc, HocPhan, KetQuaHocTap, WarningRule, WarningCase, ImportLog,
+)
+
+
+YIELD_ROWS = 2000
+FLUSH_ROWS = 1000
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class ExportError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Dataset:
+    filename: str
+    columns: Sequence[Tuple[str, Any]]                     # (tiêu đề, biểu thức cột)
+    build: Callable[[Any, Mapping[str, str]], Any]        # (select, args) -> select đã lọc/sắp xếp
+
+    def statement(self, args: Mapping[str, str]):
+        stmt = select(*(col.label(f"c{i}") for i, (_, col) in enumerate(self.columns)))
+        return self.build(stmt, args)
+
+    @property
+    def header(self) -> List[str]:
+        return [h for h, _ in self.columns]
+
+
+def _arg(args: Mapping[str, str], name: str) -> str:
+    return (args.get(name) or "").strip()
+
+
+# "YYYY-MM-DD" hoặc ISO datetime; until chỉ có ngày thì lấy hết ngày đó
+def _range(stmt, col, args: Mapping[str, str]):
+    for name in ("since", "until"):
+        s = _arg(args, name)
+        if not s:
+            continue
+        try:
+            t = datetime.fromisoformat(s)
+        except ValueError:
+            raise ExportError(f"{name} không hợp lệ (YYYY-MM-DD): {s}")
+        if name == "since":
+            stmt = stmt.where(col >= t)
+        elif len(s) == 10:
+            stmt = stmt.where(col < t + timedelta(days=1))
+        else:
+            stmt = stmt.where(col <= t)
+    return stmt
+
+
+def _students(stmt, args):
+    stmt = (stmt.select_from(SinhVien)
+            .outerjoin(LopHoc, LopHoc.MaLop == SinhVien.MaLop)
+            .outerjoin(NganhHoc, NganhHoc.MaNganh == LopHoc.MaNganh))
+    if lop := _arg(args, "lop"):
+        stmt = stmt.where(SinhVien.MaLop == lop)
+    if nganh := _arg(args, "nganh"):
+        stmt = stmt.where(LopHoc.MaNganh == nganh)
+    return stmt.order_by(SinhVien.MaSV)
+
+
+# Bảng điểm: thứ tự (MaSV, MaHP, HocKy) theo chỉ mục duy nhất nên SQLite không phải sắp xếp 2 triệu dòng
+def _grades(stmt, args):
+    stmt = (stmt.select_from(KetQuaHocTap)
+            .join(SinhVien, SinhVien.MaSV == KetQuaHocTap.MaSV)
+            .outerjoin(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP))
+    if masv := _arg(args, "masv"):
+        stmt = stmt.where(KetQuaHocTap.MaSV == masv)
+    if lop := _arg(args, "lop"):
+        stmt = stmt.where(SinhVien.MaLop == lop)
+    if nganh := _arg(args, "nganh"):
+        stmt = stmt.where(SinhVien.MaLop.in_(select(LopHoc.MaLop).where(LopHoc.MaNganh == nganh)))
+    if mahp := _arg(args, "mahp"):
+        stmt = stmt.where(KetQuaHocTap.MaHP == mahp)
+    if hocky := _arg(args, "hocky"):
+        stmt = stmt.where(KetQuaHocTap.HocKy == hocky)
+    if _arg(args, "final") in ("1", "true"):
+        stmt = stmt.where(KetQuaHocTap.LaDiemCuoiCung == True)
+    return stmt.order_by(KetQuaHocTap.MaSV, KetQuaHocTap.MaHP, KetQuaHocTap.HocKy)
+
+
+def _warning_cases(stmt, args):
+    stmt = (stmt.select_from(WarningCase)
+            .join(WarningRule, WarningRule.Id == WarningCase.RuleId)
+            .outerjoin(SinhVien, SinhVien.MaSV == WarningCase.MaSV))
+    if status := _arg(args, "status"):
+        stmt = stmt.where(WarningCase.Status == status)
+    if rule := _arg(args, "rule"):
+        stmt = stmt.where(WarningRule.Code == rule)
+    if masv := _arg(args, "masv"):
+        stmt = stmt.where(WarningCase.MaSV == masv)
+    if lop := _arg(args, "lop"):
+        stmt = stmt.where(SinhVien.MaLop == lop)
+    return _range(stmt, WarningCase.CreatedAt, args).order_by(WarningCase.Id)
+
+
+# Không xuất Params: có thể chứa body của request (kể cả mật khẩu đăng nhập)
+def _import_logs(stmt, args):
+    stmt = stmt.select_from(ImportLog)
+    if endpoint := _arg(args, "endpoint"):
+        stmt = stmt.where(ImportLog.Endpoint.contains(endpoint, autoescape=True))
+    if actor := _arg(args, "actor"):
+        stmt = stmt.where(ImportLog.Actor == actor)
+    return _range(stmt, ImportLog.When, args).order_by(ImportLog.RunId)
+
+
+EXPORTS: Dict[str, Dataset] = {
+    "students": Dataset("students", [
+        ("MaSV", SinhVien.MaSV), ("HoTen", SinhVien.HoTen),
+        ("Lop", LopHoc.TenLop), ("Nganh", NganhHoc.TenNganh),
+    ], _students),
+    "grades": Dataset("grades", [
+        ("MaSV", KetQuaHocTap.MaSV), ("HoTen", SinhVien.HoTen), ("MaLop", SinhVien.MaLop),
+        ("HocKy", KetQuaHocTap.HocKy), ("MaHP", KetQuaHocTap.MaHP), ("TenHP", HocPhan.TenHP),
+        ("SoTinChi", HocPhan.SoTinChi), ("DiemHe10", KetQuaHocTap.DiemHe10),
+        ("DiemHe4", KetQuaHocTap.DiemHe4), ("DiemChu", KetQuaHocTap.DiemChu),
+        ("LaDiemCuoiCung", KetQuaHocTap.LaDiemCuoiCung),
+        ("TinhDiemTichLuy", KetQuaHocTap.TinhDiemTichLuy),
+    ], _grades),
+    "warning-cases": Dataset("warning_cases", [
+        ("Id", WarningCase.Id), ("MaSV", WarningCase.MaSV), ("HoTen", SinhVien.HoTen),
+        ("MaLop", SinhVien.MaLop), ("RuleCode", WarningRule.Code), ("RuleName", WarningRule.Name),
+        ("Threshold", WarningRule.Threshold), ("Value", WarningCase.Value), ("Level", WarningCase.Level),
+        ("Status", WarningCase.Status), ("CreatedAt", WarningCase.CreatedAt),
+        ("ClosedAt", WarningCase.ClosedAt),
+    ], _warning_cases),
+    "import-logs": Dataset("import_logs", [
+        ("RunId", ImportLog.RunId), ("When", ImportLog.When), ("Actor", ImportLog.Actor),
+        ("Endpoint", ImportLog.Endpoint), ("Filename", ImportLog.Filename),
+        ("AffectedTable", ImportLog.AffectedTable), ("Summary", ImportLog.Summary),
+    ], _import_logs),
+}
+
+
+def dataset(name: str) -> Dataset:
+    ds = EXPORTS.get(name)
+    if ds is None:
+        raise ExportError(f"Không có bộ dữ liệu '{name}' (có: {', '.join(EXPORTS)})")
+    return ds
+
+
+def iter_rows(ds: Dataset, args: Mapping[str, str]) -> Iterator[Tuple]:
+    result = db.session.execute(ds.statement(args).execution_options(yield_per=YIELD_ROWS))
+    try:
+        for row in result:
+            yield tuple(row)
+    finally:
+        result.close()
+
+
+def _csv_cell(v):
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ", timespec="seconds")
+    return v
+
+
+def csv_chunks(header: Sequence[str], rows: Iterable[Sequence], bom: bool = False) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    if bom:
+        buf.write("\ufeff")
+    w.writerow(header)
+    n = 0
+    for row in rows:
+        w.writerow([_csv_cell(v) for v in row])
+        n += 1
+        if n % FLUSH_ROWS == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0); buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def export_response(name: str, fmt: str, args: Mapping[str, str]) -> Response:
+    ds = dataset(name)
+    stmt_args = dict(args)
+    ds.statement(stmt_args)                  # kiểm tra bộ lọc trước khi gửi header
+    disposition = {"Content-Disposition": f"attachment; filename={ds.filename}.{fmt}"}
+    if fmt == "csv":
+        bom = _arg(stmt_args, "bom") in ("1", "true")
+        body = stream_with_context(csv_chunks(ds.header, iter_rows(ds, stmt_args), bom=bom))
+        return Response(body, mimetype="text/csv", headers=disposition)
+    if fmt == "xlsx":
+        body = stream_with_context(iter_xlsx(ds.header, iter_rows(ds, stmt_args), title=ds.filename))
+        return Response(body, mimetype=XLSX_MIME, headers=disposition)
+    raise ExportError(f"Định dạng không hỗ trợ: {fmt}")
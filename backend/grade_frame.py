@@ -0,0 +1,46 @@
+# backend/grade_frame.py
+from __future__ import annotations
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+# Ngưỡng hệ 10 -> (điểm chữ, hệ 4); cùng bảng với quy chế đào tạo tín chỉ.
+GRADE_BINS = np.array([4.0, 4.8, 5.5, 6.3, 7.0, 7.8, 8.5])
+GRADE_LETTERS = np.array(["F", "D", "D+", "C", "C+", "B", "B+", "A"], dtype=object)
+GRADE_HE4 = np.array([0.0, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0])
+
+
+def parse_scores(raw: pd.Series) -> pd.Series:
+    # Tương đương _num_2: đổi ',' -> '.', bỏ ký tự lạ, làm tròn ROUND_HALF_UP 2 chữ số.
+    s = raw.astype(str).str.strip().str.replace(",", ".", regex=False)
+    s = s.str.replace(r"[^0-9.\-]", "", regex=True)
+    v = pd.to_numeric(s, errors="coerce")
+    return np.sign(v) * np.floor(np.abs(v) * 100 + 0.5 + 1e-9) / 100
+
+
+def grade_letters(v: np.ndarray):
+    idx = np.digitize(v, GRADE_BINS)
+    return GRADE_LETTERS[idx], GRADE_HE4[idx]
+
+
+# Chuyển khối điểm WIDE sang TALL: một dòng cho mỗi ô điểm khác rỗng của các dòng row_mask.
+# Cột trả về: rowpos, rowno (số dòng Excel), colpos, col, raw, v (NaN nếu không đọc được);
+# sắp theo dòng rồi theo cột, đúng thứ tự khi duyệt tuần tự.
+def melt_wide(df: pd.DataFrame, row_mask: pd.Series, subject_cols: Sequence) -> pd.DataFrame:
+    cols: List = list(subject_cols)
+    if not cols or not row_mask.any():
+        return pd.DataFrame(columns=["rowpos", "rowno", "colpos", "col", "raw", "v"])
+
+    block = df.loc[row_mask, cols].copy()
+    block.columns = range(len(cols))
+    block["rowpos"] = np.flatnonzero(row_mask.to_numpy())
+    block["rowno"] = df.index[row_mask] + 2
+
+    long = block.melt(id_vars=["rowpos", "rowno"], var_name="colpos", value_name="raw")
+    long = long[long["raw"].notna()]
+    long["colpos"] = long["colpos"].astype(int)
+    long["col"] = [cols[i] for i in long["colpos"]]
+    long["v"] = parse_scores(long["raw"])
+    return long.sort_values(["rowpos", "colpos"], kind="stable").reset_index(drop=True)
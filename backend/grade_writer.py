@@ -0,0 +1,178 @@
+# backend/grade_writer.py
+from __future__ import annotations
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, func, insert, inspect, or_, select, update
+
+from .config_cache import RETAKE_POLICIES
+from .db_profile import upsert
+from .models import db, KetQuaHocTap
+from .utils_import import chunked
+
+
+GRADE_FIELDS = ("DiemHe10", "DiemHe4", "DiemChu", "TinhDiemTichLuy")
+PASS_LETTERS = ("A", "B+", "B", "C+", "C", "D+", "D", "P")
+PASSED, FAILED = "Đạt", "Không đạt"
+
+GradeKey = Tuple[str, str, str]
+_T = KetQuaHocTap.__table__
+_WRITE_FIELDS = GRADE_FIELDS + ("KetQua",)
+UNIQUE_INDEX = "ux_KetQuaHocTap_MaSV_MaHP_HocKy"
+_unique_ready: Set[str] = set()          # URL các CSDL đã có UNIQUE_INDEX
+
+
+@dataclass
+class UpsertResult:
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    masvs: Set[str] = field(default_factory=set)
+
+
+# Đạt nếu hệ 10 >= 4 hoặc điểm chữ đạt (P: học phần chỉ xét đạt/không đạt)
+def ket_qua(diem_he10, diem_chu) -> str:
+    return PASSED if (diem_he10 is not None and diem_he10 >= 4.0) or diem_chu in PASS_LETTERS else FAILED
+
+
+def ket_qua_sql():
+    return case((or_(KetQuaHocTap.DiemHe10 >= 4.0, KetQuaHocTap.DiemChu.in_(PASS_LETTERS)), PASSED),
+                else_=FAILED)
+
+
+def load_grade_index(masvs: Iterable[str]) -> Dict[GradeKey, int]:
+    index: Dict[GradeKey, int] = {}
+    for part in chunked(sorted(set(masvs)), 500):
+        stmt = (select(KetQuaHocTap.MaKQ, KetQuaHocTap.MaSV, KetQuaHocTap.MaHP, KetQuaHocTap.HocKy)
+                .where(KetQuaHocTap.MaSV.in_(part)))
+        for makq, masv, mahp, hk in db.session.execute(stmt):
+            index[(masv, mahp, hk)] = makq
+    return index
+
+
+# ON CONFLICT cần chỉ mục unique; CSDL cũ còn điểm trùng khoá thì chỉ mục chưa tạo được (xem migration
+# 0006_ketquahoctap_dedupe), khi đó upsert_grades đi đường select-rồi-ghi.
+def has_unique_index(conn) -> bool:
+    url = str(conn.engine.url)
+    if url in _unique_ready:
+        return True
+    if UNIQUE_INDEX not in {ix["name"] for ix in inspect(conn).get_indexes(_T.name)}:
+        return False
+    _unique_ready.add(url)
+    return True
+
+
+# records: dict có MaSV, MaHP, HocKy + các cột GRADE_FIELDS; bản ghi sau ghi đè bản ghi trước cùng khoá.
+# SQLite/PostgreSQL ghi cả lô bằng INSERT ... ON CONFLICT theo ux_KetQuaHocTap_MaSV_MaHP_HocKy: một câu
+# cho cả dòng mới lẫn dòng cũ, và hai lần import đua nhau cùng khoá không lỗi unique. Số đếm
+# inserted/updated tính theo chỉ mục đọc trước khi ghi.
+def upsert_grades(records: List[Dict[str, Any]], *, allow_update: bool = True,
+                  batch_size: int = 1000) -> UpsertResult:
+    res = UpsertResult()
+    if not records:
+        return res
+
+    index = load_grade_index(r["MaSV"] for r in records)
+    rows: Dict[GradeKey, Dict[str, Any]] = {}
+
+    for r in records:
+        key = (r["MaSV"], r["MaHP"], r["HocKy"])
+        values = {f: r.get(f) for f in GRADE_FIELDS}
+        values["KetQua"] = ket_qua(values["DiemHe10"], values["DiemChu"])
+        if key in index or key in rows:
+            if not allow_update:
+                res.skipped += 1
+                continue
+            res.updated += 1
+        else:
+            res.inserted += 1
+        rows.setdefault(key, {"MaSV": key[0], "MaHP": key[1], "HocKy": key[2], "LaDiemCuoiCung": True}).update(values)
+        res.masvs.add(key[0])
+
+    conn = db.session.connection()
+    stmt = upsert(conn, _T, ["MaSV", "MaHP", "HocKy"], _WRITE_FIELDS if allow_update else ())
+    if stmt is not None and has_unique_index(conn):
+        for part in chunked(list(rows.values()), batch_size):
+            db.session.execute(stmt, part)
+        return res
+
+    inserts = [v for k, v in rows.items() if k not in index]
+    updates = [{"MaKQ": index[k], **{f: v[f] for f in _WRITE_FIELDS}} for k, v in rows.items() if k in index]
+    for part in chunked(inserts, batch_size):
+        db.session.execute(insert(KetQuaHocTap), part)
+    for part in chunked(updates, batch_size):
+        db.session.execute(update(KetQuaHocTap), part)
+    return res
+
+
+# Học kỳ muộn hơn xếp trước; độ dài trước để "10" đứng trước "9" khi HocKy là số (t: bảng hoặc alias)
+def latest_first(t=_T):
+    return (func.length(t.c.HocKy).desc(), t.c.HocKy.desc(), t.c.MaKQ.desc())
+
+
+# LaDiemCuoiCung cho mỗi nhóm (MaSV, MaHP): dòng đứng đầu theo chính sách là điểm cuối cùng.
+#   keep-latest: lần học muộn nhất (HocKy, rồi MaKQ); best: DiemHe4 cao nhất, hoà thì lần muộn hơn.
+# Một câu UPDATE ... FROM (ROW_NUMBER) cho mỗi lô 500 sinh viên, chỉ ghi dòng có cờ thay đổi;
+# masvs=None: cả CSDL (sửa dữ liệu cũ). Không commit; trả về số dòng đã đổi cờ.
+# changed: nếu truyền vào thì nhận thêm MaSV có dòng đổi cờ (UPDATE ... RETURNING).
+def resolve_retakes(policy: str, masvs: Optional[Iterable[str]] = None,
+                    changed: Optional[Set[str]] = None) -> int:
+    if policy not in RETAKE_POLICIES:
+        raise ValueError(f"Chính sách thi lại không hợp lệ: {policy} (có: {', '.join(RETAKE_POLICIES)})")
+    order = latest_first()
+    if policy == "best":
+        order = (func.coalesce(_T.c.DiemHe4, 0.0).desc(), *order)
+    rn = func.row_number().over(partition_by=(_T.c.MaSV, _T.c.MaHP), order_by=order)
+
+    def run(part: Optional[List[str]]) -> int:
+        ranked = select(_T.c.MaKQ, rn.label("rn"))
+        if part is not None:
+            ranked = ranked.where(_T.c.MaSV.in_(part))
+        ranked = ranked.subquery()
+        final = case((ranked.c.rn == 1, True), else_=False)
+        where = (_T.c.MaKQ == ranked.c.MaKQ, _T.c.LaDiemCuoiCung != final)
+        stmt = (update(_T).where(*where).values(LaDiemCuoiCung=final)
+                .execution_options(synchronize_session=False))
+        if changed is None:
+            return db.session.execute(stmt).rowcount or 0
+        if db.session.get_bind().dialect.update_returning:
+            rows = db.session.execute(stmt.returning(_T.c.MaSV)).all()
+            changed.update(m for (m,) in rows)
+            return len(rows)
+        changed.update(db.session.execute(select(_T.c.MaSV).where(*where).distinct()).scalars())
+        return db.session.execute(stmt).rowcount or 0
+
+    if masvs is None:
+        return run(None)
+    return sum(run(part) for part in chunked(sorted({m for m in masvs if m}), 500))
+
+
+def main(argv: List[str]) -> int:
+    from .app import create_app
+    from .config_cache import settings
+    from .data_version import bump, sv_scope
+    from .services.student_aggregate import rebuild_all
+    from .warning_scan import mark_all_dirty
+
+    if argv and argv[0] != "retakes":
+        print("usage: python -m backend.grade_writer retakes [keep-latest|best]")
+        return 2
+    app = create_app()
+    with app.app_context():
+        policy = argv[1] if len(argv) > 1 else settings().retake_policy
+        masvs: Set[str] = set()
+        changed = resolve_retakes(policy, changed=masvs)
+        if changed:
+            # như import: cache theo sinh viên/toàn cục và quét cảnh báo phải thấy cờ mới
+            bump(sv_scope(m) for m in masvs)
+            mark_all_dirty()
+        db.session.commit()
+        print(f"{policy}: {changed} rows changed, {len(masvs)} students")
+        if changed:
+            print(f"StudentAggregate: {rebuild_all()} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
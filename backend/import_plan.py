@@ -0,0 +1,190 @@
+# backend/import_plan.py
+# Preview import không đụng session: importer parse file thành các lô dữ liệu cần ghi (steps), so với
+# snapshot chỉ đọc của các khoá liên quan (Diff: created/updated/unchanged/conflict + danh sách thay đổi
+# từng dòng) rồi trả kết quả; không tạo NguoiDung, không băm mật khẩu, không flush/rollback nên không
+# giữ khoá ghi. Kế hoạch được giữ trong PlanCache theo (loại import, SHA-256 file, tham số):
+#   - lần "xác nhận" (preview=0, cùng file và tham số) ghi thẳng các steps, bỏ qua bước parse;
+#   - kế hoạch ghi kèm phiên bản data_version của các phạm vi đã đọc (sv:<MaSV>, catalog, config) lúc
+#     chụp snapshot; có phạm vi đã đổi, quá IMPORT_PLAN_TTL giây hoặc khác worker thì import chạy lại từ đầu;
+#   - kế hoạch quá IMPORT_PLAN_MAX_ROWS dòng không được giữ (bộ nhớ), mỗi kế hoạch dùng một lần.
+from __future__ import annotations
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask, current_app
+
+from .data_version import versions
+from .utils_import import chunked
+
+MAX_CHANGES = 500
+PLAN_TTL = 900.0
+PLAN_CACHE_SIZE = 8
+PLAN_MAX_ROWS = 200_000
+
+Key = Tuple[Any, ...]
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, float) or isinstance(b, float):
+        if a is None or b is None:
+            return a is b
+        return math.isclose(float(a), float(b), abs_tol=1e-9)
+    return a == b
+
+
+def _plain(v):
+    return v.isoformat() if hasattr(v, "isoformat") else v
+
+
+ACTIONS = ("created", "updated", "unchanged", "conflict", "deleted")
+
+
+class Diff:
+    def __init__(self):
+        self.counts: Dict[str, Counter] = {}                  # bảng -> số dòng theo ACTIONS
+        self.changes: List[Dict[str, Any]] = []               # tối đa MAX_CHANGES dòng
+        self._seen: Dict[Tuple[str, Key], Tuple] = {}
+
+    def _count(self, table: str, action: str):
+        self.counts.setdefault(table, Counter())[action] += 1
+
+    def _note(self, action: str, table: str, key: Key, before, after):
+        if len(self.changes) < MAX_CHANGES:
+            self.changes.append({
+                "action": action, "table": table, "key": list(key),
+                "before": {k: _plain(v) for k, v in before.items()} if before is not None else None,
+                "after": {k: _plain(v) for k, v in after.items()} if after is not None else None,
+            })
+
+    def seen(self, table: str, key: Key) -> bool:
+        return (table, key) in self._seen
+
+    # before: giá trị trong snapshot (None nếu chưa có), after: giá trị sẽ ghi. Khoá lặp lại trong file
+    # với giá trị khác là conflict (dòng sau thắng như khi ghi); có thay đổi nhưng không cho cập nhật
+    # (allow_update=0) cũng là conflict. Trả về hành động đã tính ("duplicate": lặp lại y hệt).
+    def compare(self, table: str, key: Key, before: Optional[Dict[str, Any]], after: Dict[str, Any], *,
+                allow_update: bool = True) -> str:
+        sig = tuple(after.items())
+        prev = self._seen.get((table, key))
+        self._seen[(table, key)] = sig
+        if prev is not None:
+            if prev == sig:
+                return "duplicate"
+            self._count(table, "conflict")
+            self._note("conflict", table, key, dict(prev), after)
+            return "conflict"
+        if before is None:
+            self._count(table, "created")
+            self._note("create", table, key, None, after)
+            return "created"
+        changed = {k: v for k, v in after.items() if not _same(before.get(k), v)}
+        if not changed:
+            self._count(table, "unchanged")
+            return "unchanged"
+        old = {k: before.get(k) for k in changed}
+        if not allow_update:
+            self._count(table, "conflict")
+            self._note("conflict", table, key, old, changed)
+            return "conflict"
+        self._count(table, "updated")
+        self._note("update", table, key, old, changed)
+        return "updated"
+
+    def delete(self, table: str, key: Key, before: Dict[str, Any]):
+        self._count(table, "deleted")
+        self._note("delete", table, key, before, None)
+
+    def to_json(self) -> Dict[str, Any]:
+        total = {a: sum(c[a] for c in self.counts.values()) for a in ACTIONS}
+        noted = total["created"] + total["updated"] + total["conflict"] + total["deleted"]
+        return {**total, "tables": {t: {a: c[a] for a in ACTIONS} for t, c in self.counts.items()},
+                "changes": self.changes, "changes_truncated": noted > len(self.changes)}
+
+
+@dataclass
+class Plan:
+    kind: str
+    digest: str
+    params: Key
+    steps: List[Any] = field(default_factory=list)       # lô dữ liệu cần ghi, định dạng do importer quy định
+    scopes: Dict[str, int] = field(default_factory=dict)  # phạm vi data_version -> phiên bản lúc đọc
+    rows: int = 0
+    meta: Dict[str, Any] = field(default_factory=dict)   # summary/warnings... của lần parse
+    at: float = field(default_factory=time.monotonic)
+
+    # Gọi trước khi đọc snapshot của các phạm vi: thay đổi xảy ra sau đó làm kế hoạch hết hiệu lực
+    def watch(self, scopes: Iterable[str]):
+        todo = [s for s in dict.fromkeys(scopes) if s not in self.scopes]
+        for part in chunked(todo, 500):
+            self.scopes.update(versions(part))
+
+    def add(self, step, rows: int):
+        self.steps.append(step)
+        self.rows += rows
+
+    def fresh(self) -> bool:
+        items = list(self.scopes.items())
+        for part in chunked(items, 500):
+            now = versions(s for s, _ in part)
+            if any(now[s] != v for s, v in part):
+                return False
+        return True
+
+
+class PlanCache:
+    def __init__(self, size: int = PLAN_CACHE_SIZE, ttl: float = PLAN_TTL, max_rows: int = PLAN_MAX_ROWS):
+        self.size = size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._plans: "OrderedDict[Tuple[str, str, Key], Plan]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.stale = 0
+
+    def put(self, plan: Plan) -> bool:
+        if plan.rows > self.max_rows or self.size <= 0:
+            return False
+        with self._lock:
+            key = (plan.kind, plan.digest, plan.params)
+            self._plans.pop(key, None)
+            self._plans[key] = plan
+            while len(self._plans) > self.size:
+                self._plans.popitem(last=False)
+        return True
+
+    # Lấy (và bỏ khỏi cache) kế hoạch còn hiệu lực; None nếu không có, quá hạn hoặc dữ liệu đã đổi
+    def take(self, kind: str, digest: str, params: Key) -> Optional[Plan]:
+        with self._lock:
+            plan = self._plans.pop((kind, digest, params), None)
+        if plan is None or time.monotonic() - plan.at > self.ttl:
+            self.misses += 1
+            return None
+        if not plan.fresh():
+            self.stale += 1
+            return None
+        self.hits += 1
+        return plan
+
+    def stats(self) -> Dict[str, int]:
+        return {"plans": len(self._plans), "hits": self.hits, "misses": self.misses, "stale": self.stale}
+
+
+def plans(app: Optional[Flask] = None) -> PlanCache:
+    app = app or current_app
+    cache = app.extensions.get("import_plans")
+    if cache is None:
+        cache = app.extensions["import_plans"] = PlanCache()
+    return cache
+
+
+def init_app(app: Flask):
+    app.config.setdefault("IMPORT_PLAN_TTL", float(os.getenv("IMPORT_PLAN_TTL", PLAN_TTL)))
+    app.config.setdefault("IMPORT_PLAN_CACHE_SIZE", int(os.getenv("IMPORT_PLAN_CACHE_SIZE", PLAN_CACHE_SIZE)))
+    app.config.setdefault("IMPORT_PLAN_MAX_ROWS", int(os.getenv("IMPORT_PLAN_MAX_ROWS", PLAN_MAX_ROWS)))
+    if "import_plans" not in app.extensions:
+        app.extensions["import_plans"] = PlanCache(app.config["IMPORT_PLAN_CACHE_SIZE"], app.config["IMPORT_PLAN_TTL"],
+                                                   app.config["IMPORT_PLAN_MAX_ROWS"])
@@ -0,0 +1,122 @@
+# backend/import_runs.py
+# Chống import trùng và chạy tiếp import dở. Mỗi lần import thật (preview=0) là một dòng ImportLog với
+# ImportKey = SHA-256(loại import, SHA-256 file, tham số) và Status running/done/failed:
+#   - cùng file + cùng tham số đã import xong (done) thì trả lại summary cũ, không ghi gì; ?force=1 luôn
+#     tạo run mới và import lại từ đầu;
+#   - import lớn commit theo từng lô: dữ liệu của lô, Cursor (số dòng file đã xử lý) và summary tạm được
+#     ghi trong cùng transaction (checkpoint). Lô lỗi thì chỉ lô đó bị rollback, run chuyển failed và giữ
+#     Cursor; tải lại đúng file với cùng tham số thì chạy tiếp từ Cursor thay vì từ dòng đầu;
+#   - run đang chạy (UpdatedAt trong vòng IMPORT_RUN_STALE giây) thì lần tải trùng bị từ chối; quá hạn
+#     (tiến trình chết giữa chừng) thì được nhận lại như run failed.
+from __future__ import annotations
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import insert, select, update
+
+from .models import db, ImportLog
+
+RUN_STALE = 600.0
+_T = ImportLog.__table__
+
+
+def import_key(kind: str, digest: str, params) -> str:
+    raw = json.dumps([kind, digest, list(params)], ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _dump(summary: Dict[str, Any]) -> str:
+    return json.dumps(summary, ensure_ascii=False, default=str)
+
+
+def latest(key: str) -> Optional[ImportLog]:
+    return db.session.execute(select(ImportLog).where(ImportLog.ImportKey == key)
+                              .order_by(ImportLog.RunId.desc()).limit(1)).scalar()
+
+
+class AlreadyImported(Exception):
+    def __init__(self, row: ImportLog, running: bool):
+        self.row = row
+        self.running = running
+        if running:
+            msg = (f"File này đang được import (RunId {row.RunId}, đã xử lý {row.Cursor or 0} dòng) "
+                   f"→ chờ xong rồi tải lại.")
+        else:
+            msg = (f"File này đã được import với cùng tham số lúc {row.When:%Y-%m-%d %H:%M:%S} "
+                   f"(RunId {row.RunId}) → bỏ qua. Thêm ?force=1 để import lại.")
+        super().__init__(msg)
+
+    # Summary của lần import trước, kèm cảnh báo và RunId
+    def summary(self) -> Dict[str, Any]:
+        try:
+            out = json.loads(self.row.Summary) if self.row.Summary else {}
+        except ValueError:
+            out = {}
+        out["warnings"] = [str(self)] + list(out.get("warnings") or [])
+        out["duplicate_of"] = self.row.RunId
+        return out
+
+
+@dataclass
+class ImportRun:
+    run_id: int
+    key: str
+    cursor: int = 0                                          # số dòng file đã commit
+    state: Dict[str, Any] = field(default_factory=dict)      # summary tạm ở checkpoint cuối
+
+    # Trong transaction của session: commit cùng dữ liệu của lô
+    def checkpoint(self, cursor: int, state: Dict[str, Any]):
+        self.cursor, self.state = cursor, state
+        db.session.execute(update(_T).where(_T.c.RunId == self.run_id)
+                           .values(Cursor=cursor, Summary=_dump(state), UpdatedAt=datetime.utcnow()))
+
+    def finish(self, summary: Dict[str, Any]):
+        db.session.execute(update(_T).where(_T.c.RunId == self.run_id)
+                           .values(Status="done", Summary=_dump(summary), UpdatedAt=datetime.utcnow()))
+
+    # Gọi sau rollback, transaction riêng: giữ Cursor và summary của checkpoint cuối
+    def fail(self, error: str):
+        with db.engine.begin() as conn:
+            conn.execute(update(_T).where(_T.c.RunId == self.run_id).values(
+                Status="failed", UpdatedAt=datetime.utcnow(), Summary=_dump({**self.state, "error": error})))
+
+
+# Bắt đầu (hoặc nhận lại) run cho key; AlreadyImported nếu đã import xong hoặc đang có tiến trình chạy
+def begin(key: str, *, endpoint: str, affected: str, filename: Optional[str], actor: str = "",
+          params: Any = None, force: bool = False) -> ImportRun:
+    row = latest(key)
+    now = datetime.utcnow()
+    stale = timedelta(seconds=float(current_app.config.get("IMPORT_RUN_STALE", RUN_STALE)))
+    if row is not None:
+        running = row.Status == "running" and row.UpdatedAt is not None and now - row.UpdatedAt < stale
+        if not force and (running or row.Status == "done"):
+            raise AlreadyImported(row, running)
+        if row.Status in ("running", "failed") and not force:
+            # UPDATE có điều kiện như jobs._claim: chỉ một request nhận lại được run dở
+            with db.engine.begin() as conn:
+                n = conn.execute(update(_T).where(_T.c.RunId == row.RunId, _T.c.Status == row.Status,
+                                                  _T.c.UpdatedAt == row.UpdatedAt)
+                                 .values(Status="running", UpdatedAt=now, Actor=actor or row.Actor)).rowcount
+            if n != 1:
+                raise AlreadyImported(row, True)
+            try:
+                state = json.loads(row.Summary) if row.Summary else {}
+            except ValueError:
+                state = {}
+            state.pop("error", None)
+            return ImportRun(row.RunId, key, int(row.Cursor or 0) if state else 0, state)
+    with db.engine.begin() as conn:
+        res = conn.execute(insert(_T).values(
+            When=now, Actor=str(actor or ""), Endpoint=endpoint, AffectedTable=affected, Filename=filename,
+            Params=_dump(params) if params is not None else None, ImportKey=key, Status="running",
+            Cursor=0, UpdatedAt=now))
+    return ImportRun(res.inserted_primary_key[0], key)
+
+
+def init_app(app: Flask):
+    app.config.setdefault("IMPORT_RUN_STALE", float(os.getenv("IMPORT_RUN_STALE", RUN_STALE)))
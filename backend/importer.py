@@ -1,24 +1,37 @@
 # backend/importer.py
 from __future__ import annotations
 import io
+import itertools
 import json
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
 import pandas as pd
-from flask import request, jsonify
+from flask import g, request, jsonify
 from flask_jwt_extended import get_jwt_identity
-from numpy import select
-from passlib.hash import bcrypt
-from sqlalchemy import func
-from difflib import SequenceMatcher
+from sqlalchemy import func, select
 from .models import (
     db,
     HocPhan, LopHoc, NganhHoc,
     NguoiDung, VaiTro,
     SinhVien, KetQuaHocTap,
-    SystemConfig, ImportLog, GradeAuditLog,ChuongTrinhDaoTao
+    SystemConfig, GradeAuditLog,ChuongTrinhDaoTao
 )
+from .accounts import provision_student_users
+from .grade_writer import GRADE_FIELDS, upsert_grades, resolve_retakes
+from .grade_frame import melt_wide, grade_letters
+from .jobs import report_progress
+from .upload_stream import SpooledUpload, ParsedSheet, spool_upload, iter_frames, read_frame, estimate_rows
+from .subject_resolver import SubjectResolver, FUZZY_THRESHOLD, save_aliases
+from .services.student_aggregate import refresh_students, refresh_courses
+from .services.grade_snapshot import request_refresh as refresh_snapshot
+from .data_version import bump, sv_scope, CATALOG, CONFIG
+from .config_cache import settings, RETAKE_POLICIES
+from .audit_sink import log_event, redact
+from .import_runs import AlreadyImported, ImportRun, import_key, begin as begin_run, latest as latest_run
+from .import_plan import Diff, Plan, plans
+from .utils_import import chunked
 
 
 @dataclass
@@ -45,77 +58,57 @@ def _actor_id() -> int:
         return 0
 
 
-def _get_file_df() -> Tuple[pd.DataFrame, str]:
+def _spool_request_file() -> SpooledUpload:
     f = request.files.get("file")
     if not f:
         raise ValueError("Thiếu file (form field 'file')")
-    filename = f.filename or "upload.xlsx"
-    content = f.read()
-    buf = io.BytesIO(content)
     try:
-        if filename.lower().endswith(".csv"):
-            df = pd.read_csv(buf)
-        else:
-            df = pd.read_excel(buf, dtype=str)
+        return spool_upload(f)
     except Exception as e:
         raise ValueError(f"Lỗi đọc file: {e}")
-    return df, filename
 
 
-def _audit_import(*, endpoint: str, affected: str, summary: Dict[str, Any], filename: Optional[str] = None):
-    try:
-        actor = get_jwt_identity() or ""
-    except Exception:
-        actor = ""
+# File nhỏ (CTĐT): đọc cả bảng nhưng vẫn qua file tạm thay vì BytesIO; trả kèm SHA-256 của file.
+# Lỗi đã có tiền tố "Lỗi đọc file:" (trừ thiếu file), nơi gọi trả nguyên thông báo
+def _get_file_df() -> Tuple[pd.DataFrame, str, str]:
+    with _spool_request_file() as up:
+        try:
+            return read_frame(up, dtype=str), up.filename, up.digest
+        except Exception as e:
+            raise ValueError(f"Lỗi đọc file: {e}")
+
+
+def _actor_name() -> str:
+    if g.get("job_actor") is not None:
+        return g.job_actor
     try:
-        log = ImportLog(
-            When=datetime.utcnow(),
-            Actor=str(actor),
-            Endpoint=endpoint,
-            Params=json.dumps(request.args.to_dict(), ensure_ascii=False),
-            Filename=filename,
-            Summary=json.dumps(summary, ensure_ascii=False),
-            AffectedTable=affected,
-            InsertedIds=None,
-        )
-        db.session.add(log)
-        db.session.commit()
+        return str(get_jwt_identity() or "")
     except Exception:
-        db.session.rollback()
+        return ""
+
+
+def _audit_import(*, endpoint: str, affected: str, summary: Dict[str, Any], filename: Optional[str] = None,
+                  run: Optional[ImportRun] = None):
+    log_event(endpoint, summary, filename=filename, affected=affected, actor=_actor_name(), import_log=run is None)
+
+
+# Run import thật theo SHA-256 file + tham số (import_runs.py); ?force=1 bỏ qua kiểm tra trùng
+def _begin_run(kind: str, digest: str, params, *, endpoint: str, affected: str, filename: Optional[str]) -> ImportRun:
+    force = str(request.args.get("force") or "").lower() in ("1", "true", "yes", "y")
+    return begin_run(import_key(kind, digest, params), endpoint=endpoint, affected=affected, filename=filename,
+                     actor=_actor_name(), params=redact(request.args.to_dict()), force=force)
+
+
+# Preview: RunId của lần import xong trước đó với cùng file + tham số (nếu có)
+def _imported_before(kind: str, digest: str, params) -> Optional[int]:
+    row = latest_run(import_key(kind, digest, params))
+    return row.RunId if row is not None and row.Status == "done" else None
 
 
 def _ensure_student_user(masv: str, email_domain: str) -> int:
-    u = NguoiDung.query.filter_by(TenDangNhap=masv).first()
-    if u:
-        return u.MaNguoiDung
     vr = VaiTro.query.filter_by(TenVaiTro="Sinh viên").first()
-    u = NguoiDung(
-        TenDangNhap=masv,
-        MatKhauMaHoa=bcrypt.hash(masv),
-        Email=f"{masv}@{email_domain}",
-        TrangThai="Hoạt động",
-        MaVaiTro=vr.MaVaiTro if vr else None,
-    )
-    db.session.add(u); db.session.flush()
-    return u.MaNguoiDung
-
-
-def _retake_apply_policy(masv: str, mahp: str, new_rec: KetQuaHocTap, policy: str = "keep-latest"):
-    policy = (policy or "keep-latest").strip().lower()
-    existing = KetQuaHocTap.query.filter_by(MaSV=masv, MaHP=mahp).order_by(KetQuaHocTap.MaKQ.asc()).all()
-    if not existing:
-        new_rec.LaDiemCuoiCung = True
-        return
-    if policy == "best":
-        all_recs = existing + [new_rec]
-        best = max(all_recs, key=lambda r: (r.DiemHe4 or 0.0, r.HocKy or ""))
-        for r in all_recs:
-            r.LaDiemCuoiCung = (r is best)
-    else:
-        for r in existing:
-            r.LaDiemCuoiCung = False
-        new_rec.LaDiemCuoiCung = True
-
+    ids = provision_student_users([masv], email_domain=email_domain, role_id=vr.MaVaiTro if vr else None)
+    return ids[masv]
 
 
 def import_curriculum(*, preview: bool = True, allow_update: bool = True, replace: bool = False):
@@ -134,18 +127,9 @@ def import_curriculum(*, preview: bool = True, allow_update: bool = True, replac
         return jsonify({"msg": f"Ngành '{ma_nganh}' không tồn tại."}), 400
 
     try:
-        df, filename = _get_file_df()
-    except NameError:
-        f = request.files.get("file")
-        if not f:
-            return jsonify({"msg": "Thiếu file upload (form field 'file')."}), 400
-        filename = f.filename
-        if filename.lower().endswith((".xlsx", ".xls")):
-            df = pd.read_excel(f)
-        else:
-            df = pd.read_csv(f)
+        df, filename, digest = _get_file_df()
     except Exception as e:
-        return jsonify({"msg": f"Lỗi đọc file: {e}"}), 400
+        return jsonify({"msg": str(e)}), 400
 
     import re, unicodedata
     def _norm(s: str) -> str:
@@ -179,90 +163,147 @@ def import_curriculum(*, preview: bool = True, allow_update: bool = True, replac
     df = df[(df[col_ma] != "") & (df[col_ten] != "")]
     df = df.drop_duplicates(subset=[col_ma], keep="last")
 
-    if replace:
-        db.session.query(ChuongTrinhDaoTao).filter(
-            ChuongTrinhDaoTao.MaNganh == ma_nganh
-        ).delete(synchronize_session=False)
-
-    hp_by_code = {x.MaHP: x for x in db.session.execute(select(HocPhan)).scalars().all()}
-    ct_by_key  = {(x.MaNganh, x.MaHP): x for x in db.session.execute(
-                    select(ChuongTrinhDaoTao).where(ChuongTrinhDaoTao.MaNganh == ma_nganh)
-                  ).scalars().all()}
+    params = (ma_nganh, allow_update, replace)
+    run = None
+    if not preview:
+        try:
+            run = _begin_run("curriculum", digest, params, endpoint="/api/admin/import/curriculum",
+                             affected="HocPhan,ChuongTrinhDaoTao", filename=filename)
+        except AlreadyImported as e:
+            return jsonify({"file": filename, "manganh": ma_nganh, "preview": preview, "replace": replace,
+                            **e.summary()}), (409 if e.running else 200)
+    plan = None if preview else plans().take("curriculum", digest, params)
+    if plan is not None:
+        rows, errors = plan.steps[0]
+    else:
+        rows, errors = [], []
+        for _, row in df.iterrows():
+            rowno = int(row["_rowno"])
+            try:
+                hk = int(str(row[col_hk]).strip())
+            except Exception:
+                errors.append({"row": rowno, "error": "Kỳ thứ không hợp lệ"})
+                continue
+            try:
+                stc = int(str(row[col_stc]).strip())
+            except Exception:
+                errors.append({"row": rowno, "error": "Số tín chỉ không hợp lệ"})
+                continue
+            rows.append((row[col_ma], row[col_ten], hk, stc))
 
     stats = {
         "rows": int(df.shape[0]),
         "hp_inserted": 0, "hp_updated": 0,
         "ct_inserted": 0, "ct_updated": 0,
-        "skipped": 0, "errors": []
+        "skipped": len(errors), "errors": errors
     }
+    report_progress(total=stats["rows"], processed=0)
 
-    for _, row in df.iterrows():
-        mahp  = row[col_ma]
-        tenhp = row[col_ten]
-        rowno = int(row["_rowno"])
-
+    def _respond(**extra):
         try:
-            hk = int(str(row[col_hk]).strip())
+            _audit_import(
+                endpoint="/api/admin/import/curriculum",
+                affected="HocPhan,ChuongTrinhDaoTao",
+                summary=stats, filename=filename, run=run
+            )
         except Exception:
-            stats["skipped"] += 1
-            stats["errors"].append({"row": rowno, "error": "Kỳ thứ không hợp lệ"})
-            continue
+            pass
 
-        try:
-            stc = int(str(row[col_stc]).strip())
-        except Exception:
-            stats["skipped"] += 1
-            stats["errors"].append({"row": rowno, "error": "Số tín chỉ không hợp lệ"})
-            continue
-
-        hp = hp_by_code.get(mahp)
-        if hp is None:
-            hp = HocPhan(MaHP=mahp, TenHP=tenhp, SoTinChi=stc, TinhDiemTichLuy=True)
-            db.session.add(hp)
-            hp_by_code[mahp] = hp
-            stats["hp_inserted"] += 1
-        else:
-            if allow_update:
-                changed = False
-                if hp.TenHP != tenhp:
-                    hp.TenHP = tenhp; changed = True
-                if hp.SoTinChi != stc:
-                    hp.SoTinChi = stc; changed = True
-                if changed:
-                    stats["hp_updated"] += 1
-
-        ct = ct_by_key.get((ma_nganh, mahp))
-        if ct is None:
-            ct = ChuongTrinhDaoTao(MaNganh=ma_nganh, MaHP=mahp, HocKy=hk, LaMonBatBuoc=True)
-            db.session.add(ct)
-            ct_by_key[(ma_nganh, mahp)] = ct
-            stats["ct_inserted"] += 1
-        else:
-            if allow_update and ct.HocKy != hk:
-                ct.HocKy = hk
-                stats["ct_updated"] += 1
+        return jsonify({
+            "file": filename,
+            "manganh": ma_nganh,
+            "preview": preview,
+            "replace": replace,
+            **stats,
+            **extra
+        }), 200
 
     if preview:
-        db.session.rollback()
-    else:
-        db.session.commit()
-
+        # Snapshot chỉ đọc của HocPhan/CTĐT ngành; đếm theo cùng quy tắc với nhánh ghi bên dưới
+        plan = Plan("curriculum", digest, params)
+        plan.watch([CATALOG])
+        plan.add((rows, errors), len(rows))
+        diff = Diff()
+        hp_snap = {r.MaHP: {"TenHP": r.TenHP, "SoTinChi": r.SoTinChi}
+                   for r in db.session.execute(select(HocPhan.MaHP, HocPhan.TenHP, HocPhan.SoTinChi))}
+        ct_snap = {r.MaHP: {"HocKy": r.HocKy} for r in db.session.execute(
+                   select(ChuongTrinhDaoTao.MaHP, ChuongTrinhDaoTao.HocKy).where(ChuongTrinhDaoTao.MaNganh == ma_nganh))}
+        if replace:
+            for mahp in sorted(set(ct_snap) - {r[0] for r in rows}):
+                diff.delete("ChuongTrinhDaoTao", (ma_nganh, mahp), ct_snap[mahp])
+        for mahp, tenhp, hk, stc in rows:
+            existed = mahp in hp_snap or diff.seen("HocPhan", (mahp,))
+            action = diff.compare("HocPhan", (mahp,), hp_snap.get(mahp), {"TenHP": tenhp, "SoTinChi": stc},
+                                  allow_update=allow_update)
+            if not existed: stats["hp_inserted"] += 1
+            elif allow_update and action in ("updated", "conflict"): stats["hp_updated"] += 1
+            existed = (mahp in ct_snap and not replace) or diff.seen("ChuongTrinhDaoTao", (ma_nganh, mahp))
+            action = diff.compare("ChuongTrinhDaoTao", (ma_nganh, mahp), ct_snap.get(mahp), {"HocKy": hk},
+                                  allow_update=allow_update)
+            if not existed: stats["ct_inserted"] += 1
+            elif allow_update and action in ("updated", "conflict"): stats["ct_updated"] += 1
+        report_progress(processed=stats["rows"], created=stats["hp_inserted"] + stats["ct_inserted"],
+                        updated=stats["hp_updated"] + stats["ct_updated"], skipped=stats["skipped"])
+        return _respond(diff=diff.to_json(), plan_cached=plans().put(plan),
+                        imported_before=_imported_before("curriculum", digest, params))
+
+    # Cả pha ghi trong try: lỗi ở đâu (xoá CTĐT cũ, autoflush, refresh_courses...) cũng rollback và đánh
+    # dấu run failed, không để run "running" chặn lần tải lại tới IMPORT_RUN_STALE
     try:
-        _audit_import(
-            endpoint="/api/admin/import/curriculum",
-            affected="HocPhan,ChuongTrinhDaoTao",
-            summary=stats, filename=filename
-        )
-    except Exception:
-        pass
-
-    return jsonify({
-        "file": filename,
-        "manganh": ma_nganh,
-        "preview": preview,
-        "replace": replace,
-        **stats
-    }), 200
+        if replace:
+            db.session.query(ChuongTrinhDaoTao).filter(
+                ChuongTrinhDaoTao.MaNganh == ma_nganh
+            ).delete(synchronize_session=False)
+            bump([CATALOG])  # query.delete không qua flush
+
+        hp_by_code = {x.MaHP: x for x in db.session.execute(select(HocPhan)).scalars().all()}
+        ct_by_key  = {(x.MaNganh, x.MaHP): x for x in db.session.execute(
+                        select(ChuongTrinhDaoTao).where(ChuongTrinhDaoTao.MaNganh == ma_nganh)
+                      ).scalars().all()}
+        credit_changed = set()
+
+        for mahp, tenhp, hk, stc in rows:
+            hp = hp_by_code.get(mahp)
+            if hp is None:
+                hp = HocPhan(MaHP=mahp, TenHP=tenhp, SoTinChi=stc, TinhDiemTichLuy=True)
+                db.session.add(hp)
+                hp_by_code[mahp] = hp
+                stats["hp_inserted"] += 1
+            else:
+                if allow_update:
+                    changed = False
+                    if hp.TenHP != tenhp:
+                        hp.TenHP = tenhp; changed = True
+                    if hp.SoTinChi != stc:
+                        hp.SoTinChi = stc; changed = True
+                        credit_changed.add(mahp)
+                    if changed:
+                        stats["hp_updated"] += 1
+
+            ct = ct_by_key.get((ma_nganh, mahp))
+            if ct is None:
+                ct = ChuongTrinhDaoTao(MaNganh=ma_nganh, MaHP=mahp, HocKy=hk, LaMonBatBuoc=True)
+                db.session.add(ct)
+                ct_by_key[(ma_nganh, mahp)] = ct
+                stats["ct_inserted"] += 1
+            else:
+                if allow_update and ct.HocKy != hk:
+                    ct.HocKy = hk
+                    stats["ct_updated"] += 1
+
+        report_progress(processed=stats["rows"], created=stats["hp_inserted"] + stats["ct_inserted"],
+                        updated=stats["hp_updated"] + stats["ct_updated"], skipped=stats["skipped"])
+        if credit_changed:
+            refresh_courses(credit_changed)
+        if plan is not None:
+            stats["from_preview"] = True
+        run.finish(stats)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        run.fail(str(e))
+        raise
+    return _respond()
 
 def import_class_roster(*, preview: bool = True, allow_update: bool = True):
 
@@ -270,7 +311,6 @@ def import_class_roster(*, preview: bool = True, allow_update: bool = True):
     from datetime import datetime, timedelta
     import pandas as pd
     from flask import request, jsonify
-    from passlib.hash import bcrypt
 
     HEADER_TOKENS = {
         "masinhvien": {"masinhvien", "ma sinh vien", "masv", "mssv", "studentid", "id", "mã sinh viên"},
@@ -314,8 +354,7 @@ def import_class_roster(*, preview: bool = True, allow_update: bool = True):
         return None if pd.isna(dt) else dt.date()
 
     def _email_domain() -> str:
-        row = db.session.get(SystemConfig, "EMAIL_DOMAIN")
-        return row.ConfigValue if row else "vui.edu.vn"
+        return settings().email_domain
 
     def _ensure_role_sinhvien_id():
         r = db.session.query(VaiTro).filter(VaiTro.TenVaiTro.in_(["SinhVien", "Sinh Viên", "student"])).first()
@@ -323,19 +362,6 @@ def import_class_roster(*, preview: bool = True, allow_update: bool = True):
             r = VaiTro(TenVaiTro="SinhVien"); db.session.add(r); db.session.flush()
         return r.MaVaiTro
 
-    def _ensure_user_for_sv(masv: str, email_domain: str) -> int:
-        u = db.session.query(NguoiDung).filter_by(TenDangNhap=masv).first()
-        if u: return u.MaNguoiDung
-        u = NguoiDung(
-            TenDangNhap=masv,
-            MatKhauMaHoa=bcrypt.hash(masv),
-            Email=f"{masv}@{email_domain}".lower(),
-            TrangThai="Hoạt động",
-            MaVaiTro=_ensure_role_sinhvien_id(),
-        )
-        db.session.add(u); db.session.flush()
-        return u.MaNguoiDung
-
     lop = (request.args.get("lop") or "").strip().upper()
     if not lop:
         payload = {
@@ -362,13 +388,14 @@ def import_class_roster(*, preview: bool = True, allow_update: bool = True):
         }
         return jsonify(payload), 400
 
-    up = request.files["file"]; fname = up.filename; raw = up.read()
+    fname = request.files["file"].filename
+    upload = None
     try:
-        if fname.lower().endswith(".csv"):
-            df = pd.read_csv(io.BytesIO(raw), dtype=object, encoding="utf-8")
-        else:
-            df = pd.read_excel(io.BytesIO(raw), dtype=object)
+        upload = spool_upload(request.files["file"])
+        frames = iter_frames(upload, dtype=object)
+        df = next(frames)
     except Exception as e:
+        if upload: upload.close()
         payload = {
             "summary": {"total_rows": 0, "created": 0, "updated": 0, "skipped": 0,
                         "warnings": [f"Lỗi đọc file: {e}"]},
@@ -395,96 +422,187 @@ def import_class_roster(*, preview: bool = True, allow_update: bool = True):
         warn = [f"Thiếu cột: {', '.join(label[m] for m in missing)}"]
         payload = {"summary":{"total_rows":0,"created":0,"updated":0,"skipped":0,"warnings":warn},
                    "preview":[], "warnings":warn, "file": fname}
+        upload.close()
         return jsonify(payload), 400
 
     email_domain = _email_domain()
-
-    total=0; created=0; updated=0; skipped=0
-    warnings=[]; preview_rows=[]
-
-    for i, row in df.iterrows():
-        masv = str(row[resolved["masinhvien"]]).strip() if pd.notna(row[resolved["masinhvien"]]) else ""
-        hoten = str(row[resolved["hovaten"]]).strip() if pd.notna(row[resolved["hovaten"]]) else ""
-        ngs_raw = str(row[resolved["ngaysinh"]]).strip() if pd.notna(row[resolved["ngaysinh"]]) else ""
-        nois = str(row[resolved["noisinh"]]).strip() if pd.notna(row[resolved["noisinh"]]) else ""
-
-        if _is_header_like(masv, hoten, ngs_raw, nois):
-            skipped += 1
-            warnings.append(f"Dòng {i + 2}: bỏ qua vì trùng tiêu đề cột")
-            continue
-
-        ngs = _parse_date(ngs_raw) if ngs_raw else None
-
-        if not masv and not hoten:
-            continue
-        total += 1
-
-        if not masv or not hoten:
-            skipped += 1
-            warnings.append(f"Dòng {i+2}: Thiếu Mã SV hoặc Họ tên")
-            continue
-
-        uid = _ensure_user_for_sv(masv, email_domain)
-        sv = db.session.get(SinhVien, masv)
-        if not sv:
-            sv = SinhVien(MaSV=masv, HoTen=hoten, NgaySinh=ngs, NoiSinh=nois, MaLop=lop, MaNguoiDung=uid)
-            if hasattr(SinhVien, "Lop"): setattr(sv, "Lop", lop)
-            db.session.add(sv); created += 1
-        else:
-            changed = False
-            if allow_update:
-                if hoten and sv.HoTen != hoten: sv.HoTen = hoten; changed = True
-                if ngs and getattr(sv, "NgaySinh", None) != ngs: sv.NgaySinh = ngs; changed = True
-                if nois is not None and getattr(sv, "NoiSinh", None) != nois: sv.NoiSinh = nois; changed = True
-                if hasattr(SinhVien, "MaLop") and getattr(sv, "MaLop", None) != lop:
-                    sv.MaLop = lop; changed = True
-                if hasattr(SinhVien, "Lop") and getattr(sv, "Lop", None) != lop:
-                    sv.Lop = lop; changed = True
-            if changed: updated += 1
-            else: skipped += 1
-
-        if len(preview_rows) < 10:
-            preview_rows.append({
-                "Mã sinh viên": masv,
-                "Họ và tên": hoten,
-                "Ngày sinh": (ngs.isoformat() if ngs else None),
-                "Nơi sinh": nois,
-                "Tên lớp (chọn)": lop,
-            })
+    role_id = None
+
+    def _snapshot(masvs):
+        snap = {}
+        for part in chunked(masvs, 500):
+            for r in db.session.execute(select(SinhVien.MaSV, SinhVien.HoTen, SinhVien.NgaySinh,
+                                               SinhVien.NoiSinh, SinhVien.MaLop).where(SinhVien.MaSV.in_(part))):
+                snap[r.MaSV] = {"HoTen": r.HoTen, "NgaySinh": r.NgaySinh, "NoiSinh": r.NoiSinh, "MaLop": r.MaLop}
+        return snap
+
+    # Ghi một lô (masv, hoten, ngs, nois); trả về (created, updated, skipped)
+    def _apply(parsed):
+        nonlocal role_id
+        if not parsed:
+            return 0, 0, 0
+        if role_id is None:
+            role_id = _ensure_role_sinhvien_id()
+        c = u = s = 0
+        user_ids = provision_student_users((p[0] for p in parsed), email_domain=email_domain, role_id=role_id)
+        sv_by_ma = {}
+        for part in chunked([p[0] for p in parsed], 500):
+            sv_by_ma.update({x.MaSV: x for x in db.session.query(SinhVien).filter(SinhVien.MaSV.in_(part))})
+
+        for masv, hoten, ngs, nois in parsed:
+            sv = sv_by_ma.get(masv)
+            if not sv:
+                sv = SinhVien(MaSV=masv, HoTen=hoten, NgaySinh=ngs, NoiSinh=nois, MaLop=lop, MaNguoiDung=user_ids[masv])
+                db.session.add(sv); sv_by_ma[masv] = sv; c += 1
+            else:
+                changed = False
+                if allow_update:
+                    if hoten and sv.HoTen != hoten: sv.HoTen = hoten; changed = True
+                    if ngs and sv.NgaySinh != ngs: sv.NgaySinh = ngs; changed = True
+                    if nois is not None and sv.NoiSinh != nois: sv.NoiSinh = nois; changed = True
+                    if sv.MaLop != lop: sv.MaLop = lop; changed = True
+                if changed: u += 1
+                else: s += 1
+        return c, u, s
+
+    # Preview: so với snapshot chỉ đọc, cùng quy tắc đếm với _apply
+    def _compare(parsed, snap, diff):
+        c = u = s = 0
+        for masv, hoten, ngs, nois in parsed:
+            after = {"HoTen": hoten, "NgaySinh": ngs, "NoiSinh": nois, "MaLop": lop}
+            before = snap.get(masv)
+            if before is not None and not ngs:
+                after.pop("NgaySinh")
+            existed = before is not None or diff.seen("SinhVien", (masv,))
+            action = diff.compare("SinhVien", (masv,), before, after, allow_update=allow_update)
+            if not existed: c += 1
+            elif allow_update and action in ("updated", "conflict"): u += 1
+            else: s += 1
+        return c, u, s
+
+    params = (lop, allow_update)
+    run = None
+    if not preview:
+        try:
+            run = _begin_run("roster", upload.digest, params, endpoint="/api/admin/import/class-roster",
+                             affected="SinhVien", filename=fname)
+        except AlreadyImported as e:
+            upload.close()
+            summary = e.summary()
+            return jsonify({"summary": summary, "preview": [], "warnings": summary["warnings"], "file": fname}), \
+                (409 if e.running else 200)
+    plan = None if preview else plans().take("roster", upload.digest, params)
+    from_preview = plan is not None
+    if from_preview:
+        upload.close()
+        total, warnings, preview_rows = plan.meta["total"], plan.meta["warnings"], plan.meta["preview"]
+        created = updated = 0
+        skipped = plan.meta["skipped"]
+        try:
+            for parsed in plan.steps:
+                c, u, s = _apply(parsed)
+                created += c; updated += u; skipped += s
+        except Exception as e:
+            db.session.rollback(); run.fail(str(e))
+            raise
+        report_progress(processed=plan.rows, created=created, updated=updated, skipped=skipped)
+    else:
+        plan = Plan("roster", upload.digest, params)
+        diff = Diff()
+        total=0; created=0; updated=0; skipped=0; bad_rows=0
+        warnings=[]; preview_rows=[]
+        # Đọc và ghi theo từng lô dòng; mỗi lô một lượt tạo tài khoản và nạp SinhVien
+        processed = 0
+        report_progress(total=estimate_rows(upload), processed=0)
+        try:
+            for df in itertools.chain([df], frames):
+                parsed = []
+                for i, row in df.iterrows():
+                    masv = str(row[resolved["masinhvien"]]).strip() if pd.notna(row[resolved["masinhvien"]]) else ""
+                    hoten = str(row[resolved["hovaten"]]).strip() if pd.notna(row[resolved["hovaten"]]) else ""
+                    ngs_raw = str(row[resolved["ngaysinh"]]).strip() if pd.notna(row[resolved["ngaysinh"]]) else ""
+                    nois = str(row[resolved["noisinh"]]).strip() if pd.notna(row[resolved["noisinh"]]) else ""
+
+                    if _is_header_like(masv, hoten, ngs_raw, nois):
+                        skipped += 1; bad_rows += 1
+                        warnings.append(f"Dòng {i + 2}: bỏ qua vì trùng tiêu đề cột")
+                        continue
+
+                    ngs = _parse_date(ngs_raw) if ngs_raw else None
+
+                    if not masv and not hoten:
+                        continue
+                    total += 1
+
+                    if not masv or not hoten:
+                        skipped += 1; bad_rows += 1
+                        warnings.append(f"Dòng {i+2}: Thiếu Mã SV hoặc Họ tên")
+                        continue
+
+                    parsed.append((masv, hoten, ngs, nois))
+                processed += len(df)
+
+                if preview:
+                    plan.watch(sv_scope(p[0]) for p in parsed)
+                    c, u, s = _compare(parsed, _snapshot([p[0] for p in parsed]), diff)
+                    plan.add(parsed, len(parsed))
+                else:
+                    c, u, s = _apply(parsed)
+                created += c; updated += u; skipped += s
+
+                for masv, hoten, ngs, nois in parsed[:max(0, 10 - len(preview_rows))]:
+                    preview_rows.append({
+                        "Mã sinh viên": masv,
+                        "Họ và tên": hoten,
+                        "Ngày sinh": (ngs.isoformat() if ngs else None),
+                        "Nơi sinh": nois,
+                        "Tên lớp (chọn)": lop,
+                    })
+                report_progress(processed=processed, created=created, updated=updated, skipped=skipped)
+        except Exception as e:
+            if run is not None:
+                db.session.rollback(); run.fail(str(e))
+            raise
+        finally:
+            upload.close()
 
     summary = {"total_rows": total, "created": created, "updated": updated, "skipped": skipped, "warnings": warnings}
+    if from_preview:
+        summary["from_preview"] = True
 
     if preview:
-        db.session.rollback()
+        plan.meta = {"total": total, "warnings": list(warnings), "preview": preview_rows, "skipped": bad_rows}
+        summary["diff"] = diff.to_json()
+        summary["plan_cached"] = plans().put(plan)
+        summary["imported_before"] = _imported_before("roster", upload.digest, params)
         return jsonify({"summary": summary, "preview": preview_rows, "warnings": warnings, "file": fname}), 200
 
     try:
+        run.finish(summary)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
+        run.fail(str(e))
         summary["warnings"].append(f"Lỗi commit DB: {e}")
         return jsonify({"summary": summary, "preview": preview_rows, "warnings": summary["warnings"], "file": fname}), 400
 
-    try:
-        db.session.add(ImportLog(Endpoint="/api/admin/import/class-roster",
-                                 Summary=json.dumps(summary, ensure_ascii=False),
-                                 Filename=fname, AffectedTable="SinhVien"))
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
+    _audit_import(endpoint="/api/admin/import/class-roster", affected="SinhVien", summary=summary, filename=fname,
+                  run=run)
 
     return jsonify({"summary": summary, "preview": preview_rows, "warnings": warnings, "file": fname}), 200
 
 
+# lop/source: batch import (batch_import.py) truyền lớp và sheet đã đọc sẵn thay cho ?lop và file upload
 def import_grades(*, preview: bool = True,
                   allow_update: bool = True,
                   hoc_ky_default: str | None = None,
-                  retake_policy: str = "keep-latest"):
+                  retake_policy: str | None = None,
+                  lop: str | None = None,
+                  source: ParsedSheet | None = None):
 
     import re, unicodedata, math
     import pandas as pd
     from flask import request, jsonify
-    from passlib.hash import bcrypt
     from decimal import Decimal, ROUND_HALF_UP
     EPS = Decimal("0.05")
     tbc_policy = (request.args.get("tbc_policy") or "calc_only").strip().lower()
@@ -497,15 +615,6 @@ def import_grades(*, preview: bool = True,
         s = re.sub(r'_{2,}', '_', s).strip('_')
         s = s.replace('lt', 'laptrinh')  # 'LT C' -> 'laptrinhc'
         return s
-    def _fuzzy_pick_subject(key_norm: str, by_ten: dict, threshold: float = 0.78):
-        best, score = None, 0.0
-        for k, h in by_ten.items():
-            overlap = len(set(k.split('_')) & set(key_norm.split('_')))
-            r = SequenceMatcher(a=k, b=key_norm).ratio() + overlap * 0.05
-            if r > score:
-                best, score = h, r
-        return best if score >= threshold else None
-
     def _is_meta_header(key_norm: str) -> bool:
         if key_norm in {'stt', 'masv', 'mssv', 'hovaten', 'hoten', 'ngaysinh', 'noisinh', 'tenlop', 'lop',
                         'tbcht10', 'tbhk', 'sohpno', 'sotcno', 'ngaytonghop', 'nguoitonghop'}:
@@ -554,19 +663,8 @@ def import_grades(*, preview: bool = True,
         dt = pd.to_datetime(str(v).replace("-","/"), dayfirst=True, errors="coerce")
         return None if pd.isna(dt) else dt.date()
 
-    def _grade_letter(v: float) -> tuple[str, float, str]:
-        if v >= 8.5:   return "A", 4.0, "Đạt"
-        if v >= 7.8:   return "B+", 3.5, "Đạt"
-        if v >= 7.0:   return "B",  3.0, "Đạt"
-        if v >= 6.3:   return "C+", 2.5, "Đạt"
-        if v >= 5.5:   return "C",  2.0, "Đạt"
-        if v >= 4.8:   return "D+", 1.5, "Đạt"
-        if v >= 4.0:   return "D",  1.0, "Đạt"
-        return "F", 0.0, "Không đạt"
-
     def _email_domain() -> str:
-        row = db.session.get(SystemConfig, "EMAIL_DOMAIN")
-        return row.ConfigValue if row else "vui.edu.vn"
+        return settings().email_domain
 
     def _ensure_role_sinhvien_id():
         r = db.session.query(VaiTro).filter(VaiTro.TenVaiTro.in_(["SinhVien","Sinh Viên","student"])).first()
@@ -574,29 +672,6 @@ def import_grades(*, preview: bool = True,
             r = VaiTro(TenVaiTro="SinhVien"); db.session.add(r); db.session.flush()
         return r.MaVaiTro
 
-    def _ensure_user_and_student(masv: str, ho_ten: str|None, ngay_sinh, noi_sinh, lop: str|None):
-        u = db.session.query(NguoiDung).filter_by(TenDangNhap=masv).first()
-        if not u:
-            u = NguoiDung(TenDangNhap=masv, MatKhauMaHoa=bcrypt.hash(masv),
-                          Email=f"{masv}@{_email_domain()}".lower(),
-                          TrangThai="Hoạt động", MaVaiTro=_ensure_role_sinhvien_id())
-            db.session.add(u); db.session.flush()
-        sv = db.session.get(SinhVien, masv)
-        if not sv:
-            sv = SinhVien(MaSV=masv, HoTen=(ho_ten or masv), MaNguoiDung=u.MaNguoiDung)
-            if ngay_sinh: setattr(sv, "NgaySinh", ngay_sinh)
-            if noi_sinh is not None: setattr(sv, "NoiSinh", noi_sinh)
-            if lop:
-                if hasattr(SinhVien,"MaLop"): setattr(sv,"MaLop",lop)
-                if hasattr(SinhVien,"Lop"):   setattr(sv,"Lop",lop)
-            db.session.add(sv)
-
-    def _hp_lookup_builder():
-        all_hp = db.session.query(HocPhan).all()
-        by_ma = {(h.MaHP or "").strip().upper(): h for h in all_hp}
-        by_ten = {_norm_subject_name(h.TenHP or ""): h for h in all_hp if h.TenHP}
-        return by_ma, by_ten
-
     def _build_ctdt_hocky_map_for_lop(lop_code: str) -> dict[str, int]:
         if not lop_code:
             return {}
@@ -612,225 +687,415 @@ def import_grades(*, preview: bool = True,
         )
         return {mahp: (int(hk) if hk is not None else None) for (mahp, hk) in rows}
 
-    lop = (request.args.get("lop") or "").strip().upper()
+    # Ghi một step của lô: tài khoản + SinhVien mới, giá trị tổng hợp của SV, rồi điểm (upsert theo lô)
+    def _apply(step):
+        new = list(step["new"])
+        user_ids = provision_student_users(new, email_domain=_email_domain(),
+                                           role_id=_ensure_role_sinhvien_id()) if new else {}
+        # Giữ tham chiếu mạnh tới SinhVien của lô: identity map chỉ giữ yếu, db.session.get()
+        # từng dòng sẽ lại truy vấn (kèm autoflush cả session)
+        known = {}
+        for part in chunked(list(dict.fromkeys([*step["sv"], *new])), 500):
+            known.update((x.MaSV, x) for x in db.session.query(SinhVien).filter(SinhVien.MaSV.in_(part)))
+        for masv, (hoten, ngs, nois) in step["new"].items():
+            if masv not in known:
+                known[masv] = SinhVien(MaSV=masv, HoTen=(hoten or masv), MaNguoiDung=user_ids[masv],
+                                       NgaySinh=ngs or None, NoiSinh=nois, MaLop=lop or None)
+                db.session.add(known[masv])
+        for masv, vals in step["sv"].items():
+            sv = known.get(masv)
+            if sv is not None:
+                for k, v in vals.items():
+                    setattr(sv, k, v)
+        return upsert_grades(step["grades"], allow_update=allow_update)
+
+    # Preview: so step với snapshot chỉ đọc; số created/updated/skipped đếm như upsert_grades
+    def _compare(step, sv_snap, diff):
+        for masv, (hoten, ngs, nois) in step["new"].items():
+            diff.compare("SinhVien", (masv,), None, {"HoTen": hoten or masv, "NgaySinh": ngs, "NoiSinh": nois,
+                                                     "MaLop": lop, **step["sv"].get(masv, {})})
+        for masv, vals in step["sv"].items():
+            if masv in sv_snap:
+                diff.compare("SinhVien", (masv,), sv_snap[masv], vals)
+        snap = {}
+        for part in chunked(sorted({r["MaSV"] for r in step["grades"]} - set(step["new"])), 500):
+            for r in db.session.execute(select(KetQuaHocTap.MaSV, KetQuaHocTap.MaHP, KetQuaHocTap.HocKy,
+                                               *(getattr(KetQuaHocTap, f) for f in GRADE_FIELDS))
+                                        .where(KetQuaHocTap.MaSV.in_(part))):
+                snap[(r.MaSV, r.MaHP, r.HocKy)] = {f: getattr(r, f) for f in GRADE_FIELDS}
+        c = u = s = 0
+        for r in step["grades"]:
+            key = (r["MaSV"], r["MaHP"], r["HocKy"])
+            existed = key in snap or diff.seen("KetQuaHocTap", key)
+            diff.compare("KetQuaHocTap", key, snap.get(key), {f: r[f] for f in GRADE_FIELDS},
+                         allow_update=allow_update)
+            if not existed: c += 1
+            elif allow_update: u += 1
+            else: s += 1
+        return c, u, s
+
+    # Import thật: mỗi lô ghi xong thì tính lại cờ điểm cuối + tổng hợp của SV trong lô rồi commit cùng
+    # checkpoint của run (cursor = số dòng file đã xử lý), không giữ khoá ghi suốt cả file
+    def _commit(masvs, cursor, summary, alias_rows):
+        save_aliases(alias_rows)
+        summary["retake_flags_changed"] = summary.get("retake_flags_changed", 0) + resolve_retakes(retake_policy, masvs)
+        refresh_students(masvs)
+        run.checkpoint(cursor, summary)
+        db.session.commit()
+
+    # Lô lỗi: bỏ lô đó, các lô đã commit giữ nguyên; tải lại đúng file + tham số thì chạy tiếp từ cursor
+    def _stopped(e, preview_rows, fname):
+        db.session.rollback()
+        run.fail(str(e))
+        summary = {"total_rows": 0, "created": 0, "updated": 0, "skipped": 0, **run.state}
+        summary["warnings"] = list(summary.get("warnings") or []) + [f"Lỗi commit DB: {e}"]
+        if run.cursor:
+            summary["warnings"].append(f"Đã lưu {run.cursor} dòng đầu của file; tải lại đúng file với cùng "
+                                       f"tham số để chạy tiếp từ dòng {run.cursor + 1}.")
+            refresh_snapshot()          # các lô đã commit vẫn đổi điểm
+        summary["resume"] = {"run_id": run.run_id, "cursor": run.cursor}
+        return jsonify({"summary":summary,"preview":preview_rows,"warnings":summary["warnings"],"file":fname}), 400
+
+    def _save(summary, preview_rows, fname):
+        try:
+            run.finish(summary)
+            db.session.commit()
+        except Exception as e:
+            return _stopped(e, preview_rows, fname)
+
+        refresh_snapshot()
+        _audit_import(endpoint="/api/admin/import/grades", affected="KetQuaHocTap", summary=summary,
+                      filename=fname, run=run)
+        return jsonify({"summary":summary,"preview":preview_rows,"warnings":summary["warnings"],"file":fname}), 200
+
+    lop = ((request.args.get("lop") if lop is None else lop) or "").strip().upper()
     if lop and not db.session.get(LopHoc, lop):
         return jsonify({"summary":{"total_rows":0,"created":0,"updated":0,"skipped":0,
                                    "warnings":[f"Lớp '{lop}' chưa tồn tại trong Danh mục → hãy tạo trước."]},
                         "preview":[], "warnings":[f"Lớp '{lop}' chưa tồn tại trong Danh mục → hãy tạo trước."], "file":None}), 400
 
-    ctdt_map = _build_ctdt_hocky_map_for_lop(lop)
+    retake_policy = (retake_policy or settings().retake_policy).strip().lower()
+    if retake_policy not in RETAKE_POLICIES:
+        msg = f"retake_policy không hợp lệ: '{retake_policy}' (có: {', '.join(RETAKE_POLICIES)})"
+        return jsonify({"summary":{"total_rows":0,"created":0,"updated":0,"skipped":0,"warnings":[msg]},
+                        "preview":[], "warnings":[msg], "file":None}), 400
 
     try:
-        df, fname = _get_file_df()
-    except Exception as e:
-        return jsonify({"summary":{"total_rows":0,"created":0,"updated":0,"skipped":0,"warnings":[str(e)]},
-                        "preview":[], "warnings":[str(e)], "file":None}), 400
+        fuzzy_th = float(request.args.get("fuzzy_threshold") or FUZZY_THRESHOLD)
+    except ValueError:
+        fuzzy_th = FUZZY_THRESHOLD
+    hoc_ky = (request.args.get("hocky") or hoc_ky_default or "").strip() or "HK"
 
-    cols_norm = {_norm_key(c): c for c in df.columns}
-    alias = {
-        "stt": {"stt","so","sott","sothutu"},
-        "masv": {"masv","ma sv","mssv","masinhvien","ma sinh vien","id","studentid","mãsinhviên"},
-        "hoten": {"hovaten","ho va ten","hoten","ten","fullname","name","họ và tên"},
-        "ngaysinh": {"ngaysinh","ngay sinh","dob","dateofbirth","ngày sinh"},
-        "noisinh": {"noisinh","noi sinh","quequan","que quan","birthplace","nơi sinh"},
-        "tenlop": {"tenlop","ten lop","lop","malop"},
-        "tbcht10": {"tbcht10","tbc ht10","tbcht 10","tbc he 10","tbc10","gpa10"},
-        "sohpno": {"sohpno","so hp no","somonno","nohp"},
-        "sotcno": {"sotinchino","so tin chi no","sotcno","notinchi"},
-    }
-    def _col(key):
-        for a in alias.get(key,set()):
-            k=_norm_key(a)
-            if k in cols_norm: return cols_norm[k]
-        return None
+    upload = run = plan = None
 
-    col_masv  = _col("masv")
-    col_hoten = _col("hoten")
-    col_ngs   = _col("ngaysinh")
-    col_nois  = _col("noisinh")
-    col_tb10  = _col("tbcht10")
-    col_sohp  = _col("sohpno")
-    col_sotc  = _col("sotcno")
-    if not col_masv:
-        return jsonify({"summary":{"total_rows":0,"created":0,"updated":0,"skipped":0,
-                                   "warnings":["Thiếu cột Mã sinh viên"]},
-                        "preview":[], "warnings":["Thiếu cột Mã sinh viên"], "file":fname}), 400
-
-    META_KEYS = {
-        _norm_key("STT"), _norm_key("Mã sinh viên"), _norm_key("Họ và tên"),
-        _norm_key("Ngày sinh"), _norm_key("Nơi sinh"), _norm_key("Tên lớp"),
-        _norm_key("TBC HT10"), _norm_key("Số HP nợ"), _norm_key("Số tín chỉ nợ"),
-        _norm_key("Ngày tổng hợp"), _norm_key("Người tổng hợp")
-    }
-    for k in ("stt", "masv", "hoten", "ngaysinh", "noisinh", "tenlop", "tbcht10", "sohpno", "sotcno"):
-        for a in alias.get(k, set()):
-            META_KEYS.add(_norm_key(a))
-    start_idx = list(df.columns).index(col_masv) + 1 if col_masv in df.columns else 0
-    subject_cols = []
-    for idx, c in enumerate(df.columns):
-        if idx < start_idx:
-            continue
-        key = _norm_key(str(c))
-        if _is_meta_header(key):
-            continue
-        subject_cols.append(c)
-    by_ma, by_ten = _hp_lookup_builder()
-
-    total=0; created=0; updated=0; skipped=0
-    warnings=[]; preview_rows=[]
-    hoc_ky = (request.args.get("hocky") or hoc_ky_default or "").strip() or "HK"
+    # Lỗi trước khi vào vòng ghi (đọc file, ánh xạ CTĐT, cột, resolver...): đóng file, đánh dấu run failed
+    # để lần tải lại không bị 409 tới IMPORT_RUN_STALE
+    def _setup_failed(e):
+        db.session.rollback()
+        if upload: upload.close()
+        if run: run.fail(str(e))
+        return jsonify({"summary":{"total_rows":0,"created":0,"updated":0,"skipped":0,"warnings":[str(e)]},
+                        "preview":[], "warnings":[str(e)], "file":None}), 400
 
-    def _format_hk_for_save(hk_val):
-        return str(hk_val) if hk_val is not None else None
-
-    header_tokens = {"masinhvien","ma sinh vien","mssv","mã sinh viên","hovaten","họ và tên",
-                     "ngaysinh","ngay sinh","nơi sinh","noisinh","tbc ht10","số hp nợ","số tín chỉ nợ"}
-
-    for i, row in df.iterrows():
-        masv = str(row[col_masv]).strip() if pd.notna(row[col_masv]) else ""
-        if not masv: continue
-        if _norm_key(masv) in header_tokens:
-            skipped += 1; warnings.append(f"Dòng {i+2}: bỏ qua vì trùng tiêu đề"); continue
-
-        total += 1
-        hoten = (str(row[col_hoten]).strip() if (col_hoten and pd.notna(row[col_hoten])) else None)
-        ngs   = _parse_date(row[col_ngs]) if (col_ngs and pd.notna(row[col_ngs])) else None
-        nois  = (str(row[col_nois]).strip() if (col_nois and pd.notna(row[col_nois])) else None)
-        tb10  = _num_2(row[col_tb10]) if (col_tb10 and pd.notna(row[col_tb10])) else None
-
-        sohp=None
-        if col_sohp and pd.notna(row[col_sohp]):
-            try: sohp=int(str(row[col_sohp]).strip())
-            except Exception: sohp=None
-        sotcno=None
-        if col_sotc and pd.notna(row[col_sotc]):
-            try: sotcno=int(str(row[col_sotc]).strip())
-            except Exception: sotcno=None
-
-        sv_exist = db.session.get(SinhVien, masv)
-        if not sv_exist:
-            if not lop:
-                skipped += 1
-                warnings.append(f"Dòng {i+2}: MaSV '{masv}' chưa có, thiếu ?lop để gán lớp → bỏ qua")
-                continue
-            _ensure_user_and_student(masv, hoten, ngs, nois, lop)
-        else:
+    try:
+        upload = source or _spool_request_file()
+        fname = upload.filename
+        params = (lop, hoc_ky, allow_update, retake_policy, fuzzy_th)
+        if not preview:
+            run = _begin_run("grades", upload.digest, params, endpoint="/api/admin/import/grades",
+                             affected="KetQuaHocTap", filename=fname)
+            # Run dở (cursor > 0) chạy tiếp bằng cách parse lại phần còn lại của file
+            plan = None if run.cursor else plans().take("grades", upload.digest, params)
+        if plan is None:
+            frames = iter_frames(upload, dtype=str)
+            df = next(frames)
+    except AlreadyImported as e:
+        upload.close()
+        summary = e.summary()
+        return jsonify({"summary":summary,"preview":[],"warnings":summary["warnings"],"file":fname}), \
+            (409 if e.running else 200)
+    except Exception as e:
+        return _setup_failed(e)
+
+    # Xác nhận đúng file và tham số vừa preview: ghi thẳng kế hoạch đã parse, mỗi step một lô như khi parse
+    if plan is not None:
+        upload.close()
+        meta = plan.meta
+        alias_rows = meta["alias_rows"]; cursor = n_grades = 0
+        summary = {"total_rows": 0, "created": 0, "updated": 0, "skipped": 0, "warnings": list(meta["warnings"]),
+                   "aliases": meta["aliases"], "retake_flags_changed": 0, "from_preview": True}
+        for step in plan.steps:
+            summary["total_rows"] += step["total"]; summary["skipped"] += step["bad"]
+            summary["warnings"] += step["warnings"]; cursor += step["rows"]; n_grades += len(step["grades"])
             try:
-                if tb10 is not None:
-                    for attr in ("TBCHe10","TBCHT10","TBC_HT10","GPA10","DiemTBC10"):
-                        if hasattr(sv_exist, attr): setattr(sv_exist, attr, tb10); break
-                if sohp is not None:
-                    for attr in ("SoHPNo","SoMonNo","SoHocPhanNo"):
-                        if hasattr(sv_exist, attr): setattr(sv_exist, attr, sohp); break
-                if sotcno is not None:
-                    for attr in ("SoTinChiNo","SoTCNo"):
-                        if hasattr(sv_exist, attr): setattr(sv_exist, attr, sotcno); break
-            except Exception:
-                pass
+                res = _apply(step)
+                summary["created"] += res.inserted; summary["updated"] += res.updated; summary["skipped"] += res.skipped
+                _commit(res.masvs, cursor, summary, alias_rows)
+            except Exception as e:
+                return _stopped(e, meta["preview"], fname)
+            alias_rows = []
+            report_progress(processed=cursor, grades=n_grades, created=summary["created"],
+                            updated=summary["updated"], skipped=summary["skipped"])
+        return _save(summary, meta["preview"], fname)
 
-        w_sum=Decimal("0"); w_cnt=Decimal("0")
-        for col in subject_cols:
-            key = _norm_key(str(col))
-            if key in META_KEYS:
-                continue
+    try:
+        plan = Plan("grades", upload.digest, params)
+        if preview:
+            plan.watch([CATALOG, CONFIG])
+        ctdt_map = _build_ctdt_hocky_map_for_lop(lop)
+
+        cols_norm = {_norm_key(c): c for c in df.columns}
+        alias = {
+            "stt": {"stt","so","sott","sothutu"},
+            "masv": {"masv","ma sv","mssv","masinhvien","ma sinh vien","id","studentid","mãsinhviên"},
+            "hoten": {"hovaten","ho va ten","hoten","ten","fullname","name","họ và tên"},
+            "ngaysinh": {"ngaysinh","ngay sinh","dob","dateofbirth","ngày sinh"},
+            "noisinh": {"noisinh","noi sinh","quequan","que quan","birthplace","nơi sinh"},
+            "tenlop": {"tenlop","ten lop","lop","malop"},
+            "tbcht10": {"tbcht10","tbc ht10","tbcht 10","tbc he 10","tbc10","gpa10"},
+            "sohpno": {"sohpno","so hp no","somonno","nohp"},
+            "sotcno": {"sotinchino","so tin chi no","sotcno","notinchi"},
+        }
+        def _col(key):
+            for a in alias.get(key,set()):
+                k=_norm_key(a)
+                if k in cols_norm: return cols_norm[k]
+            return None
 
-            raw = row[col]
-            if pd.isna(raw):
+        col_masv  = _col("masv")
+        col_hoten = _col("hoten")
+        col_ngs   = _col("ngaysinh")
+        col_nois  = _col("noisinh")
+        col_tb10  = _col("tbcht10")
+        col_sohp  = _col("sohpno")
+        col_sotc  = _col("sotcno")
+        if not col_masv:
+            upload.close()
+            if run: run.fail("Thiếu cột Mã sinh viên")
+            return jsonify({"summary":{"total_rows":0,"created":0,"updated":0,"skipped":0,
+                                       "warnings":["Thiếu cột Mã sinh viên"]},
+                            "preview":[], "warnings":["Thiếu cột Mã sinh viên"], "file":fname}), 400
+
+        META_KEYS = {
+            _norm_key("STT"), _norm_key("Mã sinh viên"), _norm_key("Họ và tên"),
+            _norm_key("Ngày sinh"), _norm_key("Nơi sinh"), _norm_key("Tên lớp"),
+            _norm_key("TBC HT10"), _norm_key("Số HP nợ"), _norm_key("Số tín chỉ nợ"),
+            _norm_key("Ngày tổng hợp"), _norm_key("Người tổng hợp")
+        }
+        for k in ("stt", "masv", "hoten", "ngaysinh", "noisinh", "tenlop", "tbcht10", "sohpno", "sotcno"):
+            for a in alias.get(k, set()):
+                META_KEYS.add(_norm_key(a))
+        start_idx = list(df.columns).index(col_masv) + 1 if col_masv in df.columns else 0
+        subject_cols = []
+        for idx, c in enumerate(df.columns):
+            if idx < start_idx:
                 continue
-            v = _num_2(raw)
-            if v is None or not (0.0 <= v <= 10.0):
-                warnings.append(f"Dòng {i + 2}: Điểm không hợp lệ '{raw}' ở môn '{col}'")
+            key = _norm_key(str(c))
+            if _is_meta_header(key):
                 continue
+            subject_cols.append(c)
+        resolver = SubjectResolver.load(_norm_subject_name, threshold=fuzzy_th)
 
+        total=0; created=0; updated=0; skipped=0
+        warnings=[]; preview_rows=[]
+
+        def _format_hk_for_save(hk_val):
+            return str(hk_val) if hk_val is not None else None
+
+        header_tokens = {"masinhvien","ma sinh vien","mssv","mã sinh viên","hovaten","họ và tên",
+                         "ngaysinh","ngay sinh","nơi sinh","noisinh","tbc ht10","số hp nợ","số tín chỉ nợ"}
+
+        # Phân giải tiêu đề cột môn -> học phần một lần cho cả file; alias chỉ báo một lần
+        col_info = []; aliases = []
+        for col in subject_cols:
+            if _norm_key(str(col)) in META_KEYS:
+                continue
             subj_key = _norm_subject_name(str(col))
-            hobj = by_ten.get(subj_key)
-            if not hobj:
-                cand = _fuzzy_pick_subject(subj_key, by_ten)
-                if cand:
-                    hobj = cand
-                    warnings.append(f"[gợi ý] Cột '{col}' khớp gần với học phần '{cand.TenHP}' (fuzzy)")
-
-            if not hobj:
-                warnings.append(
-                    f"Dòng {i + 2}: Không khớp học phần cho cột '{col}' (norm='{subj_key}'). "
-                    f"→ Kiểm tra TenHP trong Danh mục HọcPhan hoặc chuẩn hoá tiêu đề cột."
-                )
+            hobj, how = resolver.resolve(subj_key)
+            col_info.append((col, subj_key, hobj))
+            if how in ("alias", "fuzzy"):
+                aliases.append({"column": str(col), "norm": subj_key, "MaHP": hobj.MaHP, "TenHP": hobj.TenHP, "source": how})
+                warnings.append(f"[gợi ý] Cột '{col}' khớp gần với học phần '{hobj.TenHP}' "
+                                f"({'fuzzy' if how == 'fuzzy' else 'alias đã lưu'})")
+
+        # Xử lý từng lô dòng (upload_stream): bộ nhớ đỉnh theo cỡ lô, không theo cỡ file. Mỗi lô được parse
+        # thành một step (SV mới, giá trị SV cần đặt, dòng điểm) không đụng session; preview so step với
+        # snapshot chỉ đọc, import thật ghi step ngay (_apply).
+        new_all = set(); processed = 0; n_grades = 0; bad_rows = 0
+        alias_rows = resolver.new_alias_rows(); head_warnings = list(warnings)
+        summary = {"total_rows": 0, "created": 0, "updated": 0, "skipped": 0, "warnings": warnings,
+                   "aliases": aliases, "retake_flags_changed": 0}
+        if run is not None and run.cursor:
+            # Chạy tiếp run dở: bộ đếm/cảnh báo lấy từ checkpoint, bỏ qua các dòng file đã commit
+            summary.update(run.state)
+            summary["resumed_from"] = processed = run.cursor
+            warnings = summary["warnings"]
+            total, created, updated, skipped = (summary[k] for k in ("total_rows", "created", "updated", "skipped"))
+        diff = Diff()
+        report_progress(total=estimate_rows(upload), processed=processed)
+    except Exception as e:
+        return _setup_failed(e)
+    try:
+        offset = 0
+        for df in itertools.chain([df], frames):
+            offset += len(df)
+            if offset <= processed:
                 continue
-            mahp = hobj.MaHP
+            if offset - len(df) < processed:
+                df = df.iloc[processed - (offset - len(df)):]
+            t0, b0 = total, bad_rows
+            row_masvs = [m for m in (str(x).strip() if pd.notna(x) else "" for x in df[col_masv])
+                         if m and _norm_key(m) not in header_tokens]
+            chunk_masvs = list(dict.fromkeys(row_masvs))
+            if preview:
+                plan.watch(sv_scope(m) for m in chunk_masvs)
+            sv_snap = {}
+            for part in chunked(chunk_masvs, 500):
+                sv_snap.update((r.MaSV, {"TBCHe10": r.TBCHe10, "SoHPNo": r.SoHPNo, "SoTinChiNo": r.SoTinChiNo})
+                               for r in db.session.execute(select(SinhVien.MaSV, SinhVien.TBCHe10, SinhVien.SoHPNo,
+                                                                  SinhVien.SoTinChiNo).where(SinhVien.MaSV.in_(part))))
+            step = {"new": {}, "sv": {}, "grades": []}
+
+            # (vị trí dòng, pha, vị trí cột, nội dung): sắp lại để cảnh báo giữ đúng thứ tự duyệt từng dòng
+            events = []
+            def _vals(c):
+                return df[c].tolist() if c else [None] * len(df)
+
+            active = pd.Series(False, index=df.index)
+            row_meta = {}
+            for pos, (i, v_masv, v_hoten, v_ngs, v_nois, v_tb10, v_sohp, v_sotc) in enumerate(zip(
+                    df.index, _vals(col_masv), _vals(col_hoten), _vals(col_ngs), _vals(col_nois),
+                    _vals(col_tb10), _vals(col_sohp), _vals(col_sotc))):
+                masv = str(v_masv).strip() if pd.notna(v_masv) else ""
+                if not masv: continue
+                if _norm_key(masv) in header_tokens:
+                    skipped += 1; bad_rows += 1
+                    events.append((pos, 0, 0, f"Dòng {i+2}: bỏ qua vì trùng tiêu đề")); continue
+
+                total += 1
+                hoten = (str(v_hoten).strip() if (col_hoten and pd.notna(v_hoten)) else None)
+                ngs   = _parse_date(v_ngs) if (col_ngs and pd.notna(v_ngs)) else None
+                nois  = (str(v_nois).strip() if (col_nois and pd.notna(v_nois)) else None)
+                tb10  = _num_2(v_tb10) if (col_tb10 and pd.notna(v_tb10)) else None
+
+                sohp=None
+                if col_sohp and pd.notna(v_sohp):
+                    try: sohp=int(str(v_sohp).strip())
+                    except Exception: sohp=None
+                sotcno=None
+                if col_sotc and pd.notna(v_sotc):
+                    try: sotcno=int(str(v_sotc).strip())
+                    except Exception: sotcno=None
+
+                if masv not in sv_snap and masv not in new_all:
+                    if not lop:
+                        skipped += 1; bad_rows += 1
+                        events.append((pos, 0, 0, f"Dòng {i+2}: MaSV '{masv}' chưa có, thiếu ?lop để gán lớp → bỏ qua"))
+                        continue
+                    step["new"][masv] = (hoten, ngs, nois); new_all.add(masv)
+                else:
+                    vals = step["sv"].setdefault(masv, {})
+                    if sohp is not None: vals["SoHPNo"] = sohp
+                    if sotcno is not None: vals["SoTinChiNo"] = sotcno
+
+                active.iloc[pos] = True
+                row_meta[pos] = (masv, hoten, tb10, sohp, sotcno)
+
+            # Khối điểm: WIDE -> TALL, kiểm tra miền giá trị và quy đổi điểm chữ trên cả cột
+            long = melt_wide(df, active, [c[0] for c in col_info])
+            info = pd.DataFrame({
+                "subj_key": [c[1] for c in col_info],
+                "mahp":     [c[2].MaHP if c[2] else None for c in col_info],
+                "stc":      [int(c[2].SoTinChi or 0) if c[2] else 0 for c in col_info],
+                "tdtl":     [bool(c[2].TinhDiemTichLuy) if c[2] else False for c in col_info],
+            })
+            info["hocky"] = [(_format_hk_for_save(ctdt_map[m]) if ctdt_map.get(m) is not None else hoc_ky) if m else None
+                             for m in info["mahp"]]
+            long = long.join(info, on="colpos")
+
+            invalid = long["v"].isna() | (long["v"] < 0.0) | (long["v"] > 10.0)
+            for r in long[invalid].itertuples():
+                events.append((r.rowpos, 1, r.colpos, f"Dòng {r.rowno}: Điểm không hợp lệ '{r.raw}' ở môn '{r.col}'"))
+            long = long[~invalid]
+            for r in long[long["mahp"].isna()].itertuples():
+                events.append((r.rowpos, 1, r.colpos,
+                               f"Dòng {r.rowno}: Không khớp học phần cho cột '{r.col}' (norm='{r.subj_key}'). "
+                               f"→ Kiểm tra TenHP trong Danh mục HọcPhan hoặc chuẩn hoá tiêu đề cột."))
+            long = long[long["mahp"].notna()]
+
+            letters, he4 = grade_letters(long["v"].to_numpy())
+            masv_by_pos = {p: m[0] for p, m in row_meta.items()}
+            step["grades"] = pd.DataFrame({
+                "MaSV": long["rowpos"].map(masv_by_pos).to_numpy(),
+                "MaHP": long["mahp"].to_numpy(),
+                "HocKy": long["hocky"].to_numpy(),
+                "DiemHe10": long["v"].astype(float).to_numpy(),
+                "DiemHe4": he4,
+                "DiemChu": letters,
+                "TinhDiemTichLuy": long["tdtl"].astype(bool).to_numpy(),
+            }).to_dict("records")
+
+            # TBC hệ 10 theo tín chỉ, tính bằng số nguyên (điểm x100) để khớp phép Decimal cũ
+            weighted = long[long["stc"] > 0]
+            w_sum100 = (np.rint(weighted["v"] * 100).astype("int64") * weighted["stc"]).groupby(weighted["rowpos"]).sum()
+            w_cnt = weighted["stc"].groupby(weighted["rowpos"]).sum()
+
+            for pos, (masv, hoten, tb10, sohp, sotcno) in row_meta.items():
+                chosen = None
+                calc = None
+                if w_cnt.get(pos, 0) > 0:
+                    calc = (Decimal(int(w_sum100[pos])) / Decimal(100 * int(w_cnt[pos]))).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
-            hk_from_ctdt = ctdt_map.get(mahp)
-            if hk_from_ctdt is not None:
-                hk_for_row = _format_hk_for_save(hk_from_ctdt)
-            else:
-                hk_for_row = hoc_ky
-
-            diemchu, he4, kq = _grade_letter(v)
-            stc = int(hobj.SoTinChi or 0)
-            if stc>0:
-                w_sum += Decimal(str(v))*Decimal(str(stc))
-                w_cnt += Decimal(str(stc))
-
-            rec = (db.session.query(KetQuaHocTap)
-                   .filter(KetQuaHocTap.MaSV==masv,
-                           KetQuaHocTap.MaHP==mahp,
-                           KetQuaHocTap.HocKy==hk_for_row)
-                   .first())
-            if rec:
-                if allow_update:
-                    rec.DiemHe10 = float(v)
-                    if hasattr(rec,"DiemHe4"):  rec.DiemHe4  = he4
-                    if hasattr(rec,"DiemChu"):  rec.DiemChu  = diemchu
-                    if hasattr(rec,"KetQua"):   rec.KetQua   = kq
-                    if hasattr(rec,"TinhDiemTichLuy"): rec.TinhDiemTichLuy = bool(hobj.TinhDiemTichLuy)
-                    updated += 1
+                if tb10 is not None:
+                    if calc is not None and abs(Decimal(str(tb10)) - calc) > EPS:
+                        events.append((pos, 2, 0, f"MaSV {masv}: TBC_HT10 file = {tb10}, tính lại = {float(calc)} (lệch)"))
+                    chosen = Decimal(str(tb10))
                 else:
-                    skipped += 1
+                    chosen = calc
+
+                if chosen is not None:
+                    val = float(Decimal(chosen).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+                    step["sv"].setdefault(masv, {})["TBCHe10"] = val
+
+                if len(preview_rows) < 80:
+                    preview_rows.append({"MaSV":masv,"HoTen":hoten,"TBC_HT10(file)":tb10,"SoHPNo":sohp,"SoTCNo":sotcno})
+
+            events.sort(key=lambda e: e[:3])
+            step_warnings = [e[3] for e in events]
+            warnings.extend(step_warnings)
+            processed += len(df); n_grades += len(step["grades"])
+
+            if preview:
+                c, u, s = _compare(step, sv_snap, diff)
+                step.update(rows=len(df), total=total - t0, bad=bad_rows - b0, warnings=step_warnings)
+                plan.add(step, len(step["grades"]))
+                created += c; updated += u; skipped += s
             else:
-                obj = KetQuaHocTap(MaSV=masv, MaHP=mahp, HocKy=hk_for_row, DiemHe10=float(v))
-                if hasattr(obj,"DiemHe4"):  obj.DiemHe4  = he4
-                if hasattr(obj,"DiemChu"):  obj.DiemChu  = diemchu
-                if hasattr(obj,"KetQua"):   obj.KetQua   = kq
-                if hasattr(obj,"TinhDiemTichLuy"): obj.TinhDiemTichLuy = bool(hobj.TinhDiemTichLuy)
-                db.session.add(obj); created += 1
-
-        chosen = None
-        calc = None
-        if w_cnt > 0:
-            calc = (w_sum / w_cnt).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-
-        if tb10 is not None:
-            if calc is not None and abs(Decimal(str(tb10)) - calc) > EPS:
-                warnings.append(
-                    f"MaSV {masv}: TBC_HT10 file = {tb10}, tính lại = {float(calc)} (lệch)"
-                )
-            chosen = Decimal(str(tb10))
-        else:
-            chosen = calc
-
-        if not preview and chosen is not None:
-            val = float(Decimal(chosen).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
-            sv_row = db.session.get(SinhVien, masv)
-            if sv_row:
-                for attr in ("TBCHe10", "TBCHT10", "TBC_HT10", "GPA10", "DiemTBC10"):
-                    if hasattr(sv_row, attr):
-                        setattr(sv_row, attr, val)
-                        break
-
-        if len(preview_rows) < 80:
-            preview_rows.append({"MaSV":masv,"HoTen":hoten,"TBC_HT10(file)":tb10,"SoHPNo":sohp,"SoTCNo":sotcno})
-
-    summary={"total_rows":total,"created":created,"updated":updated,"skipped":skipped,"warnings":warnings}
+                try:
+                    res = _apply(step)
+                    created += res.inserted; updated += res.updated; skipped += res.skipped
+                    summary.update(total_rows=total, created=created, updated=updated, skipped=skipped)
+                    _commit(res.masvs, processed, summary, alias_rows)
+                except Exception as e:
+                    return _stopped(e, preview_rows, fname)
+                alias_rows = []
+            report_progress(processed=processed, grades=n_grades, created=created, updated=updated, skipped=skipped)
+    except Exception as e:
+        if run is not None:
+            db.session.rollback(); run.fail(str(e))
+        raise
+    finally:
+        upload.close()
+
+    summary.update(total_rows=total, created=created, updated=updated, skipped=skipped)
 
     if preview:
-        db.session.rollback()
+        plan.meta = {"warnings": head_warnings, "aliases": aliases, "alias_rows": alias_rows,
+                     "preview": preview_rows}
+        summary.pop("retake_flags_changed")
+        summary["diff"] = diff.to_json()
+        summary["plan_cached"] = plans().put(plan)
+        summary["imported_before"] = _imported_before("grades", upload.digest, params)
         return jsonify({"summary":summary,"preview":preview_rows,"warnings":warnings,"file":fname}), 200
 
-    try:
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        summary["warnings"].append(f"Lỗi commit DB: {e}")
-        return jsonify({"summary":summary,"preview":preview_rows,"warnings":summary["warnings"],"file":fname}), 400
-
-    _audit_import(endpoint="/api/admin/import/grades", affected="KetQuaHocTap", summary=summary, filename=fname)
-    return jsonify({"summary":summary,"preview":preview_rows,"warnings":warnings,"file":fname}), 200
\ No newline at end of file
+    return _save(summary, preview_rows, fname)
@@ -0,0 +1,299 @@
+# backend/jobs.py
+# Chạy import/quét cảnh báo ở luồng nền thay vì chiếm worker gunicorn.
+# Hàng đợi nằm trong bảng Job (SQLite) nên worker nào rảnh cũng nhận được việc; file upload
+# được lưu tạm ra đĩa (JOB_SPOOL_DIR) và phát lại qua test_request_context cho hàm import gốc.
+#   - request phát lại không có JWT: người nộp (Job.Actor) đặt vào g.job_actor/g.job_actor_name, importer
+#     và audit_sink đọc trước JWT;
+#   - mỗi bộ chạy có một luồng heartbeat: cứ JOB_HEARTBEAT_SECONDS giây ghi HeartbeatAt và tiến độ mới
+#     (report_progress) vào dòng Job để worker khác đọc được. Ghi từ luồng riêng vì luồng job có thể
+#     đang giữ khoá ghi SQLite;
+#   - job "running" không có heartbeat quá JOB_STALE giây (tiến trình chết giữa chừng) bị đánh failed
+#     khi nhận việc, để giao diện không chờ mãi.
+from __future__ import annotations
+import json
+import os
+import tempfile
+import threading
+import shutil
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from flask import Flask, g
+from sqlalchemy import func, or_, select, update
+
+from .models import db, Job, NguoiDung
+
+
+JOB_STALE = 600.0
+HEARTBEAT = 5.0
+
+# kind -> (đường dẫn endpoint gốc, hàm chạy trong request context)
+_REGISTRY: Dict[str, tuple] = {}
+
+# Tiến độ của job đang chạy trong tiến trình này: {job_id: {...}}; _dirty: job có tiến độ chưa ghi vào DB
+_progress: Dict[int, Dict[str, Any]] = {}
+_dirty: set = set()
+_progress_lock = threading.Lock()
+_current = threading.local()
+
+
+def register(kind: str, path: str, fn: Callable[[], Any]):
+    _REGISTRY[kind] = (path, fn)
+
+
+def kinds():
+    return sorted(_REGISTRY)
+
+
+# Gọi từ importer/scan để cập nhật bộ đếm (processed, total, created, updated...); ngoài job thì bỏ qua.
+def report_progress(**counters):
+    job_id = getattr(_current, "job_id", None)
+    if job_id is None:
+        return
+    with _progress_lock:
+        _progress.setdefault(job_id, {}).update(counters)
+        _dirty.add(job_id)
+
+
+def live_progress(job_id: int) -> Optional[Dict[str, Any]]:
+    with _progress_lock:
+        p = _progress.get(job_id)
+        return dict(p) if p is not None else None
+
+
+def _spool_dir(app: Flask) -> str:
+    d = app.config.get("JOB_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "sars-jobs")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+# upload: một file, hoặc danh sách (import theo lô): nhiều file được lưu vào một thư mục
+# <spool>/job-xxx/<i>/<tên file> và phát lại thành các field 'files'
+def submit(kind: str, params: Dict[str, str], upload=None, actor: str = "") -> Job:
+    from flask import current_app
+
+    if kind not in _REGISTRY:
+        raise ValueError(f"Loại job không hỗ trợ: {kind}")
+    app = current_app._get_current_object()
+    uploads = [u for u in (upload if isinstance(upload, list) else [upload]) if u is not None and u.filename]
+    path = filename = None
+    if len(uploads) == 1:
+        upload = uploads[0]
+        fd, path = tempfile.mkstemp(prefix="job-", suffix=os.path.splitext(upload.filename)[1],
+                                    dir=_spool_dir(app))
+        with os.fdopen(fd, "wb") as fh:
+            upload.save(fh)
+        filename = upload.filename
+    elif uploads:
+        path = tempfile.mkdtemp(prefix="job-", dir=_spool_dir(app))
+        for i, u in enumerate(uploads):
+            os.makedirs(os.path.join(path, str(i)))
+            u.save(os.path.join(path, str(i), os.path.basename(u.filename)))
+        filename = f"{len(uploads)} files"
+    job = Job(Kind=kind, Status="queued", Params=json.dumps(params, ensure_ascii=False),
+              Filename=filename, FilePath=path, Actor=actor, CreatedAt=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    runner(app).wake()
+    return job
+
+
+def job_to_dict(job: Job, with_result: bool = False) -> Dict[str, Any]:
+    progress = live_progress(job.Id) if job.Status == "running" else None
+    if progress is None:
+        progress = json.loads(job.Progress) if job.Progress else {}
+    out = {
+        "Id": job.Id, "Kind": job.Kind, "Status": job.Status, "Filename": job.Filename,
+        "Actor": job.Actor, "Progress": progress, "HttpStatus": job.HttpStatus, "Error": job.Error,
+        "CreatedAt": job.CreatedAt.isoformat() if job.CreatedAt else None,
+        "StartedAt": job.StartedAt.isoformat() if job.StartedAt else None,
+        "FinishedAt": job.FinishedAt.isoformat() if job.FinishedAt else None,
+    }
+    if with_result:
+        out["Result"] = json.loads(job.Result) if job.Result else None
+    return out
+
+
+class JobRunner:
+    def __init__(self, app: Flask, workers: int = 1, poll: float = 2.0):
+        self.app = app
+        self.workers = max(1, workers)
+        self.poll = poll
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running: set = set()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+
+    # Job "running" mà tiến trình chạy nó đã chết: HeartbeatAt (hoặc StartedAt) cũ hơn JOB_STALE
+    def _recover_stale(self):
+        cutoff = datetime.utcnow() - timedelta(
+            seconds=float(self.app.config.get("JOB_STALE", JOB_STALE)))
+        stale = db.session.execute(select(Job.Id, Job.FilePath).where(
+            Job.Status == "running", func.coalesce(Job.HeartbeatAt, Job.StartedAt) < cutoff)).all()
+        for job_id, file_path in stale:
+            n = db.session.execute(
+                update(Job).where(Job.Id == job_id, Job.Status == "running",
+                                  or_(Job.HeartbeatAt.is_(None), Job.HeartbeatAt < cutoff))
+                .values(Status="failed", HttpStatus=500, FinishedAt=datetime.utcnow(),
+                        Error="Tiến trình chạy job đã dừng giữa chừng (không còn heartbeat).")).rowcount
+            db.session.commit()
+            if n == 1:
+                self.app.logger.warning("job %s: không còn heartbeat, đánh dấu failed", job_id)
+                _remove(file_path)
+
+    def _claim(self) -> Optional[int]:
+        with self.app.app_context():
+            self._recover_stale()
+            job_id = db.session.execute(
+                select(Job.Id).where(Job.Status == "queued").order_by(Job.Id).limit(1)).scalar()
+            if job_id is None:
+                return None
+            # UPDATE có điều kiện: chỉ một worker (kể cả ở tiến trình khác) nhận được job
+            n = db.session.execute(
+                update(Job).where(Job.Id == job_id, Job.Status == "queued")
+                .values(Status="running", StartedAt=datetime.utcnow(), HeartbeatAt=datetime.utcnow())).rowcount
+            db.session.commit()
+            return job_id if n == 1 else None
+
+    def _heartbeat(self):
+        with _progress_lock:
+            running = set(self._running)
+            dirty = {i: dict(_progress.get(i) or {}) for i in running & _dirty}
+            _dirty.difference_update(dirty)
+        if not running:
+            return
+        now = datetime.utcnow()
+        with self.app.app_context():
+            db.session.execute(update(Job).where(Job.Id.in_(running - set(dirty)), Job.Status == "running")
+                               .values(HeartbeatAt=now))
+            for job_id, progress in dirty.items():
+                db.session.execute(update(Job).where(Job.Id == job_id, Job.Status == "running").values(
+                    HeartbeatAt=now, Progress=json.dumps(progress, ensure_ascii=False, default=str)))
+            db.session.commit()
+
+    def _heartbeat_loop(self):
+        interval = float(self.app.config.get("JOB_HEARTBEAT_SECONDS", HEARTBEAT))
+        while not self._stop.wait(interval):
+            try:
+                self._heartbeat()
+            except Exception:
+                self.app.logger.exception("job heartbeat failed")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self._claim()
+            except Exception:
+                self.app.logger.exception("job claim failed")
+                job_id = None
+            if job_id is None:
+                self._wake.wait(self.poll)
+                self._wake.clear()
+                continue
+            self._execute(job_id)
+
+    def _execute(self, job_id: int):
+        app = self.app
+        with app.app_context():
+            job = db.session.get(Job, job_id)
+            kind, params = job.Kind, json.loads(job.Params or "{}")
+            file_path, filename = job.FilePath, job.Filename
+            actor = job.Actor or ""
+            user = db.session.get(NguoiDung, int(actor)) if actor.isdigit() else None
+            actor_name = user.TenDangNhap if user is not None else actor
+        path, fn = _REGISTRY[kind]
+
+        _current.job_id = job_id
+        with _progress_lock:
+            _progress[job_id] = {}
+            self._running.add(job_id)
+        status, result, error, http = "failed", None, None, 500
+        fhs, data = [], None
+        if file_path and os.path.isdir(file_path):
+            for i in sorted(os.listdir(file_path), key=int):
+                name = os.listdir(os.path.join(file_path, i))[0]
+                fhs.append((open(os.path.join(file_path, i, name), "rb"), name))
+            data = {"files": fhs}
+        elif file_path:
+            fhs.append((open(file_path, "rb"), filename))
+            data = {"file": fhs[0]}
+        try:
+            with app.test_request_context(path, method="POST", query_string=params, data=data):
+                g.job_actor, g.job_actor_name = actor, actor_name
+                try:
+                    resp = app.make_response(fn())
+                    result = resp.get_json(silent=True)
+                    http = resp.status_code
+                    status = "done" if http < 400 else "failed"
+                except Exception as e:
+                    db.session.rollback()
+                    http, error = 500, f"{e}\n{traceback.format_exc(limit=5)}"
+        finally:
+            for fh, _ in fhs:
+                fh.close()
+            _current.job_id = None
+            progress = live_progress(job_id) or {}
+            with _progress_lock:
+                _progress.pop(job_id, None)
+                _dirty.discard(job_id)
+                self._running.discard(job_id)
+            with app.app_context():
+                db.session.execute(update(Job).where(Job.Id == job_id).values(
+                    Status=status, HttpStatus=http, Error=error, FinishedAt=datetime.utcnow(),
+                    Progress=json.dumps(progress, ensure_ascii=False, default=str),
+                    Result=json.dumps(result, ensure_ascii=False, default=str) if result is not None else None))
+                db.session.commit()
+            _remove(file_path)
+
+
+def _remove(file_path: Optional[str]):
+    if file_path and os.path.isdir(file_path):
+        shutil.rmtree(file_path, ignore_errors=True)
+    elif file_path:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+
+def runner(app: Flask) -> JobRunner:
+    r = app.extensions.get("job_runner")
+    if r is None:
+        r = JobRunner(app, workers=int(app.config.get("JOB_WORKERS", 1)),
+                      poll=float(app.config.get("JOB_POLL_SECONDS", 2.0)))
+        app.extensions["job_runner"] = r
+    return r
+
+
+# Bộ chạy khởi động ở request đầu tiên (không chạy trong script/CLI chỉ gọi create_app)
+def init_app(app: Flask):
+    app.config.setdefault("JOB_WORKERS", int(os.getenv("JOB_WORKERS", "1")))
+    app.config.setdefault("JOB_SPOOL_DIR", os.getenv("JOB_SPOOL_DIR"))
+    app.config.setdefault("JOB_STALE", float(os.getenv("JOB_STALE", JOB_STALE)))
+    app.config.setdefault("JOB_HEARTBEAT_SECONDS", float(os.getenv("JOB_HEARTBEAT_SECONDS", HEARTBEAT)))
+    r = runner(app)
+
+    @app.before_request
+    def _start_job_runner():
+        r.start()
@@ -0,0 +1,353 @@
+# backend/migrations.py
+# Đưa app.db cũ lên lược đồ hiện tại. db.create_all() chỉ tạo bảng mới: bỏ qua bảng đã tồn tại, kể cả
+# cột và chỉ mục mới khai báo trên bảng đó. Khi khởi động (create_app):
+#   1. MIGRATIONS theo thứ tự: bước schema (thêm cột...) chạy ngay, idempotent;
+#   2. ensure_indexes(): tạo chỉ mục khai báo trong models.py còn thiếu (so theo tên);
+#   3. backfill của các migration chạy theo lô, mỗi lô một transaction ngắn (BACKFILL_BATCH dòng, nghỉ
+#      BACKFILL_PAUSE giây giữa các lô) nên không giữ khoá ghi SQLite nhiều phút. Mặc định chạy ở thread
+#      nền (MIGRATIONS_BACKFILL=thread; "inline" chạy xong mới phục vụ, "off" để chạy bằng CLI). Nhiều
+#      worker cùng khởi động thì chỉ tiến trình giữ lease (SchemaMigration.Owner/HeartbeatAt) chạy
+#      backfill; lô dựa trên điều kiện "chưa có giá trị" nên dừng giữa chừng thì lần sau làm tiếp.
+# Migration chỉ được đánh dấu done khi backfill xong; code đọc cột mới phải chấp nhận NULL trong lúc đó.
+#   python -m backend.migrations [status|upgrade|indexes]
+from __future__ import annotations
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import sqlalchemy as sa
+from flask import Flask
+
+from .db_profile import no_statement_timeout
+from .models import db, SinhVien, KetQuaHocTap, ImportLog, Job, SchemaMigration, StudentAggregate
+
+log = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 5000
+BACKFILL_PAUSE = 0.05
+LEASE_SECONDS = 60
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+@dataclass(frozen=True)
+class AddColumn:
+    column: sa.Column                     # cột đã khai báo trên model
+
+    def apply(self, engine) -> None:
+        table = self.column.table.name
+        have = {c["name"] for c in sa.inspect(engine).get_columns(table)}
+        if self.column.name in have:
+            return
+        ddl = sa.schema.CreateColumn(self.column).compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {ddl}')
+        log.info("đã thêm cột %s.%s", table, self.column.name)
+
+
+# CSDL cũ có thể còn nhiều dòng điểm cùng (MaSV, MaHP, HocKy) nên chỉ mục unique (ON CONFLICT của
+# upsert_grades) không tạo được. Giữ một dòng mỗi khoá (dòng LaDiemCuoiCung, rồi MaKQ lớn nhất), xoá phần
+# còn lại, tính lại cờ thi lại/StudentAggregate/phiên bản dữ liệu của sinh viên bị ảnh hưởng rồi tạo chỉ
+# mục; tạo không được thì lỗi để migration không được đánh dấu done.
+@dataclass(frozen=True)
+class DedupeGrades:
+    index: sa.Index
+
+    def apply(self, engine) -> None:
+        from .config_cache import settings
+        from .data_version import bump, sv_scope
+        from .grade_writer import resolve_retakes
+        from .services.student_aggregate import refresh_students
+
+        t = self.index.table
+        if self.index.name in {ix["name"] for ix in sa.inspect(engine).get_indexes(t.name)}:
+            return
+        keys = (t.c.MaSV, t.c.MaHP, t.c.HocKy)
+        dup = sa.select(*keys).group_by(*keys).having(sa.func.count() > 1).subquery()
+        rn = sa.func.row_number().over(partition_by=keys, order_by=(
+            sa.func.coalesce(t.c.LaDiemCuoiCung, False).desc(), t.c.MaKQ.desc()))
+        ranked = (sa.select(t.c.MaKQ, t.c.MaSV, rn.label("rn"))
+                  .join(dup, sa.and_(*(k == dup.c[k.name] for k in keys))).subquery())
+        rows = db.session.execute(sa.select(ranked.c.MaKQ, ranked.c.MaSV).where(ranked.c.rn > 1)).all()
+        if rows:
+            masvs = {m for _, m in rows}
+            ids = [k for k, _ in rows]
+            for i in range(0, len(ids), 500):
+                db.session.execute(sa.delete(t).where(t.c.MaKQ.in_(ids[i:i + 500])))
+            resolve_retakes(settings().retake_policy, masvs)
+            refresh_students(masvs)
+            bump(sv_scope(m) for m in masvs)
+            db.session.commit()
+            log.warning("đã xoá %d dòng điểm trùng khoá của %d sinh viên", len(ids), len(masvs))
+        db.session.rollback()
+        with engine.begin() as conn:
+            no_statement_timeout(conn)
+            self.index.create(conn, checkfirst=True)
+        log.info("đã tạo chỉ mục %s", self.index.name)
+
+
+# UPDATE theo lô trên khoá chính số nguyên: lấy BACKFILL_BATCH khoá kế tiếp thoả `where` rồi cập nhật
+# khoảng đó. `where` phải loại các dòng đã xong (vd. cột mới IS NULL) để chạy lại được.
+@dataclass(frozen=True)
+class Backfill:
+    pk: sa.Column
+    values: Callable[[], Dict[str, Any]]
+    where: Callable[[], Any]
+
+    def run(self, engine, heartbeat: Callable[[int], bool], batch: int, pause: float) -> int:
+        table = self.pk.table
+        done, last = 0, None
+        while True:
+            with engine.begin() as conn:
+                q = sa.select(self.pk).where(self.where()).order_by(self.pk).limit(batch)
+                if last is not None:
+                    q = q.where(self.pk > last)
+                ids = conn.execute(q).scalars().all()
+                if not ids:
+                    return done
+                conn.execute(sa.update(table).where(self.pk.between(ids[0], ids[-1]), self.where())
+                             .values(self.values()))
+            done += len(ids)
+            last = ids[-1]
+            if not heartbeat(done):
+                raise RuntimeError("mất lease migration")
+            if pause:
+                time.sleep(pause)
+
+
+# StudentAggregate cho sinh viên có điểm mà chưa có dòng tổng hợp (CSDL cũ từ trước khi có bảng, hoặc
+# bảng bị xoá). Theo lô sinh viên (≈ batch/50), mỗi lô một transaction qua refresh_students nên cũng
+# tăng phiên bản dữ liệu và đánh dấu quét cảnh báo như import; dừng giữa chừng thì lần sau làm tiếp.
+@dataclass(frozen=True)
+class RefreshAggregates:
+    def run(self, engine, heartbeat: Callable[[int], bool], batch: int, pause: float) -> int:
+        from .services.student_aggregate import refresh_students
+
+        kq, agg = KetQuaHocTap.__table__, StudentAggregate.__table__
+        per = max(1, batch // 50)
+        done, last = 0, None
+        while True:
+            q = (sa.select(kq.c.MaSV).where(~sa.exists().where(agg.c.MaSV == kq.c.MaSV))
+                 .group_by(kq.c.MaSV).order_by(kq.c.MaSV).limit(per))
+            if last is not None:
+                q = q.where(kq.c.MaSV > last)
+            masvs = db.session.execute(q).scalars().all()
+            if not masvs:
+                db.session.rollback()
+                return done
+            refresh_students(masvs)
+            db.session.commit()
+            done += len(masvs)
+            last = masvs[-1]
+            if not heartbeat(done):
+                raise RuntimeError("mất lease migration")
+            if pause:
+                time.sleep(pause)
+
+
+@dataclass(frozen=True)
+class Migration:
+    id: str
+    schema: Sequence[Any] = ()                                  # AddColumn | DedupeGrades
+    backfill: Sequence[Any] = field(default_factory=tuple)      # Backfill | RefreshAggregates
+
+
+def _ket_qua_values():
+    from .grade_writer import ket_qua_sql
+    return {"KetQua": ket_qua_sql()}
+
+
+MIGRATIONS: List[Migration] = [
+    Migration("0001_sinhvien_tong_hop_file", schema=[
+        AddColumn(SinhVien.__table__.c.TBCHe10),
+        AddColumn(SinhVien.__table__.c.SoHPNo),
+        AddColumn(SinhVien.__table__.c.SoTinChiNo),
+    ]),
+    Migration("0002_ketquahoctap_ketqua",
+              schema=[AddColumn(KetQuaHocTap.__table__.c.KetQua)],
+              backfill=[Backfill(KetQuaHocTap.__table__.c.MaKQ, _ket_qua_values,
+                                 lambda: KetQuaHocTap.__table__.c.KetQua.is_(None))]),
+    Migration("0003_importlog_run", schema=[
+        AddColumn(ImportLog.__table__.c.ImportKey),
+        AddColumn(ImportLog.__table__.c.Status),
+        AddColumn(ImportLog.__table__.c.Cursor),
+        AddColumn(ImportLog.__table__.c.UpdatedAt),
+    ]),
+    Migration("0004_studentaggregate_fill", backfill=[RefreshAggregates()]),
+    Migration("0005_job_heartbeat", schema=[AddColumn(Job.__table__.c.HeartbeatAt)]),
+    Migration("0006_ketquahoctap_dedupe", schema=[DedupeGrades(next(
+        ix for ix in KetQuaHocTap.__table__.indexes if ix.name == "ux_KetQuaHocTap_MaSV_MaHP_HocKy"))]),
+]
+
+
+def _state() -> Dict[str, SchemaMigration]:
+    return {m.Id: m for m in db.session.query(SchemaMigration).all()}
+
+
+def _mark(mid: str, **values):
+    t = SchemaMigration.__table__
+    with db.engine.begin() as conn:
+        if conn.execute(sa.update(t).where(t.c.Id == mid).values(**values)).rowcount == 0:
+            conn.execute(sa.insert(t).values(Id=mid, **{"Status": "pending", "Rows": 0, **values}))
+
+
+# Giành lease: chưa có chủ, của chính mình, hoặc chủ cũ không heartbeat quá LEASE_SECONDS
+def _claim(mid: str) -> bool:
+    t = SchemaMigration.__table__
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        res = conn.execute(sa.update(t).where(
+            t.c.Id == mid, t.c.Status != "done",
+            sa.or_(t.c.Owner.is_(None), t.c.Owner == _OWNER,
+                   t.c.HeartbeatAt < now - timedelta(seconds=LEASE_SECONDS)),
+        ).values(Status="running", Owner=_OWNER, HeartbeatAt=now))
+        return res.rowcount == 1
+
+
+def _heartbeat(mid: str, rows: int) -> bool:
+    t = SchemaMigration.__table__
+    with db.engine.begin() as conn:
+        res = conn.execute(sa.update(t).where(t.c.Id == mid, t.c.Owner == _OWNER)
+                           .values(HeartbeatAt=datetime.utcnow(), Rows=rows))
+        return res.rowcount == 1
+
+
+def apply_schema() -> List[Migration]:
+    state = _state()
+    pending = [m for m in MIGRATIONS if getattr(state.get(m.id), "Status", None) != "done"]
+    db.session.rollback()
+    for m in pending:
+        for step in m.schema:
+            step.apply(db.engine)
+        if m.backfill:
+            if m.id not in state:
+                _mark(m.id, Status="pending")
+        else:
+            _mark(m.id, Status="done", AppliedAt=datetime.utcnow())
+            log.info("migration %s: done", m.id)
+    return [m for m in pending if m.backfill]
+
+
+# Trả về danh sách migration đã xong trong lần gọi này (bỏ qua migration đang do tiến trình khác chạy)
+def run_backfills(migrations: Sequence[Migration], batch: int = BACKFILL_BATCH,
+                  pause: float = BACKFILL_PAUSE) -> List[str]:
+    finished = []
+    for m in migrations:
+        if not _claim(m.id):
+            log.info("migration %s: tiến trình khác đang chạy backfill", m.id)
+            continue
+        t, rows = time.time(), 0
+        for step in m.backfill:
+            rows += step.run(db.engine, lambda n: _heartbeat(m.id, rows + n), batch, pause)
+        _mark(m.id, Status="done", Rows=rows, AppliedAt=datetime.utcnow(), Owner=None)
+        log.info("migration %s: backfill %d dòng (%.1fs)", m.id, rows, time.time() - t)
+        finished.append(m.id)
+    return finished
+
+
+def missing_indexes(conn) -> List[sa.Index]:
+    insp = sa.inspect(conn)
+    tables = set(insp.get_table_names())
+    out = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        have = {ix["name"] for ix in insp.get_indexes(table.name)}
+        out += [ix for ix in sorted(table.indexes, key=lambda i: i.name) if ix.name not in have]
+    return out
+
+
+# Trả về tên các chỉ mục đã tạo. Chỉ mục unique không tạo được vì dữ liệu trùng thì ghi log và bỏ qua.
+def ensure_indexes() -> List[str]:
+    created = []
+    with db.engine.connect() as conn:
+        todo = missing_indexes(conn)
+    for ix in todo:
+        t = time.time()
+        try:
+            with db.engine.begin() as conn:
+                no_statement_timeout(conn)
+                ix.create(conn, checkfirst=True)
+        except sa.exc.IntegrityError as e:
+            log.warning("không tạo được chỉ mục %s: %s", ix.name, e.orig)
+            continue
+        created.append(ix.name)
+        log.info("đã tạo chỉ mục %s (%.1fs)", ix.name, time.time() - t)
+    if created and db.engine.dialect.name == "sqlite":
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    return created
+
+
+def _backfill_thread(app: Flask, migrations: Sequence[Migration]):
+    def run():
+        with app.app_context():
+            try:
+                run_backfills(migrations, app.config["MIGRATIONS_BACKFILL_BATCH"],
+                              app.config["MIGRATIONS_BACKFILL_PAUSE"])
+            except Exception:
+                app.logger.exception("backfill migration lỗi")
+            finally:
+                db.session.remove()
+    th = threading.Thread(target=run, name="migrations-backfill", daemon=True)
+    th.start()
+    return th
+
+
+def init_app(app: Flask) -> Optional[threading.Thread]:
+    app.config.setdefault("MIGRATIONS_BACKFILL", os.getenv("MIGRATIONS_BACKFILL", "thread"))
+    app.config.setdefault("MIGRATIONS_BACKFILL_BATCH", int(os.getenv("MIGRATIONS_BACKFILL_BATCH", BACKFILL_BATCH)))
+    app.config.setdefault("MIGRATIONS_BACKFILL_PAUSE", float(os.getenv("MIGRATIONS_BACKFILL_PAUSE", BACKFILL_PAUSE)))
+    with app.app_context():
+        try:
+            pending = apply_schema()
+            ensure_indexes()
+        except Exception:
+            app.logger.exception("không cập nhật được lược đồ")
+            return None
+        mode = app.config["MIGRATIONS_BACKFILL"]
+        if not pending or mode == "off":
+            return None
+        if mode == "inline":
+            run_backfills(pending, app.config["MIGRATIONS_BACKFILL_BATCH"], app.config["MIGRATIONS_BACKFILL_PAUSE"])
+            return None
+    return _backfill_thread(app, pending)
+
+
+def main(argv: List[str]) -> int:
+    from .app import create_app
+
+    cmd = argv[0] if argv else "status"
+    os.environ.setdefault("MIGRATIONS_BACKFILL", "off")
+    app = create_app()
+    with app.app_context():
+        if cmd == "upgrade":
+            pending = apply_schema()
+            ensure_indexes()
+            run_backfills(pending, app.config["MIGRATIONS_BACKFILL_BATCH"], 0)
+            cmd = "status"
+        if cmd == "status":
+            state = _state()
+            for m in MIGRATIONS:
+                s = state.get(m.id)
+                print(f"{m.id:40s} {getattr(s, 'Status', 'pending'):8s} rows={getattr(s, 'Rows', 0)}")
+            with db.engine.connect() as conn:
+                left = missing_indexes(conn)
+            print("missing indexes:", ", ".join(ix.name for ix in left) or "-")
+            return 0 if all(getattr(state.get(m.id), "Status", None) == "done" for m in MIGRATIONS) and not left else 1
+        if cmd == "indexes":
+            with db.engine.connect() as conn:
+                left = missing_indexes(conn)
+            print("missing:", ", ".join(ix.name for ix in left) or "-")
+            return 1 if left else 0
+    print("usage: python -m backend.migrations [status|upgrade|indexes]")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
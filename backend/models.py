@@ -30,6 +30,10 @@ class LopHoc(db.Model):
     MaNganh = db.Column(db.String(50), db.ForeignKey('NganhHoc.MaNganh'), nullable=True)
     sinh_vien_rel = db.relationship('SinhVien', backref='lop_hoc', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_LopHoc_MaNganh', 'MaNganh'),
+    )
+
 class VaiTro(db.Model):
     __tablename__ = 'VaiTro'
     MaVaiTro = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -55,9 +59,17 @@ class SinhVien(db.Model):
     TrangThaiHocTap = db.Column(db.String(50), nullable=False, default='Đang học')
     MaLop = db.Column(db.String(50), db.ForeignKey('LopHoc.MaLop'), nullable=True)
     MaNguoiDung = db.Column(db.Integer, db.ForeignKey('NguoiDung.MaNguoiDung'), unique=True, nullable=False)
+    # Số liệu tổng hợp ghi trong file điểm (TBC_HT10, số HP nợ, số TC nợ); migration 0001
+    TBCHe10 = db.Column(db.Float, nullable=True)
+    SoHPNo = db.Column(db.Integer, nullable=True)
+    SoTinChiNo = db.Column(db.Integer, nullable=True)
     nguoi_dung_rel = db.relationship('NguoiDung', back_populates='sinh_vien_rel')
     ket_qua_hoc_tap_rel = db.relationship('KetQuaHocTap', backref='sinh_vien', lazy='dynamic', cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('ix_SinhVien_MaLop', 'MaLop'),
+    )
+
 class HocPhan(db.Model):
     __tablename__ = 'HocPhan'
     MaHP = db.Column(db.String(50), primary_key=True)
@@ -66,6 +78,14 @@ class HocPhan(db.Model):
     KhoiKienThuc = db.Column(db.String(100), nullable=True)
     TinhDiemTichLuy = db.Column(db.Boolean, nullable=False, default=True)
 
+class SubjectAlias(db.Model):
+    __tablename__ = 'SubjectAlias'
+    Alias = db.Column(db.String(255), primary_key=True)   # tiêu đề cột đã chuẩn hoá
+    MaHP = db.Column(db.String(50), db.ForeignKey('HocPhan.MaHP', ondelete='CASCADE'), nullable=False)
+    Source = db.Column(db.String(20), nullable=False, default='fuzzy')  # fuzzy|manual
+    Score = db.Column(db.Float, nullable=True)
+    CreatedAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class ChuongTrinhDaoTao(db.Model):
     __tablename__ = 'ChuongTrinhDaoTao'
     MaCTDT = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -75,6 +95,10 @@ class ChuongTrinhDaoTao(db.Model):
     MaHP = db.Column(db.String(50), db.ForeignKey('HocPhan.MaHP'), nullable=False)
     hoc_phan_rel = db.relationship('HocPhan')
 
+    __table_args__ = (
+        db.Index('ix_ChuongTrinhDaoTao_MaNganh_HocKy_MaHP', 'MaNganh', 'HocKy', 'MaHP'),
+    )
+
 class KetQuaHocTap(db.Model):
     __tablename__ = 'KetQuaHocTap'
     MaKQ = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -84,11 +108,32 @@ class KetQuaHocTap(db.Model):
     DiemChu = db.Column(db.String(5))
     LaDiemCuoiCung = db.Column(db.Boolean, default=True, nullable=False)
     TinhDiemTichLuy = db.Column(db.Boolean, default=True, nullable=False)
+    # "Đạt" | "Không đạt" (grade_writer.ket_qua); migration 0002, NULL khi chưa backfill xong
+    KetQua = db.Column(db.String(20), nullable=True)
 
     MaSV = db.Column(db.String(50), db.ForeignKey('SinhVien.MaSV'), nullable=False)
     MaHP = db.Column(db.String(50), db.ForeignKey('HocPhan.MaHP'), nullable=False)
     hoc_phan_rel = db.relationship('HocPhan', backref='ket_qua_hoc_tap_rel')
 
+    # ux_... cũng phục vụ mọi truy vấn theo MaSV (tiền tố trái). Không đánh chỉ mục LaDiemCuoiCung:
+    # gần như mọi dòng đều True nên chỉ mục không lọc được gì.
+    __table_args__ = (
+        db.Index('ux_KetQuaHocTap_MaSV_MaHP_HocKy', 'MaSV', 'MaHP', 'HocKy', unique=True),
+        db.Index('ix_KetQuaHocTap_MaHP_MaSV', 'MaHP', 'MaSV'),
+    )
+
+class StudentAggregate(db.Model):
+    __tablename__ = 'StudentAggregate'
+    MaSV = db.Column(db.String(50), db.ForeignKey('SinhVien.MaSV', ondelete='CASCADE'), primary_key=True)
+    GPA4 = db.Column(db.Float, nullable=True)
+    GPA10 = db.Column(db.Float, nullable=True)
+    CreditsAttempted = db.Column(db.Integer, nullable=False, default=0)
+    CreditsPassed = db.Column(db.Integer, nullable=False, default=0)
+    CreditsDebt = db.Column(db.Integer, nullable=False, default=0)
+    FailCount = db.Column(db.Integer, nullable=False, default=0)
+    LastTerm = db.Column(db.String(50), nullable=True)
+    UpdatedAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class SystemConfig(db.Model):
     __tablename__ = 'SystemConfig'
     ConfigKey = db.Column(db.String(50), primary_key=True)
@@ -131,10 +176,59 @@ class WarningCase(db.Model):
     CreatedAt = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     ClosedAt = db.Column(db.DateTime, nullable=True)
 
+    # (Status) kèm rowid ngầm định: lọc theo trạng thái đã theo thứ tự Id, không cần sắp xếp
+    __table_args__ = (
+        db.Index('ix_WarningCase_Status', 'Status'),
+        db.Index('ix_WarningCase_MaSV_Status_RuleId', 'MaSV', 'Status', 'RuleId'),
+    )
+
+# Sinh viên có điểm thay đổi từ lần quét cảnh báo trước (quét tăng dần chỉ xét các MaSV này)
+class WarningDirty(db.Model):
+    __tablename__ = "WarningDirty"
+    MaSV = db.Column(db.String(50), primary_key=True)
+    MarkedAt = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# Migration đã/đang áp dụng; Owner/HeartbeatAt là lease của tiến trình đang chạy backfill. Xem backend/migrations.py
+class SchemaMigration(db.Model):
+    __tablename__ = "SchemaMigration"
+    Id = db.Column(db.String(100), primary_key=True)
+    Status = db.Column(db.String(20), default="pending", nullable=False)   # pending|running|done
+    Owner = db.Column(db.String(100), nullable=True)
+    HeartbeatAt = db.Column(db.DateTime, nullable=True)
+    Rows = db.Column(db.Integer, default=0, nullable=False)
+    AppliedAt = db.Column(db.DateTime, nullable=True)
+
+# Bộ đếm phiên bản dữ liệu theo phạm vi ("sv:<MaSV>", "user:<MaNguoiDung>", "catalog"...);
+# tăng mỗi khi dữ liệu thuộc phạm vi thay đổi, dùng làm ETag/khoá cache. Xem backend/data_version.py
+class DataVersion(db.Model):
+    __tablename__ = "DataVersion"
+    Scope = db.Column(db.String(120), primary_key=True)
+    Version = db.Column(db.Integer, default=0, nullable=False)
+    UpdatedAt = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# Hàng đợi tác vụ nền (import, quét cảnh báo); xem backend/jobs.py
+class Job(db.Model):
+    __tablename__ = "Job"
+    Id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    Kind = db.Column(db.String(50), nullable=False)
+    Status = db.Column(db.String(20), default="queued", nullable=False, index=True)  # queued|running|done|failed
+    Params = db.Column(db.Text, nullable=True)
+    Filename = db.Column(db.String(255), nullable=True)
+    FilePath = db.Column(db.String(500), nullable=True)
+    Actor = db.Column(db.String(100), nullable=True)
+    Progress = db.Column(db.Text, nullable=True)
+    Result = db.Column(db.Text, nullable=True)
+    HttpStatus = db.Column(db.Integer, nullable=True)
+    Error = db.Column(db.Text, nullable=True)
+    CreatedAt = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    StartedAt = db.Column(db.DateTime, nullable=True)
+    HeartbeatAt = db.Column(db.DateTime, nullable=True)
+    FinishedAt = db.Column(db.DateTime, nullable=True)
+
 class ImportLog(db.Model):
     __tablename__ = "ImportLog"
     RunId = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    When = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    When = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     Actor = db.Column(db.String(64), nullable=True)
     Endpoint = db.Column(db.String(128), nullable=False)
     Params = db.Column(db.Text, nullable=True)
@@ -142,6 +236,12 @@ class ImportLog(db.Model):
     Summary = db.Column(db.Text, nullable=True)
     AffectedTable = db.Column(db.String(64), nullable=True)
     InsertedIds = db.Column(db.Text, nullable=True)
+    # Import thật (preview=0): SHA-256(loại, file, tham số) + trạng thái running/done/failed + số dòng file
+    # đã commit (xem backend/import_runs.py). NULL ở các dòng nhật ký khác.
+    ImportKey = db.Column(db.String(64), nullable=True, index=True)
+    Status = db.Column(db.String(16), nullable=True)
+    Cursor = db.Column(db.Integer, nullable=True)
+    UpdatedAt = db.Column(db.DateTime, nullable=True)
 
 class AuditLog(db.Model):
     __tablename__ = "AuditLog"
@@ -0,0 +1,117 @@
+# backend/query_budget.py
+# Đếm số câu SQL trong mỗi request. Endpoint gắn @query_budget(n) trả header X-Query-Count và
+# ghi cảnh báo khi vượt n; QUERY_BUDGET_STRICT=True (khi chạy kiểm tra) biến vượt ngân sách thành lỗi.
+# Kiểm tra /api/student/data trên CSDL SQLite tạm (sinh viên ~60 kết quả, CTĐT 70 học phần):
+#   python -m backend.query_budget            (mã thoát 1 nếu vượt STUDENT_DATA_QUERY_BUDGET)
+from __future__ import annotations
+import os
+import sys
+import tempfile
+from functools import wraps
+from typing import List
+
+from flask import Flask, current_app, g, has_request_context, make_response
+from sqlalchemy import event
+
+from .models import db
+
+
+def _count(*_args, **_kw):
+    if has_request_context():
+        g._query_count = g.get("_query_count", 0) + 1
+
+
+def query_count() -> int:
+    return g.get("_query_count", 0) if has_request_context() else 0
+
+
+def query_budget(limit: int):
+    def deco(fn):
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            start = query_count()
+            resp = make_response(fn(*args, **kwargs))
+            n = query_count() - start
+            resp.headers["X-Query-Count"] = str(n)
+            if n > limit:
+                msg = f"{fn.__name__}: {n} câu SQL, vượt ngân sách {limit}"
+                if current_app.config.get("QUERY_BUDGET_STRICT"):
+                    raise AssertionError(msg)
+                current_app.logger.warning(msg)
+            return resp
+        return wrapped
+    return deco
+
+
+def init_app(app: Flask):
+    app.config.setdefault("QUERY_BUDGET_STRICT", False)
+    with app.app_context():
+        if not event.contains(db.engine, "before_cursor_execute", _count):
+            event.listen(db.engine, "before_cursor_execute", _count)
+
+
+def _seed_student(courses: int, results: int, retakes: int) -> None:
+    from .models import Khoa, NganhHoc, LopHoc, HocPhan, SinhVien, ChuongTrinhDaoTao, KetQuaHocTap
+    from . import seed
+
+    uid = seed.ensure_user("sv_budget", "Sinh viên", "sv_budget@budget", "budget123")
+    db.session.add(Khoa(MaKhoa="K", TenKhoa="Khoa"))
+    db.session.add(NganhHoc(MaNganh="N", TenNganh="Ngành", MaKhoa="K"))
+    db.session.add(LopHoc(MaLop="L", TenLop="Lớp", MaNganh="N"))
+    db.session.add(SinhVien(MaSV="SV_BUDGET", HoTen="Sinh viên", MaLop="L", MaNguoiDung=uid))
+    for i in range(courses):
+        db.session.add(HocPhan(MaHP=f"HP{i:03d}", TenHP=f"Học phần {i}", SoTinChi=2 + i % 3, TinhDiemTichLuy=True))
+        db.session.add(ChuongTrinhDaoTao(MaNganh="N", MaHP=f"HP{i:03d}", HocKy=1 + i // 9, LaMonBatBuoc=i % 4 != 0))
+    for i in range(results):
+        retake = i >= results - retakes
+        mahp = f"HP{i - (results - retakes):03d}" if retake else f"HP{i:03d}"
+        d = 3.0 if not retake and i < retakes else 5.0 + i % 5
+        db.session.add(KetQuaHocTap(MaSV="SV_BUDGET", MaHP=mahp, HocKy=str(9 if retake else 1 + i // 9),
+                                    DiemHe10=d, DiemHe4=round(d * 0.4, 1), LaDiemCuoiCung=True,
+                                    TinhDiemTichLuy=True))
+    db.session.commit()
+
+
+# Một sinh viên ~60 kết quả (có học lại), CTĐT 70 học phần; đo lần đầu (dựng payload) và lần có ETag (304)
+def main(argv: List[str]) -> int:
+    with tempfile.TemporaryDirectory(prefix="query-budget-") as d:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(d, 'budget.db')}"
+        os.environ["MIGRATIONS_BACKFILL"] = "inline"
+        os.environ.setdefault("GEMINI_API_KEY", "budget")
+        from .app import create_app, STUDENT_DATA_QUERY_BUDGET
+        from .grade_writer import resolve_retakes
+
+        app = create_app()
+        with app.app_context():
+            _seed_student(courses=70, results=60, retakes=5)
+            resolve_retakes("keep-latest")
+            db.session.commit()
+        c = app.test_client()
+        token = c.post("/login", json={"username": "sv_budget", "password": "budget123"}).get_json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        failed = 0
+        r = c.get("/api/student/data", headers=headers)
+        body = r.get_json() or {}
+        print(f"payload: {len(body.get('KetQuaHocTap') or [])} kết quả, "
+              f"{len(body.get('ChuongTrinhDaoTao') or [])} học phần CTĐT")
+        for name, resp, code in (
+                ("cold", r, 200),
+                ("etag", c.get("/api/student/data", headers={**headers, "If-None-Match": r.headers.get("ETag", "")}), 304)):
+            n = int(resp.headers.get("X-Query-Count", -1))
+            ok = resp.status_code == code and 0 <= n <= STUDENT_DATA_QUERY_BUDGET
+            failed += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} /api/student/data {name}: HTTP {resp.status_code}, "
+                  f"{n} câu SQL (ngân sách {STUDENT_DATA_QUERY_BUDGET})")
+        # dừng luồng nền trước khi xoá CSDL tạm
+        app.extensions["audit_sink"].close()
+        r = app.extensions["job_runner"]
+        r.stop()
+        for th in r._threads:
+            th.join(5)
+        with app.app_context():
+            db.engine.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+# backend/query_plans.py
+# Kiểm tra kế hoạch truy vấn (EXPLAIN QUERY PLAN, SQLite) của các truy vấn nóng: mỗi truy vấn phải dùng
+# đúng chỉ mục khai báo trong models.py, và với những truy vấn cần thứ tự thì không được sắp xếp tạm
+# (USE TEMP B-TREE FOR ORDER BY). Chạy sau khi đổi chỉ mục hoặc truy vấn:
+#   python -m backend.query_plans            (mã thoát 1 nếu có truy vấn không đạt hoặc lỗi)
+# CSDL đang cấu hình không phải SQLite (DATABASE_URL=postgresql://...) thì kiểm tra trên file SQLite tạm
+# có cùng lược đồ/chỉ mục.
+from __future__ import annotations
+import os
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import Callable, List, Sequence
+
+import sqlalchemy as sa
+
+from .models import db, SinhVien, LopHoc, KetQuaHocTap, ChuongTrinhDaoTao, WarningCase, ImportLog
+from .exporter import EXPORTS
+from .services.student_aggregate import _aggregate_select
+
+_SV = ["SV0001", "SV0002"]
+_HP = ["HP01", "HP02"]
+
+
+@dataclass(frozen=True)
+class HotQuery:
+    name: str
+    build: Callable[[], sa.Select]
+    uses: Sequence[str]                 # chỉ mục phải xuất hiện trong kế hoạch; "a|b": một trong hai
+    no_sort: bool = False
+
+
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("aggregate.refresh", lambda: _aggregate_select(_SV), ["ux_KetQuaHocTap_MaSV_MaHP_HocKy"]),
+    HotQuery("aggregate.students_taking",
+             lambda: sa.select(KetQuaHocTap.MaSV).where(KetQuaHocTap.MaHP.in_(_HP)),
+             ["ix_KetQuaHocTap_MaHP_MaSV"]),
+    # grade_writer.load_grade_index
+    HotQuery("grade_writer.index",
+             lambda: sa.select(KetQuaHocTap.MaKQ, KetQuaHocTap.MaSV, KetQuaHocTap.MaHP, KetQuaHocTap.HocKy)
+             .where(KetQuaHocTap.MaSV.in_(_SV)),
+             ["ux_KetQuaHocTap_MaSV_MaHP_HocKy"]),
+    HotQuery("payload.results",
+             lambda: sa.select(KetQuaHocTap.MaHP, KetQuaHocTap.DiemHe10).where(KetQuaHocTap.MaSV == _SV[0])
+             .order_by(KetQuaHocTap.MaKQ),
+             ["ux_KetQuaHocTap_MaSV_MaHP_HocKy"]),
+    HotQuery("payload.plan",
+             lambda: sa.select(ChuongTrinhDaoTao.HocKy, ChuongTrinhDaoTao.MaHP)
+             .where(ChuongTrinhDaoTao.MaNganh == "CNTT")
+             .order_by(ChuongTrinhDaoTao.HocKy, ChuongTrinhDaoTao.MaHP),
+             ["ix_ChuongTrinhDaoTao_MaNganh_HocKy_MaHP"], no_sort=True),
+    HotQuery("analytics.major_students",
+             lambda: sa.select(sa.func.count(SinhVien.MaSV))
+             .join(LopHoc, LopHoc.MaLop == SinhVien.MaLop).where(LopHoc.MaNganh == "CNTT"),
+             ["ix_LopHoc_MaNganh", "ix_SinhVien_MaLop"]),
+    HotQuery("warning.open_by_student",
+             lambda: sa.select(WarningCase.Id, WarningCase.RuleId, WarningCase.MaSV)
+             .where(WarningCase.RuleId.in_([1, 2]), WarningCase.Status == "open", WarningCase.MaSV.in_(_SV)),
+             ["ix_WarningCase_MaSV_Status_RuleId"]),
+    HotQuery("warning.open_all",
+             lambda: sa.select(WarningCase.Id, WarningCase.RuleId, WarningCase.MaSV)
+             .where(WarningCase.RuleId.in_([1, 2]), WarningCase.Status == "open"),
+             ["ix_WarningCase_Status|ix_WarningCase_MaSV_Status_RuleId"]),
+    HotQuery("warning.list",
+             lambda: sa.select(WarningCase).where(WarningCase.Status == "open")
+             .order_by(WarningCase.Id.desc()).limit(20),
+             ["ix_WarningCase_Status"], no_sort=True),
+    HotQuery("import_log.recent",
+             lambda: sa.select(ImportLog).order_by(ImportLog.When.desc()).limit(200),
+             ["ix_ImportLog_When"], no_sort=True),
+    HotQuery("export.grades_by_course", lambda: EXPORTS["grades"].statement({"mahp": _HP[0]}),
+             ["ix_KetQuaHocTap_MaHP_MaSV"]),
+    HotQuery("export.grades_all", lambda: EXPORTS["grades"].statement({}),
+             ["ux_KetQuaHocTap_MaSV_MaHP_HocKy"], no_sort=True),
+]
+
+
+def explain(conn, stmt) -> List[str]:
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    return [r[-1] for r in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+
+
+# Danh sách (tên, lỗi, kế hoạch) của các truy vấn không đạt
+def check(conn, queries: Sequence[HotQuery] = HOT_QUERIES):
+    failures = []
+    for q in queries:
+        try:
+            plan = explain(conn, q.build())
+        except Exception as e:
+            failures.append((q.name, [f"lỗi: {e}"], []))
+            continue
+        text = "\n".join(plan)
+        errs = [f"không dùng {ix}" for ix in q.uses
+                if not any(f"INDEX {alt}" in text for alt in ix.split("|"))]
+        if q.no_sort and "TEMP B-TREE FOR ORDER BY" in text:
+            errs.append("sắp xếp tạm cho ORDER BY")
+        if errs:
+            failures.append((q.name, errs, plan))
+    return failures
+
+
+def main(argv: List[str]) -> int:
+    from sqlalchemy.engine import make_url
+    from .db_profile import database_uri
+
+    if make_url(database_uri("app.db")).get_backend_name() != "sqlite":
+        with tempfile.TemporaryDirectory(prefix="query-plans-") as d:
+            os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(d, 'plans.db')}"
+            return _main()
+    return _main()
+
+
+def _main() -> int:
+    from .app import create_app
+
+    app = create_app()
+    with app.app_context():
+        try:
+            with db.engine.connect() as conn:
+                failures = check(conn)
+        finally:
+            db.engine.dispose()
+    for name, errs, plan in failures:
+        print(f"FAIL {name}: {'; '.join(errs)}")
+        for line in plan:
+            print(f"    {line}")
+    print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} hot queries use their indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,114 @@
+# backend/services/analytics_cache.py
+# Snapshot dashboard theo (slice, MaNganh), gắn phiên bản "global" của data_version lúc tính.
+# Slice đã serialize sẵn nên lần đọc trúng chỉ là vài phép tra dict:
+#   - phiên bản kiểm tra qua VersionWatch (TTL = ANALYTICS_VERSION_TTL giây);
+#   - snapshot cũ vẫn được trả trong lúc luồng nền tính lại; commit có thay đổi dữ liệu cũng
+#     đẩy mọi snapshot đã có vào hàng tính lại;
+#   - ?MaNganh= phải là ngành có trong NganhHoc (tập mã đọc lại khi phiên bản catalog đổi), ngành lạ trả
+#     404 nên số snapshot tối đa là số ngành cộng các slice không lọc; ngành bị xoá thì snapshot bị bỏ.
+from __future__ import annotations
+import os
+import threading
+from typing import Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from flask import Flask, current_app, jsonify
+from sqlalchemy import select
+
+from ..models import db, NganhHoc
+from ..data_version import CATALOG, GLOBAL, VersionWatch, on_commit, versions
+from .analytics_service import get_dashboard_analytics, get_top_failing_courses, get_admin_kpi
+
+
+# slice -> (hàm dựng theo MaNganh, có lọc theo ngành hay không)
+SLICES: Dict[str, Tuple[Callable[[Optional[str]], object], bool]] = {
+    "kpi": (lambda m: get_dashboard_analytics(ma_nganh=m), True),
+    "top-fails": (lambda m: {"items": get_top_failing_courses()}, False),
+    "admin-kpi": (lambda m: get_admin_kpi(), False),
+}
+
+Key = Tuple[str, Optional[str]]
+
+
+class DashboardCache:
+    def __init__(self, app: Flask, ttl: float = 1.0):
+        self.app = app
+        self.watch = VersionWatch(GLOBAL, ttl)
+        self.catalog = VersionWatch(CATALOG, ttl)
+        self._majors: Optional[Tuple[int, FrozenSet[str]]] = None
+        self._entries: Dict[Key, Tuple[int, bytes]] = {}
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _build(self, key: Key) -> bytes:
+        fn, _ = SLICES[key[0]]
+        return current_app.json.dumps(fn(key[1])).encode("utf-8")
+
+    def _known_major(self, ma_nganh: str) -> bool:
+        ver = self.catalog.current()
+        if self._majors is None or self._majors[0] != ver:
+            majors = frozenset(db.session.execute(select(NganhHoc.MaNganh)).scalars())
+            self._majors = (ver, majors)
+            for key in [k for k in self._entries if k[1] is not None and k[1] not in majors]:
+                self._entries.pop(key, None)
+        return ma_nganh in self._majors[1]
+
+    # None nếu MaNganh không có trong NganhHoc
+    def get(self, slice_name: str, ma_nganh: Optional[str] = None) -> Optional[bytes]:
+        key = (slice_name, ((ma_nganh or "").strip() or None) if SLICES[slice_name][1] else None)
+        if key[1] is not None and not self._known_major(key[1]):
+            return None
+        ver = self.watch.current()
+        hit = self._entries.get(key)
+        if hit is None:
+            hit = self._entries[key] = (ver, self._build(key))
+        elif hit[0] != ver:
+            self.schedule([key])
+        return hit[1]
+
+    def response(self, slice_name: str, ma_nganh: Optional[str] = None):
+        body = self.get(slice_name, ma_nganh)
+        if body is None:
+            return jsonify({"msg": f"Ngành '{ma_nganh}' không tồn tại."}), 404
+        return self.app.response_class(body, mimetype="application/json")
+
+    def schedule(self, keys: Iterable[Key]):
+        with self._lock:
+            self._pending.update(keys)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="dashboard-cache", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def invalidate_all(self):
+        self.schedule(list(self._entries))
+
+    def _loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                keys, self._pending = self._pending, set()
+            if not keys:
+                continue
+            try:
+                with self.app.app_context():
+                    ver = versions([GLOBAL])[GLOBAL]
+                    for key in keys:
+                        hit = self._entries.get(key)
+                        if hit is None or hit[0] != ver:
+                            self._entries[key] = (ver, self._build(key))
+            except Exception:
+                self.app.logger.exception("dashboard cache refresh failed")
+
+
+def dashboard_cache(app: Flask) -> DashboardCache:
+    return app.extensions["dashboard_cache"]
+
+
+def init_app(app: Flask):
+    app.config.setdefault("ANALYTICS_VERSION_TTL", float(os.getenv("ANALYTICS_VERSION_TTL", "1.0")))
+    cache = DashboardCache(app, ttl=app.config["ANALYTICS_VERSION_TTL"])
+    app.extensions["dashboard_cache"] = cache
+    on_commit(cache.invalidate_all)
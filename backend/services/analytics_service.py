@@ -1,21 +1,18 @@
 # backend/services/analytics_service.py
-from sqlalchemy import func, case, and_, desc
-from ..models import db, SinhVien, KetQuaHocTap, HocPhan, SystemConfig, LopHoc
-
-def _cfg_float(dct, key, default):
-    try:
-        return float(dct.get(key, default))
-    except Exception:
-        return float(default)
+# Các phần (slice) của dashboard tính riêng: KPI, danh sách rủi ro, môn trượt nhiều.
+# Endpoint đọc qua DashboardCache (services/analytics_cache.py), không gọi trực tiếp.
+from sqlalchemy import func, case, and_, or_, desc
+from ..models import db, SinhVien, KetQuaHocTap, HocPhan, LopHoc, StudentAggregate
+from ..config_cache import settings
 
 def get_system_configs():
-    cfg = {c.ConfigKey: c.ConfigValue for c in SystemConfig.query.all()}
+    s = settings()
     return {
-        "GPA_WARN_THRESHOLD": _cfg_float(cfg, "GPA_TRUNGBINH_THRESHOLD", 2.0),
-        "DEBT_WARN_TINCHI" : _cfg_float(cfg, "TINCHI_NO_CANHCAO_THRESHOLD", 10.0),
+        "GPA_WARN_THRESHOLD": s.gpa_warn,
+        "DEBT_WARN_TINCHI" : s.debt_warn,
     }
 
-def get_dashboard_analytics(ma_nganh=None):
+def get_kpis(ma_nganh=None):
     q_sv = db.session.query(func.count(SinhVien.MaSV))
     if ma_nganh:
         q_sv = q_sv.join(LopHoc, LopHoc.MaLop == SinhVien.MaLop, isouter=True)\
@@ -23,31 +20,25 @@ def get_dashboard_analytics(ma_nganh=None):
     total_students = int(q_sv.scalar() or 0)
     total_courses  = int(db.session.query(func.count(HocPhan.MaHP)).scalar() or 0)
 
-    total_kq = db.session.query(func.count(KetQuaHocTap.MaKQ)).scalar() or 1
-    pass_kq  = db.session.query(func.count(KetQuaHocTap.MaKQ))\
-                         .filter(KetQuaHocTap.DiemHe4 >= 2.0).scalar() or 0
-    pass_rate = float(pass_kq) / float(total_kq) * 100.0
+    total_kq, pass_kq = db.session.query(
+        func.count(KetQuaHocTap.MaKQ),
+        func.coalesce(func.sum(case((KetQuaHocTap.DiemHe4 >= 2.0, 1), else_=0)), 0)).one()
+    pass_rate = float(pass_kq) / float(total_kq or 1) * 100.0
+    return {
+        "total_students": total_students,
+        "total_courses": total_courses,
+        "pass_rate": pass_rate
+    }
 
+def get_students_at_risk(ma_nganh=None):
     cfg = get_system_configs()
-    sub = (db.session.query(
-                KetQuaHocTap.MaSV.label("MaSV"),
-                func.sum((KetQuaHocTap.DiemHe4* (case((HocPhan.SoTinChi != None, HocPhan.SoTinChi), else_=0)))).label("S"),
-                func.sum(case((HocPhan.SoTinChi != None, HocPhan.SoTinChi), else_=0)).label("W"),
-                func.sum(case((KetQuaHocTap.DiemHe4 < 1.0, HocPhan.SoTinChi), else_=0)).label("DebtTC"),
-            )
-            .join(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP, isouter=True)
-            .filter(KetQuaHocTap.LaDiemCuoiCung.is_(True))
-            .group_by(KetQuaHocTap.MaSV)
-            ).subquery()
-
     q_risk = (db.session.query(
                 SinhVien.MaSV, SinhVien.HoTen, SinhVien.MaLop,
-                (sub.c.S / func.nullif(sub.c.W, 0)).label("GPA4"),
-                sub.c.DebtTC
+                StudentAggregate.GPA4.label("GPA4"),
+                StudentAggregate.CreditsDebt.label("DebtTC")
             )
-            .join(sub, sub.c.MaSV == SinhVien.MaSV, isouter=True)
+            .join(StudentAggregate, StudentAggregate.MaSV == SinhVien.MaSV, isouter=True)
             .order_by(desc("DebtTC"))
-            .limit(50)
             )
 
     if ma_nganh:
@@ -55,7 +46,7 @@ def get_dashboard_analytics(ma_nganh=None):
                        .filter(LopHoc.MaNganh == ma_nganh)
 
     students_at_risk = []
-    for r in q_risk:
+    for r in q_risk.limit(50):
         gpa = float(r.GPA4 or 0.0)
         debt = int(r.DebtTC or 0)
         if gpa <= cfg["GPA_WARN_THRESHOLD"] or debt >= cfg["DEBT_WARN_TINCHI"]:
@@ -64,30 +55,44 @@ def get_dashboard_analytics(ma_nganh=None):
                 "Rule": "GPA_BELOW" if gpa <= cfg["GPA_WARN_THRESHOLD"] else "DEBT_OVER",
                 "Value": round(gpa, 2) if gpa <= cfg["GPA_WARN_THRESHOLD"] else debt,
             })
+    return students_at_risk
 
+# Toàn trường (không lọc theo ngành)
+def get_top_failing_courses():
+    fails = func.sum(case((KetQuaHocTap.DiemHe4 == 0, 1), else_=0))
     q_top = (db.session.query(
-                KetQuaHocTap.MaHP.label("MaHP"),
+                KetQuaHocTap.MaHP.label("MaHP"), HocPhan.TenHP,
                 func.count(KetQuaHocTap.MaKQ).label("N"),
-                func.sum(case((KetQuaHocTap.DiemHe4 == 0, 1), else_=0)).label("F"))
+                fails.label("F"))
              .join(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP)
              .filter(KetQuaHocTap.LaDiemCuoiCung.is_(True), HocPhan.TinhDiemTichLuy.is_(True))
-             .group_by(KetQuaHocTap.MaHP)
-             .order_by((func.sum(case((KetQuaHocTap.DiemHe4 == 0, 1), else_=0))*1.0/func.count(KetQuaHocTap.MaKQ)).desc())
+             .group_by(KetQuaHocTap.MaHP, HocPhan.TenHP)
+             .order_by((fails*1.0/func.count(KetQuaHocTap.MaKQ)).desc())
              .limit(10)
             )
-    name_map = {hp.MaHP: hp.TenHP for hp in HocPhan.query.all()}
-    top_failing_courses = [{
-        "MaHP": m, "TenHP": name_map.get(m, ""),
+    return [{
+        "MaHP": m, "TenHP": ten or "",
         "failure_rate": (float(f or 0)/float(max(1, n)))*100.0,
         "total": int(n)
-    } for (m, n, f) in q_top.all()]
+    } for (m, ten, n, f) in q_top.all()]
 
+# KPI của trang admin (/api/admin/dashboard-analytics): đạt nếu DiemHe10 >= 4 hoặc DiemChu A/B/C/D/P
+def get_admin_kpi():
+    passed = case((or_(KetQuaHocTap.DiemHe10 >= 4.0,
+                       KetQuaHocTap.DiemChu.in_(["A", "B", "C", "D", "P"])), 1), else_=0)
+    total_students = db.session.query(func.count(SinhVien.MaSV)).scalar() or 0
+    total_courses  = db.session.query(func.count(HocPhan.MaHP)).scalar() or 0
+    total_kq, pass_kq = db.session.query(func.count(KetQuaHocTap.MaKQ),
+                                         func.coalesce(func.sum(passed), 0)).one()
+    return {"kpi": {
+        "total_students": int(total_students),
+        "total_courses": int(total_courses),
+        "pass_rate": round((pass_kq/total_kq) if total_kq else 0.0, 4),
+    }}
+
+def get_dashboard_analytics(ma_nganh=None):
     return {
-        "kpis": {
-            "total_students": total_students,
-            "total_courses": total_courses,
-            "pass_rate": pass_rate
-        },
-        "students_at_risk": students_at_risk,
-        "top_failing_courses": top_failing_courses
+        "kpis": get_kpis(ma_nganh),
+        "students_at_risk": get_students_at_risk(ma_nganh),
+        "top_failing_courses": get_top_failing_courses()
     }
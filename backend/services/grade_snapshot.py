@@ -0,0 +1,417 @@
+# backend/services/grade_snapshot.py
+# Snapshot dạng cột (Parquet) của kho điểm KetQuaHocTap ⋈ HocPhan ⋈ SinhVien ⋈ LopHoc cho các câu hỏi
+# tổng hợp (phân bố GPA theo khoá/lớp, tỉ lệ trượt theo học phần và học kỳ): đọc bằng pyarrow/pandas từ
+# GRADE_SNAPSHOT_DIR, không truy vấn ORM từng dòng trên CSDL.
+#   - mỗi phân vùng (MaNganh, HocKy) một file data/MaNganh=<..>/HocKy=<..>/part-<id>.parquet; cột mã
+#     (MaSV, MaHP, MaLop, MaNganh, HocKy, ...) mã hoá dictionary;
+#   - manifest.json (ghi đè bằng os.replace) liệt kê file của từng phân vùng. Truy vấn chỉ đọc file trong
+#     manifest nên không thấy file đang ghi dở; lọc theo MaNganh/HocKy là chọn file. File bị thay được xoá
+#     ở lần làm mới sau (người đọc manifest cũ vẫn mở được);
+#   - làm mới tăng dần: chỉ dựng lại phân vùng có sinh viên đổi dữ liệu, tức DataVersion sv:<MaSV> có
+#     UpdatedAt sau lần làm mới trước (lùi GRADE_SNAPSHOT_OVERLAP giây cho transaction commit muộn), cả
+#     phân vùng cũ trong snapshot lẫn phân vùng hiện tại trong CSDL. Phiên bản catalog (học phần, lớp,
+#     ngành) đổi thì dựng lại toàn bộ; phiên bản global không đổi thì không làm gì;
+#   - import điểm thật ghi xong (importer.import_grades) xếp job "grade-snapshot" (jobs.py) nếu chưa có job chờ;
+#   - pyarrow là phụ thuộc tuỳ chọn (bản exe có thể không kèm): thiếu thì API trả 503, import không xếp job.
+#   python -m backend.services.grade_snapshot refresh|rebuild|status
+from __future__ import annotations
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from flask import Flask, current_app
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+
+from ..data_version import CATALOG, GLOBAL, versions
+from ..models import db, DataVersion, Job, KetQuaHocTap, HocPhan, SinhVien, LopHoc
+from ..utils_import import chunked
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:                      # tuỳ chọn, xem requirements.txt
+    pa = pc = ds = pq = None
+
+try:
+    import fcntl
+except ImportError:                      # Windows
+    fcntl = None
+
+FORMAT = 1
+OVERLAP = 300.0
+JOB_KIND = "grade-snapshot"
+MANIFEST = "manifest.json"
+COHORTS = ("NamTuyenSinh", "MaLop", "MaNganh")
+_lock = threading.Lock()
+
+# (tên cột, biểu thức, kiểu): "dict" = chuỗi mã hoá dictionary
+_COLUMNS = (
+    ("MaNganh", LopHoc.MaNganh, "dict"),
+    ("HocKy", KetQuaHocTap.HocKy, "dict"),
+    ("NamTuyenSinh", LopHoc.NamTuyenSinh, "int"),
+    ("MaLop", SinhVien.MaLop, "dict"),
+    ("MaSV", KetQuaHocTap.MaSV, "dict"),
+    ("TrangThaiHocTap", SinhVien.TrangThaiHocTap, "dict"),
+    ("MaHP", KetQuaHocTap.MaHP, "dict"),
+    ("TenHP", HocPhan.TenHP, "dict"),
+    ("SoTinChi", HocPhan.SoTinChi, "int"),
+    ("TinhDiemTichLuy", HocPhan.TinhDiemTichLuy, "bool"),
+    ("DiemHe10", KetQuaHocTap.DiemHe10, "float"),
+    ("DiemHe4", KetQuaHocTap.DiemHe4, "float"),
+    ("DiemChu", KetQuaHocTap.DiemChu, "dict"),
+    ("KetQua", KetQuaHocTap.KetQua, "dict"),
+    ("LaDiemCuoiCung", KetQuaHocTap.LaDiemCuoiCung, "bool"),
+)
+
+Part = Tuple[Optional[str], str]         # (MaNganh, HocKy)
+
+
+class SnapshotUnavailable(RuntimeError):
+    pass
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def enabled(app: Optional[Flask] = None) -> bool:
+    app = app or current_app
+    return available() and bool(app.config.get("GRADE_SNAPSHOT"))
+
+
+def snapshot_dir(app: Optional[Flask] = None) -> str:
+    d = (app or current_app).config["GRADE_SNAPSHOT_DIR"]
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _need():
+    if pa is None:
+        raise SnapshotUnavailable("Chưa cài pyarrow → không dùng được snapshot Parquet (pip install pyarrow)")
+
+
+@contextmanager
+def _dir_lock(root: str):
+    # Một lần làm mới tại một thời điểm: mutex trong tiến trình + flock giữa các worker (như write_gate)
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(os.path.join(root, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def _read_manifest(root: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(root, MANIFEST), encoding="utf-8") as fh:
+            man = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return man if man.get("format") == FORMAT else None
+
+
+def _write_manifest(root: str, man: Dict[str, Any]):
+    tmp = os.path.join(root, f".{MANIFEST}.{uuid.uuid4().hex}")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(man, fh, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(root, MANIFEST))
+
+
+def _seg(v: Optional[str]) -> str:
+    return "__null__" if v is None else quote(str(v), safe="")
+
+
+def _select():
+    return (select(*(expr for _, expr, _ in _COLUMNS))
+            .select_from(KetQuaHocTap)
+            .join(SinhVien, SinhVien.MaSV == KetQuaHocTap.MaSV)
+            .join(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP, isouter=True)
+            .join(LopHoc, LopHoc.MaLop == SinhVien.MaLop, isouter=True))
+
+
+def _table(rows) -> "pa.Table":
+    types = {"int": pa.int32(), "float": pa.float64(), "bool": pa.bool_()}
+    cols = list(zip(*rows)) if rows else [()] * len(_COLUMNS)
+    arrays = []
+    for (_, _, kind), values in zip(_COLUMNS, cols):
+        if kind == "dict":
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, types[kind]))
+    return pa.Table.from_arrays(arrays, names=[name for name, _, _ in _COLUMNS])
+
+
+def _build_part(root: str, part: Part) -> Optional[Dict[str, Any]]:
+    nganh, hk = part
+    stmt = (_select().where(LopHoc.MaNganh.is_(None) if nganh is None else LopHoc.MaNganh == nganh,
+                            KetQuaHocTap.HocKy == hk)
+            .order_by(KetQuaHocTap.MaSV, KetQuaHocTap.MaHP))
+    tbl = _table(db.session.execute(stmt).all())
+    if not tbl.num_rows:
+        return None
+    rel = f"data/MaNganh={_seg(nganh)}/HocKy={_seg(hk)}/part-{uuid.uuid4().hex[:12]}.parquet"
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(tbl, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return {"MaNganh": nganh, "HocKy": hk, "file": rel, "rows": tbl.num_rows}
+
+
+# Phân vùng hiện có trong CSDL (của các sinh viên masvs, hoặc tất cả)
+def _db_parts(masvs: Optional[List[str]] = None) -> Set[Part]:
+    stmt = (select(LopHoc.MaNganh, KetQuaHocTap.HocKy).select_from(KetQuaHocTap)
+            .join(SinhVien, SinhVien.MaSV == KetQuaHocTap.MaSV)
+            .join(LopHoc, LopHoc.MaLop == SinhVien.MaLop, isouter=True)
+            .group_by(LopHoc.MaNganh, KetQuaHocTap.HocKy))
+    if masvs is None:
+        return {(n, hk) for n, hk in db.session.execute(stmt)}
+    out: Set[Part] = set()
+    for part in chunked(masvs, 500):
+        out.update((n, hk) for n, hk in db.session.execute(stmt.where(KetQuaHocTap.MaSV.in_(part))))
+    return out
+
+
+# Phân vùng trong snapshot có dòng của các sinh viên masvs (đọc mỗi cột MaSV)
+def _snapshot_parts(root: str, parts: Dict[Part, Dict[str, Any]], masvs: List[str]) -> Set[Part]:
+    out: Set[Part] = set()
+    want = pa.array(masvs, pa.string())
+    for key, p in parts.items():
+        col = pq.read_table(os.path.join(root, p["file"]), columns=["MaSV"]).column("MaSV")
+        if pc.any(pc.is_in(col.cast(pa.string()), value_set=want)).as_py():
+            out.add(key)
+    return out
+
+
+def _changed_students(since: datetime) -> List[str]:
+    return sorted(s[3:] for (s,) in db.session.execute(
+        select(DataVersion.Scope).where(DataVersion.Scope.like("sv:%"), DataVersion.UpdatedAt >= since)))
+
+
+def _remove(root: str, files: Iterable[str]):
+    for rel in files:
+        try:
+            os.remove(os.path.join(root, rel))
+        except OSError:
+            pass
+
+
+def refresh(full: bool = False) -> Dict[str, Any]:
+    _need()
+    root = snapshot_dir()
+    with _dir_lock(root):
+        t0 = time.perf_counter()
+        man = _read_manifest(root)
+        now = datetime.utcnow()
+        ver = versions([CATALOG, GLOBAL])
+        parts = {(p["MaNganh"], p["HocKy"]): p for p in (man or {}).get("partitions", [])}
+        full = full or man is None or man.get("catalog") != ver[CATALOG]
+        if full:
+            dirty, students = _db_parts() | set(parts), None
+        elif man.get("global") == ver[GLOBAL]:
+            return {"mode": "fresh", "partitions": 0, "rows": 0, "seconds": round(time.perf_counter() - t0, 3)}
+        else:
+            overlap = float(current_app.config.get("GRADE_SNAPSHOT_OVERLAP", OVERLAP))
+            students = _changed_students(datetime.fromisoformat(man["watermark"]) - timedelta(seconds=overlap))
+            dirty = (_db_parts(students) | _snapshot_parts(root, parts, students)) if students else set()
+
+        replaced, rows = [], 0
+        for key in sorted(dirty, key=lambda k: (k[0] or "", k[1])):
+            old = parts.pop(key, None)
+            if old is not None:
+                replaced.append(old["file"])
+            p = _build_part(root, key)
+            if p is not None:
+                parts[key] = p
+                rows += p["rows"]
+        db.session.rollback()                # kết thúc transaction đọc
+        keep = sorted(parts.values(), key=lambda p: (p["MaNganh"] or "", p["HocKy"]))
+        _write_manifest(root, {
+            "format": FORMAT, "built_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "watermark": now.isoformat(), "catalog": ver[CATALOG], "global": ver[GLOBAL],
+            "partitions": keep, "garbage": replaced,
+        })
+        # File bị thay ở lần trước: đã qua một lần đổi manifest, không còn ai mở
+        _remove(root, (man or {}).get("garbage", []))
+        if full:
+            # file mồ côi (làm mới bị ngắt trước khi ghi manifest)
+            live = {p["file"] for p in keep} | set(replaced)
+            for d, _, names in os.walk(os.path.join(root, "data")):
+                rels = (os.path.relpath(os.path.join(d, n), root).replace(os.sep, "/") for n in names)
+                _remove(root, [r for r in rels if r not in live])
+        return {"mode": "full" if full else "incremental", "students": len(students) if students is not None else None,
+                "partitions": len(dirty), "rows": rows, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+# Sau import thật: xếp job làm mới (nếu bật và chưa có job chờ). Lỗi ở đây không làm hỏng import.
+def request_refresh() -> Optional[Job]:
+    app = current_app._get_current_object()
+    if not enabled(app):
+        return None
+    from .. import jobs
+
+    try:
+        if db.session.execute(select(Job.Id).where(Job.Kind == JOB_KIND, Job.Status == "queued")
+                              .limit(1)).scalar() is not None:
+            return None
+        return jobs.submit(JOB_KIND, {}, actor="system")
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("không xếp được job làm mới snapshot điểm")
+        return None
+
+
+# ---- Truy vấn tổng hợp trên snapshot (không đọc CSDL) ----
+
+def _manifest() -> Dict[str, Any]:
+    _need()
+    man = _read_manifest(snapshot_dir())
+    if man is None:
+        raise SnapshotUnavailable("Chưa có snapshot điểm → POST /api/admin/snapshot/refresh")
+    return man
+
+
+def _meta(man: Dict[str, Any]) -> Dict[str, Any]:
+    return {"built_at": man["built_at"], "watermark": man["watermark"]}
+
+
+# DataFrame các cột cần, chỉ đọc file của phân vùng khớp ma_nganh/hoc_ky; where: biểu thức pyarrow
+def _frame(man: Dict[str, Any], columns: List[str], *, ma_nganh: Optional[str] = None,
+           hoc_ky: Optional[str] = None, where=None) -> pd.DataFrame:
+    root = snapshot_dir()
+    files = [os.path.join(root, p["file"]) for p in man["partitions"]
+             if (not ma_nganh or p["MaNganh"] == ma_nganh) and (not hoc_ky or p["HocKy"] == hoc_ky)]
+    if not files:
+        return pd.DataFrame({c: pd.Series(dtype=object) for c in columns})
+    return ds.dataset(files, format="parquet").to_table(columns=columns, filter=where).to_pandas()
+
+
+def _final(ma_lop: Optional[str] = None, ma_hp: Optional[str] = None):
+    where = pc.field("LaDiemCuoiCung")
+    if ma_lop:
+        where = where & (pc.field("MaLop") == ma_lop)
+    if ma_hp:
+        where = where & (pc.field("MaHP") == ma_hp)
+    return where
+
+
+def _val(v):
+    if pd.isna(v):
+        return None
+    return v.item() if hasattr(v, "item") else v
+
+
+# Tỉ lệ trượt theo (học phần, học kỳ), điểm cuối cùng của học phần tính tích luỹ; trượt như
+# StudentAggregate: DiemHe10 < 4 hoặc điểm chữ F
+def fail_rates(*, ma_nganh: Optional[str] = None, hoc_ky: Optional[str] = None, ma_lop: Optional[str] = None,
+               ma_hp: Optional[str] = None, min_n: int = 1, limit: int = 50) -> Dict[str, Any]:
+    man = _manifest()
+    df = _frame(man, ["MaHP", "TenHP", "HocKy", "DiemHe10", "DiemChu"], ma_nganh=ma_nganh, hoc_ky=hoc_ky,
+                where=_final(ma_lop, ma_hp) & pc.field("TinhDiemTichLuy"))
+    df["failed"] = (df["DiemHe10"].astype(float) < 4.0) | (df["DiemChu"] == "F")
+    g = (df.groupby(["MaHP", "TenHP", "HocKy"], observed=True, dropna=False, sort=False)["failed"]
+         .agg(total="size", fails="sum").reset_index())
+    g = g[g["total"] >= max(1, min_n)]
+    g["rate"] = g["fails"] / g["total"] * 100.0
+    g = g.sort_values(["rate", "total", "MaHP", "HocKy"], ascending=[False, False, True, True]).head(max(0, limit))
+    items = [{"MaHP": r.MaHP, "TenHP": _val(r.TenHP) or "", "HocKy": r.HocKy, "total": int(r.total),
+              "fails": int(r.fails), "failure_rate": round(float(r.rate), 2)} for r in g.itertuples(index=False)]
+    return {"items": items, "snapshot": _meta(man)}
+
+
+# Phân bố GPA hệ 4 theo khoá (NamTuyenSinh), lớp hoặc ngành. GPA của sinh viên tính như
+# StudentAggregate.GPA4: điểm cuối cùng, trọng số SoTinChi; hoc_ky thì chỉ trong học kỳ đó.
+def gpa_distribution(*, by: str = "NamTuyenSinh", ma_nganh: Optional[str] = None, hoc_ky: Optional[str] = None,
+                     ma_lop: Optional[str] = None, bins: int = 8) -> Dict[str, Any]:
+    if by not in COHORTS:
+        raise ValueError(f"by phải là một trong {', '.join(COHORTS)}")
+    bins = min(max(int(bins), 1), 40)
+    man = _manifest()
+    cols = sorted({by, "MaSV", "SoTinChi", "DiemHe4"})
+    df = _frame(man, cols, ma_nganh=ma_nganh, hoc_ky=hoc_ky, where=_final(ma_lop))
+    if by == "NamTuyenSinh":
+        df[by] = df[by].astype("Int64")      # int32 có null → float64 khi sang pandas
+    df["w"] = df["SoTinChi"].astype(float).fillna(0.0)
+    df["pts"] = df["DiemHe4"].astype(float) * df["w"]
+    sv = df.groupby([by, "MaSV"], observed=True, dropna=False)[["pts", "w"]].sum(min_count=1).reset_index()
+    sv = sv[sv["pts"].notna() & (sv["w"] > 0)]
+    sv["gpa"] = sv["pts"] / sv["w"]
+    edges = np.linspace(0.0, 4.0, bins + 1)
+    out = []
+    for key, g in sv.groupby(by, observed=True, dropna=False, sort=True):
+        gpa = g["gpa"].to_numpy()
+        counts, _ = np.histogram(np.clip(gpa, 0.0, 4.0), bins=edges)
+        out.append({by: _val(key), "students": int(len(gpa)), "mean": round(float(gpa.mean()), 4),
+                    "median": round(float(np.median(gpa)), 4),
+                    "p25": round(float(np.percentile(gpa, 25)), 4), "p75": round(float(np.percentile(gpa, 75)), 4),
+                    "histogram": [{"from": round(float(a), 3), "to": round(float(b), 3), "count": int(c)}
+                                  for a, b, c in zip(edges[:-1], edges[1:], counts)]})
+    return {"by": by, "items": out, "snapshot": _meta(man)}
+
+
+def status() -> Dict[str, Any]:
+    out: Dict[str, Any] = {"available": available(), "enabled": enabled(), "built": False}
+    if not available():
+        return out
+    man = _read_manifest(snapshot_dir())
+    if man is None:
+        return out
+    root = snapshot_dir()
+    size = 0
+    for p in man["partitions"]:
+        try:
+            size += os.path.getsize(os.path.join(root, p["file"]))
+        except OSError:
+            pass
+    out.update(built=True, **_meta(man), partitions=len(man["partitions"]),
+               rows=sum(p["rows"] for p in man["partitions"]), bytes=size,
+               stale=versions([GLOBAL])[GLOBAL] != man["global"])
+    return out
+
+
+def _default_dir(uri: str) -> str:
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        return os.path.join(os.path.dirname(os.path.abspath(url.database)), "grade_snapshot")
+    return os.path.join(tempfile.gettempdir(), f"sars-grade-snapshot-{_seg(url.database or 'db')}")
+
+
+def init_app(app: Flask):
+    app.config.setdefault("GRADE_SNAPSHOT", os.getenv("GRADE_SNAPSHOT", "1").strip().lower()
+                          in ("1", "true", "yes", "y", "on"))
+    app.config.setdefault("GRADE_SNAPSHOT_DIR", os.getenv("GRADE_SNAPSHOT_DIR")
+                          or _default_dir(app.config["SQLALCHEMY_DATABASE_URI"]))
+    app.config.setdefault("GRADE_SNAPSHOT_OVERLAP", float(os.getenv("GRADE_SNAPSHOT_OVERLAP", OVERLAP)))
+
+
+def main(argv: List[str]) -> int:
+    from ..app import create_app
+
+    cmd = argv[0] if argv else "status"
+    app = create_app()
+    with app.app_context():
+        if cmd in ("refresh", "rebuild"):
+            print(refresh(full=cmd == "rebuild"))
+            return 0
+        print(status())
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,128 @@
+# backend/services/student_aggregate.py
+# Bảng tổng hợp GPA/tín chỉ theo sinh viên (StudentAggregate), làm mới tăng dần theo MaSV.
+#   python -m backend.services.student_aggregate rebuild|check
+from __future__ import annotations
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, func, insert, literal, select
+
+from ..models import db, KetQuaHocTap, HocPhan, StudentAggregate
+from ..grade_writer import latest_first
+from ..utils_import import chunked
+from ..warning_scan import mark_dirty
+from ..data_version import bump, sv_scope
+
+
+AGG_FIELDS = ("GPA4", "GPA10", "CreditsAttempted", "CreditsPassed", "CreditsDebt", "FailCount", "LastTerm")
+
+
+def _aggregate_select(masvs: Optional[List[str]] = None):
+    stc = func.coalesce(HocPhan.SoTinChi, 0)
+    failed = (KetQuaHocTap.DiemHe10 < 4.0) | (func.coalesce(KetQuaHocTap.DiemChu, "") == "F")
+    w = func.sum(stc)
+    debt = func.coalesce(func.sum(case((failed, stc), else_=0)), 0)
+    # max(HocKy) so chuỗi ("9" > "10"): lấy học kỳ muộn nhất theo thứ tự của grade_writer
+    k2 = KetQuaHocTap.__table__.alias("k2")
+    last_term = (select(k2.c.HocKy).where(k2.c.MaSV == KetQuaHocTap.MaSV, k2.c.LaDiemCuoiCung.is_(True))
+                 .order_by(*latest_first(k2)).limit(1).scalar_subquery())
+    stmt = (select(
+                KetQuaHocTap.MaSV,
+                (func.sum(KetQuaHocTap.DiemHe4 * stc) / func.nullif(w, 0)).label("GPA4"),
+                (func.sum(KetQuaHocTap.DiemHe10 * stc) / func.nullif(w, 0)).label("GPA10"),
+                func.coalesce(w, 0).label("CreditsAttempted"),
+                (func.coalesce(w, 0) - debt).label("CreditsPassed"),
+                debt.label("CreditsDebt"),
+                func.sum(case((failed, 1), else_=0)).label("FailCount"),
+                last_term.label("LastTerm"),
+                literal(datetime.utcnow()).label("UpdatedAt"),
+            )
+            .select_from(KetQuaHocTap)
+            .join(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP, isouter=True)
+            .where(KetQuaHocTap.LaDiemCuoiCung.is_(True))
+            .group_by(KetQuaHocTap.MaSV))
+    if masvs is not None:
+        stmt = stmt.where(KetQuaHocTap.MaSV.in_(masvs))
+    return stmt
+
+
+_INSERT_COLS = ["MaSV", *AGG_FIELDS, "UpdatedAt"]
+
+
+# Gọi trong cùng transaction với thao tác ghi điểm; không commit. Sinh viên được làm mới
+# cũng được đánh dấu cho lần quét cảnh báo tăng dần và tăng phiên bản dữ liệu (ETag).
+def refresh_students(masvs: Iterable[str]) -> int:
+    n = 0
+    for part in chunked(sorted({m for m in masvs if m}), 500):
+        db.session.execute(delete(StudentAggregate).where(StudentAggregate.MaSV.in_(part)))
+        db.session.execute(insert(StudentAggregate).from_select(_INSERT_COLS, _aggregate_select(part)))
+        mark_dirty(part)
+        bump(sv_scope(m) for m in part)
+        n += len(part)
+    return n
+
+
+# Không dùng DISTINCT: với nhiều MaHP, SQLite chọn skip-scan chỉ mục (MaSV, ...) chậm gấp ~3 lần
+# so với đọc ix_KetQuaHocTap_MaHP_MaSV rồi khử trùng ở đây
+def students_taking(mahps: Iterable[str]) -> List[str]:
+    out = set()
+    for part in chunked(sorted(set(mahps)), 500):
+        out.update(m for (m,) in db.session.execute(
+            select(KetQuaHocTap.MaSV).where(KetQuaHocTap.MaHP.in_(part))))
+    return sorted(out)
+
+
+def refresh_courses(mahps: Iterable[str]) -> int:
+    return refresh_students(students_taking(mahps))
+
+
+def rebuild_all() -> int:
+    db.session.execute(delete(StudentAggregate))
+    db.session.execute(insert(StudentAggregate).from_select(_INSERT_COLS, _aggregate_select()))
+    db.session.commit()
+    return db.session.query(func.count(StudentAggregate.MaSV)).scalar() or 0
+
+
+def _differs(a, b) -> bool:
+    if a is None or b is None:
+        return (a is None) != (b is None)
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(float(a) - float(b)) > 1e-6
+    return a != b
+
+
+# So bảng tổng hợp với truy vấn tính trực tiếp; trả về danh sách sai lệch.
+def check_consistency() -> List[Dict]:
+    expected = {r.MaSV: r for r in db.session.execute(_aggregate_select())}
+    stored = {r.MaSV: r for r in db.session.query(StudentAggregate).all()}
+    issues: List[Dict] = []
+    for masv in sorted(set(expected) | set(stored)):
+        e, s = expected.get(masv), stored.get(masv)
+        if e is None or s is None:
+            issues.append({"MaSV": masv, "field": "*", "stored": bool(s), "expected": bool(e)})
+            continue
+        for f in AGG_FIELDS:
+            if _differs(getattr(s, f), getattr(e, f)):
+                issues.append({"MaSV": masv, "field": f, "stored": getattr(s, f), "expected": getattr(e, f)})
+    return issues
+
+
+def main(argv: List[str]) -> int:
+    from ..app import create_app
+
+    cmd = argv[0] if argv else "check"
+    app = create_app()
+    with app.app_context():
+        if cmd == "rebuild":
+            print(f"StudentAggregate: {rebuild_all()} rows")
+            return 0
+        issues = check_consistency()
+        for it in issues[:50]:
+            print(it)
+        print(f"{len(issues)} mismatches")
+        return 1 if issues else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,168 @@
+# backend/services/student_payload.py
+# Dữ liệu cho /api/student/data bằng 3 truy vấn nối bảng (hồ sơ, kết quả, CTĐT) thay vì
+# db.session.get(HocPhan) cho từng dòng. ETag ghép từ phiên bản dữ liệu (data_version) của sinh viên,
+# tài khoản và danh mục; JSON đã dựng được giữ trong LRU theo (MaSV, ETag).
+from __future__ import annotations
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import case, func, or_, select
+
+from ..data_version import CATALOG, sv_scope, user_scope, versions
+from ..models import (
+    db, NguoiDung, SinhVien, LopHoc, NganhHoc, Khoa, HocPhan, KetQuaHocTap, ChuongTrinhDaoTao,
+)
+
+
+def _digits_to_int(v):
+    if v is None: return None
+    s = str(v).strip()
+    dg = "".join(ch for ch in s if ch.isdigit())
+    return int(dg) if dg else None
+
+
+def _hk_key(x):
+    try:
+        return int(x.get("HocKy") or 0)
+    except Exception:
+        return 0
+
+
+# Dòng SinhVien của tài khoản: ưu tiên SV gắn MaNguoiDung, sau đó MaSV = TenDangNhap
+def _for_user(uid: int, *cols, outer=()):
+    stmt = (select(*cols).select_from(NguoiDung)
+            .join(SinhVien, or_(SinhVien.MaNguoiDung == NguoiDung.MaNguoiDung,
+                                SinhVien.MaSV == NguoiDung.TenDangNhap)))
+    for target, on in outer:
+        stmt = stmt.outerjoin(target, on)
+    return (stmt.where(NguoiDung.MaNguoiDung == uid)
+            .order_by(case((SinhVien.MaNguoiDung == NguoiDung.MaNguoiDung, 0), else_=1))
+            .limit(1))
+
+
+# NguoiDung ⋈ SinhVien ⋈ LopHoc ⋈ NganhHoc ⋈ Khoa
+def _load_profile(uid: int):
+    return db.session.execute(_for_user(
+        uid, NguoiDung.Email, SinhVien.MaSV, SinhVien.HoTen, SinhVien.NgaySinh, SinhVien.MaLop,
+        LopHoc.TenLop, LopHoc.MaNganh, NganhHoc.TenNganh, Khoa.TenKhoa,
+        outer=[(LopHoc, LopHoc.MaLop == SinhVien.MaLop),
+               (NganhHoc, NganhHoc.MaNganh == LopHoc.MaNganh),
+               (Khoa, Khoa.MaKhoa == NganhHoc.MaKhoa)])).first()
+
+
+def _results(masv: str) -> List[Dict[str, Any]]:
+    stmt = (select(KetQuaHocTap.HocKy, KetQuaHocTap.MaHP, KetQuaHocTap.DiemHe10, KetQuaHocTap.DiemHe4,
+                   KetQuaHocTap.DiemChu, KetQuaHocTap.TinhDiemTichLuy, KetQuaHocTap.LaDiemCuoiCung,
+                   HocPhan.MaHP.label("hp"), HocPhan.TenHP, HocPhan.SoTinChi,
+                   HocPhan.TinhDiemTichLuy.label("hp_tdtl"))
+            .outerjoin(HocPhan, HocPhan.MaHP == KetQuaHocTap.MaHP)
+            .where(KetQuaHocTap.MaSV == masv)
+            .order_by(KetQuaHocTap.MaKQ))
+    return [{
+        "HocKy": r.HocKy,
+        "MaHP": r.MaHP,
+        "TenHP": r.TenHP,
+        "SoTinChi": r.SoTinChi or 0,
+        "DiemHe10": r.DiemHe10,
+        "DiemHe4": r.DiemHe4,
+        "DiemChu": r.DiemChu,
+        "TinhDiemTichLuy": bool(r.hp_tdtl) if r.hp is not None else bool(r.TinhDiemTichLuy),
+        "LaDiemCuoiCung": r.LaDiemCuoiCung,
+    } for r in db.session.execute(stmt)]
+
+
+def _plan(ma_nganh: Optional[str]) -> List[Dict[str, Any]]:
+    CTDT = ChuongTrinhDaoTao
+    base = (select(CTDT.HocKy, CTDT.MaHP, HocPhan.TenHP, HocPhan.SoTinChi)
+            .outerjoin(HocPhan, HocPhan.MaHP == CTDT.MaHP)
+            .order_by(CTDT.HocKy, CTDT.MaHP))
+    rows = []
+    if ma_nganh:
+        rows = db.session.execute(base.where(CTDT.MaNganh == ma_nganh)).all()
+        if not rows:
+            rows = db.session.execute(base.where(CTDT.MaNganh.like(f"{str(ma_nganh)[:5]}%"))).all()
+    if not rows:
+        rows = db.session.execute(base).all()
+    plan = [{"HocKy": _digits_to_int(r.HocKy), "MaHP": r.MaHP, "TenHP": r.TenHP,
+             "SoTinChi": r.SoTinChi or 0} for r in rows]
+
+    if not plan:
+        hk_map_kq = dict(db.session.execute(
+            select(KetQuaHocTap.MaHP, func.min(KetQuaHocTap.HocKy)).group_by(KetQuaHocTap.MaHP)).all())
+        hps = db.session.execute(
+            select(HocPhan.MaHP, HocPhan.TenHP, HocPhan.SoTinChi)
+            .where(or_(HocPhan.TinhDiemTichLuy == True, HocPhan.TinhDiemTichLuy.is_(None)))
+            .order_by(HocPhan.MaHP)).all()
+        plan = [{"HocKy": _digits_to_int(hk_map_kq.get(hp.MaHP)), "MaHP": hp.MaHP, "TenHP": hp.TenHP,
+                 "SoTinChi": hp.SoTinChi or 0} for hp in hps]
+
+    plan.sort(key=lambda x: (_hk_key(x), str(x.get("MaHP") or "")))
+    return plan
+
+
+# None nếu tài khoản không gắn với sinh viên nào
+def build_student_payload(uid: int) -> Optional[Dict[str, Any]]:
+    p = _load_profile(uid) if uid else None
+    if p is None:
+        return None
+    return {
+        "MaSV": p.MaSV,
+        "HoTen": p.HoTen,
+        "NgaySinh": p.NgaySinh.strftime("%d/%m/%Y") if p.NgaySinh else None,
+        "Lop": p.TenLop or p.MaLop,
+        "Nganh": p.TenNganh,
+        "Khoa": p.TenKhoa,
+        "Email": p.Email,
+        "KetQuaHocTap": _results(p.MaSV),
+        "ChuongTrinhDaoTao": _plan(p.MaNganh),
+    }
+
+
+# (MaSV, ETag) của tài khoản, None nếu không gắn sinh viên. Phiên bản được đọc trước khi dựng
+# payload trong cùng transaction (snapshot WAL) nên nội dung cache không mới hơn ETag của nó.
+def student_etag(uid: int) -> Optional[Tuple[str, str]]:
+    masv = db.session.execute(_for_user(uid, SinhVien.MaSV)).scalar() if uid else None
+    if masv is None:
+        return None
+    v = versions([sv_scope(masv), user_scope(uid), CATALOG])
+    return masv, f"{masv}.{uid}.{v[sv_scope(masv)]}.{v[user_scope(uid)]}.{v[CATALOG]}"
+
+
+class _LRU:
+    def __init__(self, size: int):
+        self.size = size
+        self._d: "OrderedDict[Any, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[bytes]:
+        with self._lock:
+            v = self._d.get(key)
+            if v is not None:
+                self._d.move_to_end(key)
+            return v
+
+    def put(self, key, value: bytes):
+        with self._lock:
+            self._d[key] = value
+            self._d.move_to_end(key)
+            while len(self._d) > self.size:
+                self._d.popitem(last=False)
+
+
+_cache = _LRU(int(os.getenv("STUDENT_PAYLOAD_CACHE_SIZE", "256")))
+
+
+# JSON của payload; dữ liệu đổi thì ETag đổi nên khoá cũ không bao giờ được đọc lại và tự bị đẩy ra.
+def payload_json(uid: int, masv: str, etag: str) -> Optional[bytes]:
+    key = (masv, etag)
+    body = _cache.get(key)
+    if body is None:
+        payload = build_student_payload(uid)
+        if payload is None:
+            return None
+        body = current_app.json.dumps(payload).encode("utf-8")
+        _cache.put(key, body)
+    return body
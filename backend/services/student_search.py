@@ -0,0 +1,222 @@
+# backend/services/student_search.py
+# Danh sách/tìm kiếm sinh viên cho /api/admin/students:
+#   - phân trang keyset theo MaSV (cursor = MaSV cuối trang trước), không OFFSET;
+#   - SQLite: bảng SinhVienSearch(Id, MaSV, MaLop, Doc) với Doc = _norm("MaSV HoTen") và chỉ mục
+#     FTS5 trigram SinhVienSearchFts (external content, đồng bộ bằng trigger) nên tìm chuỗi con không
+#     dấu ("nguyen van", "0012", "duc" khớp "Đức"); trang kết quả lấy từ bảng phụ, không đọc SinhVien
+#     cho từng dòng khớp. CSDL khác dùng ilike trên SinhVien;
+#   - tổng số: "estimate" (mặc định) đếm tối đa COUNT_CAP dòng, "exact" đếm đủ, "none" bỏ qua.
+# Bảng phụ được cập nhật ở after_flush theo thay đổi ORM của SinhVien (mọi đường ghi SinhVien hiện
+# tại đều qua ORM). Dựng lại: python -m backend.services.student_search rebuild
+from __future__ import annotations
+import hashlib
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import sqlalchemy as sa
+from flask import Flask
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import selectinload
+
+from ..models import db, SinhVien
+from ..utils_import import _norm, chunked
+
+
+SEARCH_TABLE = "SinhVienSearch"
+FTS_TABLE = "SinhVienSearchFts"
+COUNT_CAP = 1000
+_key = sa.table(SEARCH_TABLE, sa.column("Id"), sa.column("MaSV"), sa.column("MaLop"), sa.column("Doc"))
+_fts = sa.table(FTS_TABLE, sa.column("rowid"), sa.column("Doc"))
+
+_DDL_TABLE = (
+    f'CREATE TABLE IF NOT EXISTS "{SEARCH_TABLE}" ('
+    '"Id" INTEGER PRIMARY KEY, "MaSV" VARCHAR(50) NOT NULL UNIQUE, "MaLop" VARCHAR(50), "Doc" TEXT NOT NULL)',
+    f'CREATE INDEX IF NOT EXISTS "ix_{SEARCH_TABLE}_MaLop_MaSV" ON "{SEARCH_TABLE}" ("MaLop", "MaSV")',
+)
+_DDL_FTS = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS "{FTS_TABLE}" USING fts5('
+    f'"Doc", content=\'{SEARCH_TABLE}\', content_rowid=\'Id\', tokenize=\'trigram\')',
+    f'CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_ai" AFTER INSERT ON "{SEARCH_TABLE}" BEGIN '
+    f'INSERT INTO "{FTS_TABLE}"(rowid, "Doc") VALUES (new."Id", new."Doc"); END',
+    f'CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_ad" AFTER DELETE ON "{SEARCH_TABLE}" BEGIN '
+    f'INSERT INTO "{FTS_TABLE}"("{FTS_TABLE}", rowid, "Doc") VALUES (\'delete\', old."Id", old."Doc"); END',
+    f'CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_au" AFTER UPDATE ON "{SEARCH_TABLE}" BEGIN '
+    f'INSERT INTO "{FTS_TABLE}"("{FTS_TABLE}", rowid, "Doc") VALUES (\'delete\', old."Id", old."Doc"); '
+    f'INSERT INTO "{FTS_TABLE}"(rowid, "Doc") VALUES (new."Id", new."Doc"); END',
+)
+
+
+def _fold(s) -> str:
+    s = "" if s is None else str(s)
+    return _norm(s.replace("đ", "d").replace("Đ", "D"))
+
+
+def _doc(masv, hoten) -> str:
+    return _fold(f"{masv} {hoten or ''}")
+
+
+# Id cố định theo MaSV để xoá/ghi đè theo khoá chính (rowid của SinhVien có thể đổi khi VACUUM)
+def _rowid(masv: str) -> int:
+    return int.from_bytes(hashlib.blake2b(masv.encode("utf-8"), digest_size=8).digest(), "big") >> 1
+
+
+def _is_sqlite(bind) -> bool:
+    return bind.dialect.name == "sqlite"
+
+
+def _row(masv, ma_lop, hoten) -> Dict[str, Any]:
+    return {"Id": _rowid(masv), "MaSV": masv, "MaLop": ma_lop, "Doc": _doc(masv, hoten)}
+
+
+def _write(conn, upserts: Dict[str, Tuple[Optional[str], str]], deletes: Iterable[str]):
+    drop = sorted(set(deletes) | set(upserts))
+    for part in chunked(drop, 500):
+        conn.execute(sa.delete(_key).where(_key.c.Id.in_([_rowid(m) for m in part])))
+    rows = [_row(m, lop, ten) for m, (lop, ten) in upserts.items()]
+    for part in chunked(rows, 1000):
+        conn.execute(sa.insert(_key), part)
+
+
+def ensure_index(rebuild_if_stale: bool = True):
+    if not _is_sqlite(db.engine):
+        return
+    with db.engine.begin() as conn:
+        for ddl in _DDL_TABLE + _DDL_FTS:
+            conn.exec_driver_sql(ddl)
+        if rebuild_if_stale:
+            n_key = conn.execute(sa.select(sa.func.count()).select_from(_key)).scalar() or 0
+            n_sv = conn.execute(sa.select(sa.func.count()).select_from(SinhVien)).scalar() or 0
+            if n_key != n_sv:
+                _rebuild(conn)
+
+
+# Dựng lại từ đầu: nạp bảng phụ khi chưa có trigger rồi 'rebuild' FTS một lần (nhanh hơn chèn từng dòng)
+def _rebuild(conn) -> int:
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{FTS_TABLE}"')
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{SEARCH_TABLE}"')   # kéo theo trigger
+    for ddl in _DDL_TABLE:
+        conn.exec_driver_sql(ddl)
+    n = 0
+    for part in chunked(conn.execute(sa.select(SinhVien.MaSV, SinhVien.MaLop, SinhVien.HoTen)).all(), 5000):
+        conn.execute(sa.insert(_key), [_row(m, lop, t) for m, lop, t in part])
+        n += len(part)
+    for ddl in _DDL_FTS:
+        conn.exec_driver_sql(ddl)
+    conn.exec_driver_sql(f'INSERT INTO "{FTS_TABLE}"("{FTS_TABLE}") VALUES (\'rebuild\')')
+    return n
+
+
+def rebuild() -> int:
+    if not _is_sqlite(db.engine):
+        return 0
+    with db.engine.begin() as conn:
+        return _rebuild(conn)
+
+
+def _after_flush(session, _ctx):
+    conn = session.connection()
+    if not _is_sqlite(conn):
+        return
+    upserts: Dict[str, Tuple[Optional[str], str]] = {}
+    deletes: set = set()
+    for obj in session.new:
+        if isinstance(obj, SinhVien):
+            upserts[obj.MaSV] = (obj.MaLop, obj.HoTen)
+    for obj in session.dirty:
+        if not isinstance(obj, SinhVien):
+            continue
+        st = inspect(obj)
+        h_ma = st.attrs.MaSV.history
+        if h_ma.deleted:
+            deletes.update(m for m in h_ma.deleted if m)
+        if any(st.attrs[a].history.has_changes() for a in ("MaSV", "HoTen", "MaLop")):
+            upserts[obj.MaSV] = (obj.MaLop, obj.HoTen)
+    for obj in session.deleted:
+        if isinstance(obj, SinhVien):
+            deletes.add(obj.MaSV)
+    if upserts or deletes:
+        _write(conn, upserts, deletes)
+
+
+def _count(stmt, mode: str, filtered: bool):
+    if mode == "none":
+        return None, False
+    if mode == "exact":
+        return db.session.execute(sa.select(sa.func.count()).select_from(stmt.subquery())).scalar() or 0, True
+    if not filtered and _is_sqlite(db.session.get_bind()):
+        # max(rowid) ~ số dòng (lệch khi có dòng đã xoá), O(1)
+        return db.session.execute(sa.text(f'SELECT max(rowid) FROM "{SinhVien.__tablename__}"')).scalar() or 0, False
+    n = db.session.execute(
+        sa.select(sa.func.count()).select_from(stmt.limit(COUNT_CAP + 1).subquery())).scalar() or 0
+    return min(n, COUNT_CAP), n <= COUNT_CAP
+
+
+# MaSV khớp q (và lớp) từ bảng phụ, theo thứ tự MaSV
+def _search_keys(qstr: str, lop: str):
+    q = _fold(qstr)
+    stmt = sa.select(_key.c.MaSV)
+    if lop:
+        stmt = stmt.where(_key.c.MaLop == lop)
+    if len(q) >= 3:
+        phrase = '"' + q.replace('"', '""') + '"'
+        return stmt.where(_key.c.Id.in_(sa.select(_fts.c.rowid).where(_fts.c.Doc.op("MATCH")(phrase)))), _key.c.MaSV
+    # trigram không dùng được chỉ mục cho chuỗi < 3 ký tự: quét bảng phụ rồi sắp xếp (+MaSV để SQLite
+    # không đi theo chỉ mục MaSV và tra từng dòng)
+    return stmt.where(_key.c.Doc.contains(q, autoescape=True)), sa.literal_column('+"MaSV"')
+
+
+def list_students(qstr: str = "", lop: str = "", cursor: Optional[str] = None, limit: int = 50,
+                  count: str = "estimate", page: Optional[int] = None) -> Dict[str, Any]:
+    if qstr and _is_sqlite(db.session.get_bind()):
+        keys, order = _search_keys(qstr, lop)
+        key_col = _key.c.MaSV
+    else:
+        keys = sa.select(SinhVien.MaSV)
+        if lop:
+            keys = keys.where(SinhVien.MaLop == lop)
+        if qstr:
+            keys = keys.where(sa.or_(SinhVien.MaSV.ilike(f"%{qstr}%"), SinhVien.HoTen.ilike(f"%{qstr}%")))
+        order = key_col = SinhVien.MaSV
+    total, exact = _count(keys, count, bool(lop or qstr))
+
+    if cursor:
+        keys = keys.where(key_col > cursor)
+    elif page and page > 1:
+        keys = keys.offset((page - 1) * limit)   # tương thích ?page=, chậm dần ở trang sâu
+    masvs = list(db.session.execute(keys.order_by(order).limit(limit + 1)).scalars())
+    more = len(masvs) > limit
+    masvs = masvs[:limit]
+    rows: List[SinhVien] = list(db.session.execute(
+        sa.select(SinhVien).options(selectinload(SinhVien.nguoi_dung_rel))
+        .where(SinhVien.MaSV.in_(masvs)).order_by(SinhVien.MaSV)).scalars()) if masvs else []
+    return {
+        "rows": rows, "total": total, "total_exact": exact,
+        "next_cursor": masvs[-1] if more else None,
+    }
+
+
+def init_app(app: Flask):
+    if not event.contains(db.session, "after_flush", _after_flush):
+        event.listen(db.session, "after_flush", _after_flush)
+    with app.app_context():
+        try:
+            ensure_index()
+        except Exception:
+            app.logger.exception("không tạo được chỉ mục tìm kiếm sinh viên")
+
+
+def main(argv: List[str]) -> int:
+    from ..app import create_app
+
+    cmd = argv[0] if argv else "rebuild"
+    app = create_app()
+    with app.app_context():
+        if cmd == "rebuild":
+            print(f"{FTS_TABLE}: {rebuild()} rows")
+            return 0
+    print("usage: python -m backend.services.student_search rebuild")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,92 @@
+# backend/subject_resolver.py
+from __future__ import annotations
+from collections import Counter, defaultdict
+from datetime import datetime
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .db_profile import upsert
+from .models import db, HocPhan, SubjectAlias
+
+
+FUZZY_THRESHOLD = 0.78
+_CANDIDATES = 12
+
+
+def _trigrams(s: str) -> set:
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+# Ánh xạ tiêu đề cột (đã chuẩn hoá) -> HocPhan: khớp đúng TenHP -> alias đã lưu (SubjectAlias)
+# -> fuzzy trên chỉ mục trigram. Kết quả nhớ theo khoá; alias fuzzy mới nằm trong new_aliases
+# để lưu khi ghi thật.
+class SubjectResolver:
+    def __init__(self, catalog: List[HocPhan], normalize: Callable[[str], str],
+                 aliases: Optional[Dict[str, str]] = None, threshold: float = FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self.by_ma = {h.MaHP: h for h in catalog}
+        self.by_ten = {normalize(h.TenHP or ""): h for h in catalog if h.TenHP}
+        self.aliases = {k: self.by_ma[m] for k, m in (aliases or {}).items() if m in self.by_ma}
+        self.new_aliases: Dict[str, Tuple[HocPhan, float]] = {}
+        self._memo: Dict[str, Tuple[Optional[HocPhan], Optional[str]]] = {}
+        self._grams: Dict[str, List[str]] = defaultdict(list)
+        for key in self.by_ten:
+            for g in _trigrams(key):
+                self._grams[g].append(key)
+
+    @classmethod
+    def load(cls, normalize: Callable[[str], str], threshold: float = FUZZY_THRESHOLD) -> "SubjectResolver":
+        catalog = db.session.query(HocPhan).all()
+        aliases = {a.Alias: a.MaHP for a in db.session.query(SubjectAlias).all()}
+        return cls(catalog, normalize, aliases=aliases, threshold=threshold)
+
+    def _fuzzy(self, key: str) -> Tuple[Optional[HocPhan], float]:
+        hits = Counter()
+        for g in _trigrams(key):
+            for cand in self._grams.get(g, ()):
+                hits[cand] += 1
+        best, score = None, 0.0
+        for cand, _ in hits.most_common(_CANDIDATES):
+            overlap = len(set(cand.split('_')) & set(key.split('_')))
+            r = SequenceMatcher(a=cand, b=key).ratio() + overlap * 0.05
+            if r > score:
+                best, score = self.by_ten[cand], r
+        return (best, score) if score >= self.threshold else (None, score)
+
+    # Trả về (HocPhan|None, cách khớp: "exact" | "alias" | "fuzzy" | None)
+    def resolve(self, key: str) -> Tuple[Optional[HocPhan], Optional[str]]:
+        if key in self._memo:
+            return self._memo[key]
+        if key in self.by_ten:
+            res = (self.by_ten[key], "exact")
+        elif key in self.aliases:
+            res = (self.aliases[key], "alias")
+        else:
+            hobj, score = self._fuzzy(key)
+            res = (hobj, "fuzzy" if hobj else None)
+            if hobj:
+                self.new_aliases[key] = (hobj, score)
+        self._memo[key] = res
+        return res
+
+    def new_alias_rows(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return [{"Alias": key, "MaHP": hobj.MaHP, "Source": "fuzzy", "Score": round(score, 4), "CreatedAt": now}
+                for key, (hobj, score) in self.new_aliases.items()]
+
+    def save_new_aliases(self):
+        save_aliases(self.new_alias_rows())
+
+
+# Alias đã có (vd. manual do người khác vừa thêm) được giữ nguyên
+def save_aliases(rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    stmt = upsert(db.session.connection(), SubjectAlias.__table__, ["Alias"])
+    if stmt is not None:
+        db.session.execute(stmt, rows)
+        return
+    for r in rows:
+        if db.session.get(SubjectAlias, r["Alias"]) is None:
+            db.session.add(SubjectAlias(**r))
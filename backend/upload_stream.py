@@ -0,0 +1,226 @@
+# backend/upload_stream.py
+# Đọc file upload theo lô: spool ra file tạm (không giữ cả file trong RAM), CSV đọc bằng
+# chunksize, XLSX đọc bằng openpyxl read_only. Mỗi lô là DataFrame có index nối tiếp
+# (index + 2 = số dòng Excel) và cùng tên cột như pd.read_excel/read_csv.
+# Batch import (batch_import.py) đọc mọi sheet trong process pool bằng read_sheets() rồi đưa từng sheet
+# vào import như một upload (ParsedSheet).
+from __future__ import annotations
+import hashlib
+import os
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+
+CHUNK_ROWS = 5000
+_XLSX_EXT = (".xlsx", ".xlsm")
+
+
+class SpooledUpload:
+    def __init__(self, path: str, filename: str):
+        self.path = path
+        self.filename = filename
+        self.ext = os.path.splitext(filename or "")[1].lower()
+        self._digest: Optional[str] = None
+
+    # SHA-256 nội dung file (khoá kế hoạch import, xem import_plan), tính một lần
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            h = hashlib.sha256()
+            with open(self.path, "rb") as fh:
+                for block in iter(lambda: fh.read(1 << 20), b""):
+                    h.update(block)
+            self._digest = h.hexdigest()
+        return self._digest
+
+    @property
+    def is_csv(self) -> bool:
+        return self.ext == ".csv"
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Một sheet đã đọc sẵn thành DataFrame: iter_frames/estimate_rows dùng như SpooledUpload. digest là
+# SHA-256 của (file, tên sheet) nên mỗi sheet có khoá import riêng.
+class ParsedSheet:
+    def __init__(self, df: pd.DataFrame, filename: str, digest: str):
+        self.df = df
+        self.filename = filename
+        self.digest = digest
+
+    def close(self):
+        self.df = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sheet_digest(file_digest: str, sheet: str) -> str:
+    return hashlib.sha256(f"{file_digest}\0{sheet}".encode("utf-8")).hexdigest()
+
+
+# file_storage: werkzeug FileStorage; save() chép theo khối nên bộ nhớ không phụ thuộc cỡ file.
+def spool_upload(file_storage, spool_dir: Optional[str] = None) -> SpooledUpload:
+    filename = file_storage.filename or "upload.xlsx"
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(filename)[1], dir=spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            file_storage.save(fh)
+    except Exception:
+        os.remove(path)
+        raise
+    if os.path.getsize(path) == 0:
+        os.remove(path)
+        raise ValueError("File rỗng.")
+    return SpooledUpload(path, filename)
+
+
+# Tên cột như pandas: ô trống -> "Unnamed: i", trùng tên -> "X.1", "X.2"...
+def _header_names(values) -> List:
+    names, seen = [], {}
+    for i, v in enumerate(values):
+        name = f"Unnamed: {i}" if v is None or (isinstance(v, str) and v == "") else v
+        if name in seen:
+            seen[name] += 1
+            alt = f"{name}.{seen[name]}"
+            while alt in seen:
+                seen[name] += 1
+                alt = f"{name}.{seen[name]}"
+            seen[alt] = 0
+            name = alt
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _xlsx_frames(path: str, dtype, chunk_rows: int, header: Optional[int]) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from _sheet_frames(wb.worksheets[0], dtype, chunk_rows, header)
+    finally:
+        wb.close()
+
+
+def _sheet_frames(ws, dtype, chunk_rows: int, header: Optional[int]) -> Iterator[pd.DataFrame]:
+    rows = ws.iter_rows(values_only=True)
+    columns = None
+    if header is not None:
+        for _ in range(header):
+            next(rows, None)
+        head = list(next(rows, ()) or ())
+        while head and head[-1] is None:
+            head.pop()
+        columns = _header_names(head)
+
+    width = len(columns) if columns is not None else 0
+    buf, blanks, start = [], [], 0
+
+    def _frame():
+        nonlocal buf, start
+        df = pd.DataFrame(buf, columns=columns, dtype=object)
+        df.index = pd.RangeIndex(start, start + len(buf))
+        if dtype is str:
+            df = df.map(lambda v: v if v is None else str(v))
+        start += len(buf); buf = []
+        return df
+
+    for row in rows:
+        row = list(row)
+        if columns is None and len(row) > width:
+            width = len(row)
+        if all(v is None for v in row):
+            blanks.append(row)         # dòng trống ở cuối sheet bị bỏ như pandas
+            continue
+        if blanks:
+            buf.extend([None] * width for _ in blanks); blanks = []
+        if columns is not None:
+            row = (row + [None] * width)[:width]
+        buf.append(row)
+        if len(buf) >= chunk_rows:
+            yield _frame()
+    if buf or start == 0:
+        yield _frame()
+
+
+def iter_frames(up: SpooledUpload, *, dtype=str, chunk_rows: Optional[int] = None,
+                header: Optional[int] = 0) -> Iterator[pd.DataFrame]:
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    if isinstance(up, ParsedSheet):
+        for i in range(0, max(len(up.df), 1), chunk_rows):
+            yield up.df.iloc[i:i + chunk_rows]
+    elif up.is_csv:
+        yield from pd.read_csv(up.path, dtype=dtype, chunksize=chunk_rows, header=header, encoding="utf-8")
+    elif up.ext in _XLSX_EXT:
+        yield from _xlsx_frames(up.path, dtype, chunk_rows, header)
+    else:
+        # .xls và định dạng khác: không có chế độ đọc dòng, đọc một lần
+        yield pd.read_excel(up.path, dtype=dtype, header=header)
+
+
+# Ước lượng số dòng dữ liệu (cho thanh tiến độ): XLSX theo dimension của sheet, CSV theo cỡ
+# file / độ dài trung bình của 64KB đầu. None nếu không ước lượng được.
+def estimate_rows(up: SpooledUpload) -> Optional[int]:
+    if isinstance(up, ParsedSheet):
+        return len(up.df)
+    try:
+        if up.is_csv:
+            size = os.path.getsize(up.path)
+            with open(up.path, "rb") as fh:
+                head = fh.read(65536)
+            lines = head.count(b"\n")
+            return max(0, int(size / (len(head) / lines)) - 1) if lines else None
+        if up.ext in _XLSX_EXT:
+            from openpyxl import load_workbook
+            wb = load_workbook(up.path, read_only=True)
+            try:
+                n = wb.worksheets[0].max_row
+            finally:
+                wb.close()
+            return max(0, n - 1) if n else None
+    except Exception:
+        return None
+    return None
+
+
+def read_frame(up: SpooledUpload, **kw) -> pd.DataFrame:
+    frames = list(iter_frames(up, **kw))
+    return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+
+def _concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+
+# Đọc mọi sheet của file thành [(tên sheet, DataFrame)] (CSV: một sheet tên ""). Chạy được trong tiến
+# trình con của process pool: chỉ cần pandas/openpyxl, không đụng app/CSDL.
+def read_sheets(path: str, filename: str, dtype=str, header: Optional[int] = 0) -> List[Tuple[str, pd.DataFrame]]:
+    up = SpooledUpload(path, filename)
+    if up.is_csv:
+        return [("", read_frame(up, dtype=dtype, header=header))]
+    if up.ext in _XLSX_EXT:
+        from openpyxl import load_workbook
+
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            return [(ws.title, _concat(list(_sheet_frames(ws, dtype, CHUNK_ROWS, header)))) for ws in wb.worksheets]
+        finally:
+            wb.close()
+    return list(pd.read_excel(path, dtype=dtype, header=header, sheet_name=None).items())
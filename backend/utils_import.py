@@ -1,4 +1,3 @@
-from io import BytesIO
 import math
 import re
 import pandas as pd
@@ -45,17 +44,13 @@ def he4_to_chu(d4):
     return "F"
 
 def read_excel_from_request(flask_request, field_name="file"):
+    from .upload_stream import spool_upload, read_frame
     if field_name not in flask_request.files:
         raise ValueError("Thiếu file (multipart field 'file').")
-    f = flask_request.files[field_name]
-    raw = f.read()
-    if not raw:
-        raise ValueError("File rỗng.")
-    name = (f.filename or "").lower()
-    bio = BytesIO(raw)
-    if name.endswith(".csv"):
-        return pd.read_csv(bio)
-    return pd.read_excel(bio, sheet_name=0, header=None)
+    with spool_upload(flask_request.files[field_name]) as up:
+        if up.is_csv:
+            return read_frame(up, dtype=None)
+        return read_frame(up, dtype=object, header=None)
 
 def clean_header_rows(df: pd.DataFrame, header_row_idx: int | None = None) -> pd.DataFrame:
     hints = {"masv", "mssv", "ma sv", "mã sv", "mã sinh viên", "hoc ky", "học kỳ",
@@ -129,3 +124,8 @@ def suggest_subject_alias(raw_name: str, list_hp: list[tuple[str, str]]):
             if score > best_score:
                 best_score = score; best = (mahp, tenhp)
     return best if best_score >= 1 else None
+
+def chunked(seq, size: int):
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
@@ -1,102 +1,135 @@
+import numpy as np
+import pandas as pd
 import sqlalchemy as sa
-from .models import db, SinhVien, KetQuaHocTap, WarningRule, WarningCase, HocPhan
+from .models import db, SinhVien, KetQuaHocTap, WarningRule, WarningCase, HocPhan, StudentAggregate, WarningDirty
+from .db_profile import upsert
+from .utils_import import chunked
+from .jobs import report_progress
 from datetime import datetime
 
-def scan_all_warnings():
-    
-    
+
+# Đánh dấu sinh viên cần quét lại; gọi trong transaction ghi điểm, không commit.
+def mark_dirty(masvs):
+    now = datetime.utcnow()
+    stmt = upsert(db.session.connection(), WarningDirty.__table__, ["MaSV"], ["MarkedAt"])
+    for part in chunked(sorted({m for m in masvs if m}), 500):
+        rows = [{"MaSV": m, "MarkedAt": now} for m in part]
+        if stmt is not None:
+            db.session.execute(stmt, rows)
+            continue
+        db.session.execute(sa.delete(WarningDirty).where(WarningDirty.MaSV.in_(part)))
+        db.session.execute(sa.insert(WarningDirty), rows)
+
+
+# Rule thay đổi -> mọi sinh viên đều phải đánh giá lại.
+def mark_all_dirty():
+    db.session.execute(sa.delete(WarningDirty))
+    db.session.execute(sa.insert(WarningDirty).from_select(
+        ["MaSV", "MarkedAt"], sa.select(SinhVien.MaSV, sa.literal(datetime.utcnow()))))
+
+
+# Mã rule -> (cột StudentAggregate, phép so sánh với ngưỡng)
+RULE_COLUMNS = {
+    "GPA_BELOW": ("GPA4", "lt"),
+    "AVG_BELOW": ("GPA10", "lt"),
+    "FAIL_COUNT": ("FailCount", "ge"),
+    "DEBT_OVER": ("CreditsDebt", "ge"),
+}
+_STAT_COLS = ["GPA4", "GPA10", "FailCount", "CreditsDebt"]
+
+
+def _load_stats(masvs=None) -> pd.DataFrame:
+    stmt = sa.select(StudentAggregate.MaSV, *[getattr(StudentAggregate, c) for c in _STAT_COLS])
+    if masvs is None:
+        rows = db.session.execute(stmt).all()
+    else:
+        rows = []
+        for part in chunked(masvs, 500):
+            rows += db.session.execute(stmt.where(StudentAggregate.MaSV.in_(part))).all()
+    df = pd.DataFrame(rows, columns=["MaSV", *_STAT_COLS])
+    df[_STAT_COLS] = df[_STAT_COLS].astype(float).fillna(0.0)
+    return df
+
+
+# Đánh giá mọi rule trong một lần: ma trận giá trị N sinh viên x R rule so với vector ngưỡng.
+# Trả về DataFrame (RuleId, MaSV, Value) cho các cặp vi phạm.
+def _evaluate(rules, stats: pd.DataFrame) -> pd.DataFrame:
+    rules = [r for r in rules if (r.Code or "").upper().strip() in RULE_COLUMNS]
+    if not rules or stats.empty:
+        return pd.DataFrame({"RuleId": pd.Series(dtype=int), "MaSV": pd.Series(dtype=object),
+                             "Value": pd.Series(dtype=float)})
+    specs = [RULE_COLUMNS[(r.Code or "").upper().strip()] for r in rules]
+    values = stats[[col for col, _ in specs]].to_numpy(dtype=float)
+    th = np.array([r.Threshold for r in rules], dtype=float)
+    less = np.array([op == "lt" for _, op in specs])
+    mask = np.where(less, values < th, values >= th)
+    si, ri = np.nonzero(mask)
+    return pd.DataFrame({
+        "RuleId": np.array([r.Id for r in rules])[ri],
+        "MaSV": stats["MaSV"].to_numpy()[si],
+        "Value": np.round(values[si, ri], 2),
+    })
+
+
+# incremental=True: chỉ xét sinh viên trong WarningDirty. Cả hai chế độ đều so với các case
+# đang mở: mở case mới, đóng case hết vi phạm, cập nhật Value; không xoá lịch sử.
+def scan_all_warnings(incremental=False):
     rules = WarningRule.query.filter_by(Active=True).all()
     if not rules:
         return {"msg": "Không có rule nào được kích hoạt"}
     rule_ids = [r.Id for r in rules]
-    db.session.query(WarningCase).filter(
-        WarningCase.RuleId.in_(rule_ids),
-        WarningCase.Status == "open"
-    ).delete(synchronize_session=False)
-
-    new_cases_count = 0
     now = datetime.utcnow()
-    stmt = sa.select(
-        KetQuaHocTap.MaSV, 
-        KetQuaHocTap.DiemHe10, 
-        KetQuaHocTap.DiemHe4, 
-        sa.func.coalesce(KetQuaHocTap.DiemChu, ""),
-        HocPhan.SoTinChi
-    ).select_from(KetQuaHocTap).join(HocPhan, KetQuaHocTap.MaHP == HocPhan.MaHP)
-    
-    rows = db.session.execute(stmt).all()
-    sv_stats = {}
-
-    for masv, d10, d4, dchu, stc in rows:
-        if masv not in sv_stats:
-            sv_stats[masv] = {'p4':0.0, 'p10':0.0, 'tc':0, 'fails':0, 'fails_credit':0}
-        
-        stat = sv_stats[masv]
-        d10 = d10 or 0.0
-        d4 = d4 or 0.0
-        stc = int(stc or 0)
-        
-        stat['tc'] += stc
-        stat['p10'] += d10 * stc
-        stat['p4'] += d4 * stc
-        
-        # Fail logic: DiemHe10 < 4.0 or DiemChu = F
-        if d10 < 4.0 or dchu == 'F':
-            stat['fails'] += 1
-            stat['fails_credit'] += stc
-
-    cases_to_add = []
-    
-    for r in rules:
-        code = (r.Code or "").upper().strip()
-        th = r.Threshold
-        
-        for masv, stat in sv_stats.items():
-            val = 0.0
-            is_warn = False
-            msg = ""
-            
-            total_tc = stat['tc']
-            if code == "GPA_BELOW":
-                # GPA he 4
-                val = (stat['p4'] / total_tc) if total_tc > 0 else 0.0
-                if val < th:
-                    is_warn = True
-                    msg = f"GPA tích lũy: {val:.2f} < {th}"
-            
-            elif code == "AVG_BELOW":
-                # AVG he 10
-                val = (stat['p10'] / total_tc) if total_tc > 0 else 0.0
-                if val < th:
-                    is_warn = True
-                    msg = f"TBCHT (hệ 10): {val:.2f} < {th}"
-            
-            elif code == "FAIL_COUNT":
-                val = float(stat['fails'])
-                if val >= th: # Warning if fails >= threshold
-                    is_warn = True
-                    msg = f"Số môn nợ: {int(val)} >= {int(th)}"
-            
-            elif code == "DEBT_OVER":
-                val = float(stat.get('fails_credit', 0))
-                if val >= th:
-                    is_warn = True
-                    # msg = f"Nợ tín chỉ: {int(val)} >= {int(th)}" # Model không có Message
-
-            if is_warn:
-                cases_to_add.append(WarningCase(
-                    RuleId=r.Id,
-                    MaSV=masv,
-                    Value=round(val, 2),
-                    Level="warning",
-                    # Message=msg, # Bỏ vì model chưa có field này
-                    Status="open",
-                    CreatedAt=now
-                ))
-                new_cases_count += 1
-
-    if cases_to_add:
-        db.session.add_all(cases_to_add)
-        db.session.commit()
-
-    return {"ok": True, "created": new_cases_count}
+
+    targets = None
+    if incremental:
+        targets = sorted({m for (m,) in db.session.query(WarningDirty.MaSV)})
+        if not targets:
+            return {"ok": True, "mode": "incremental", "scanned": 0, "created": 0, "closed": 0, "updated": 0}
+
+    stats = _load_stats(targets)
+    report_progress(total=len(stats), processed=0)
+    hits = _evaluate(rules, stats)
+
+    stmt = sa.select(WarningCase.Id, WarningCase.RuleId, WarningCase.MaSV, WarningCase.Value).where(
+        WarningCase.RuleId.in_(rule_ids), WarningCase.Status == "open")
+    if targets is None:
+        open_rows = db.session.execute(stmt).all()
+    else:
+        open_rows = []
+        for part in chunked(targets, 500):
+            open_rows += db.session.execute(stmt.where(WarningCase.MaSV.in_(part))).all()
+    open_cases = pd.DataFrame(open_rows, columns=["Id", "RuleId", "MaSV", "OldValue"])
+
+    # Case mở trùng (rule, sinh viên) chỉ giữ một; phần còn lại đóng
+    dup = open_cases.duplicated(["RuleId", "MaSV"], keep="first")
+    merged = open_cases[~dup].merge(hits, on=["RuleId", "MaSV"], how="outer", indicator=True)
+
+    close_ids = pd.concat([open_cases.loc[dup, "Id"], merged.loc[merged["_merge"] == "left_only", "Id"]])
+    both = merged[(merged["_merge"] == "both") & (merged["OldValue"] != merged["Value"])]
+    new = merged[merged["_merge"] == "right_only"]
+
+    to_close = [{"Id": int(i), "Status": "closed", "ClosedAt": now} for i in close_ids]
+    to_update = [{"Id": int(i), "Value": float(v)} for i, v in zip(both["Id"], both["Value"])]
+    to_insert = [{"RuleId": int(rid), "MaSV": masv, "Value": float(v), "Level": "warning",
+                  "Status": "open", "CreatedAt": now}
+                 for rid, masv, v in zip(new["RuleId"], new["MaSV"], new["Value"])]
+
+    for batch in (to_close, to_update):
+        for part in chunked(batch, 1000):
+            db.session.execute(sa.update(WarningCase), part)
+    for part in chunked(to_insert, 1000):
+        db.session.execute(sa.insert(WarningCase), part)
+
+    # Chỉ xoá dấu đã có trước lúc quét; điểm ghi trong lúc quét vẫn giữ cho lần sau
+    clear = sa.delete(WarningDirty).where(WarningDirty.MarkedAt <= now)
+    if targets is None:
+        db.session.execute(clear)
+    else:
+        for part in chunked(targets, 500):
+            db.session.execute(clear.where(WarningDirty.MaSV.in_(part)))
+    db.session.commit()
+    report_progress(processed=len(stats), created=len(to_insert), closed=len(to_close), updated=len(to_update))
+
+    return {"ok": True, "mode": "incremental" if incremental else "full",
+            "scanned": len(stats) if targets is None else len(targets),
+            "created": len(to_insert), "closed": len(to_close), "updated": len(to_update)}
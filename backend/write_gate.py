@@ -0,0 +1,191 @@
+# backend/write_gate.py
+# Điều phối ghi cho SQLite: CSDL chỉ có một khoá ghi, các transaction ghi đồng thời (2 worker gunicorn,
+# job nền, quét cảnh báo) trước đây tranh nhau qua busy handler của SQLite (ngủ rồi thử lại, không theo
+# thứ tự) và lỗi "database is locked" khi chờ quá busy_timeout.
+#   - Câu ghi đầu tiên của mỗi transaction (INSERT/UPDATE/DELETE/DDL) xếp hàng ở cổng ghi: mutex trong
+#     tiến trình + flock trên file "<db>-writelock" giữa các tiến trình (không có fcntl, vd. Windows, thì
+#     chỉ trong tiến trình). Cổng nhả khi transaction commit/rollback hoặc kết nối trả về pool;
+#   - câu ghi đầu tiên vẫn gặp "database is locked" (tiến trình ngoài không qua cổng, quá hạn chờ cổng) thì
+#     rollback transaction (chưa ghi gì: pysqlite chỉ BEGIN ngay trước câu ghi đầu) rồi thử lại với
+#     backoff ngẫu nhiên tới khi quá WRITE_LOCK_TIMEOUT. Mọi chỗ commit đều được bảo vệ, không phải
+#     chạy lại view/job; câu ghi sau câu đầu đã giữ khoá nên không cần thử lại;
+#   - khi có thử lại, busy_timeout của kết nối hạ xuống WRITE_BUSY_TIMEOUT_MS (mặc định 200 ms, thay cho
+#     30 s ở app._set_sqlite_pragmas): busy handler của SQLite chỉ chờ ngắn rồi trả lỗi để vòng backoff
+#     ngẫu nhiên chạy, thay vì ngủ tới 30 s trước lần thử lại đầu tiên. "off" giữ 30 s.
+# WRITE_GATE: "retry" (mặc định, chỉ thử lại), "gate" (cổng + thử lại), "off" (chỉ đo). Thời gian chờ
+# khoá của câu ghi đầu được ghi lại, xem stats() và python -m backend.bench_write. Mặc định là "retry".
+# bench_write (2 tiến trình x 4 luồng, 20 s), chờ khoá câu ghi đầu p50/p99: off 7/1545 ms, retry
+# 15/957 ms, gate 27/663 ms; không có lỗi "database is locked" ở cả ba chế độ.
+from __future__ import annotations
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, Optional
+
+from flask import Flask
+from sqlalchemy import event
+
+from .models import db
+
+try:
+    import fcntl
+except ImportError:                      # Windows
+    fcntl = None
+
+MODES = ("gate", "retry", "off")
+WRITE_LOCK_TIMEOUT = 60.0
+WRITE_BUSY_TIMEOUT_MS = 200
+RETRY_BASE = 0.005
+RETRY_CAP = 0.25
+_WRITE = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b", re.I)
+_HELD = "write_gate.held"                # trong Connection.info: True nếu giữ cổng, False nếu bỏ qua cổng
+
+
+@lru_cache(maxsize=4096)
+def _is_write(statement: str) -> bool:
+    return _WRITE.match(statement) is not None
+
+
+def is_locked(e: BaseException) -> bool:
+    return "database is locked" in str(e).lower()
+
+
+class WriteGate:
+    def __init__(self, lock_path: Optional[str]):
+        self._mutex = threading.Lock()
+        self._owner: Optional[int] = None
+        self._path = lock_path if fcntl is not None else None
+        self._fd = self._pid = None
+
+    # Mở lại sau fork (gunicorn --preload): flock của fd kế thừa là chung giữa cha và con
+    def _lock_fd(self):
+        if self._pid != os.getpid():
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    # False nếu quá hạn hoặc chính luồng này đang giữ cổng qua kết nối khác (chờ nữa là tự khoá mình)
+    def acquire(self, deadline: float) -> bool:
+        if self._owner == threading.get_ident():
+            return False
+        if not self._mutex.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            return False
+        delay = 0.001
+        while self._path is not None:
+            try:
+                fcntl.flock(self._lock_fd(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._mutex.release()
+                    return False
+                time.sleep(random.uniform(0, delay))
+                delay = min(delay * 2, 0.02)
+        self._owner = threading.get_ident()
+        return True
+
+    def release(self):
+        self._owner = None
+        if self._path is not None:
+            fcntl.flock(self._lock_fd(), fcntl.LOCK_UN)
+        self._mutex.release()
+
+
+class _Coordinator:
+    def __init__(self, mode: str, timeout: float, lock_path: Optional[str]):
+        self.mode = mode
+        self.timeout = timeout
+        self.gate = WriteGate(lock_path) if mode == "gate" else None
+        self.waits: Deque[float] = deque(maxlen=20000)     # giây chờ khoá của câu ghi đầu
+        self.retries = 0
+        self.failures = 0
+
+    def first_write(self, run, cursor, info: Dict) -> None:
+        t0 = time.monotonic()
+        deadline = t0 + self.timeout
+        info[_HELD] = self.gate.acquire(deadline) if self.gate else False
+        attempt = 0
+        while True:
+            try:
+                run()
+                break
+            except sqlite3.OperationalError as e:
+                if self.mode == "off" or not is_locked(e) or time.monotonic() >= deadline:
+                    self.failures += 1
+                    raise
+            cursor.connection.rollback()
+            self.retries += 1
+            time.sleep(random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt)))
+            attempt += 1
+        self.waits.append(time.monotonic() - t0)
+
+    def release(self, info: Dict):
+        if info.pop(_HELD, None) and self.gate:
+            self.gate.release()
+
+
+def _install(engine, co: _Coordinator, busy_timeout_ms: int):
+    def _wrap(do):
+        def listener(cursor, statement, *args):
+            context = args[-1]
+            info = context.root_connection.info
+            if _HELD in info or not _is_write(statement):
+                return None
+            co.first_write(lambda: do(cursor, statement, *args), cursor, info)
+            return True
+        return listener
+
+    dialect = engine.dialect
+    event.listen(engine, "do_execute", _wrap(dialect.do_execute))
+    event.listen(engine, "do_executemany", _wrap(dialect.do_executemany))
+    event.listen(engine, "do_execute_no_params", _wrap(dialect.do_execute_no_params))
+
+    # Nhả trước khi COMMIT thật chạy: người kế tiếp chỉ chờ vài ms trong busy handler của SQLite
+    event.listen(engine, "commit", lambda conn: co.release(conn.info))
+    event.listen(engine, "rollback", lambda conn: co.release(conn.info))
+    event.listen(engine.pool, "checkin", lambda dbapi_conn, rec: co.release(rec.info))
+
+    # Chạy sau pragma chung (listener mức lớp Engine chạy trước listener của từng engine)
+    if co.mode != "off":
+        event.listen(engine, "connect",
+                     lambda dbapi_conn, rec: dbapi_conn.execute(f"PRAGMA busy_timeout={busy_timeout_ms}"))
+
+
+def coordinator(app: Flask) -> Optional[_Coordinator]:
+    return app.extensions.get("write_gate")
+
+
+# Phân vị thời gian chờ khoá (ms) của tiến trình này
+def stats(app: Flask) -> Dict[str, Any]:
+    co = coordinator(app)
+    if co is None:
+        return {}
+    waits = sorted(co.waits)
+    out: Dict[str, Any] = {"mode": co.mode, "writes": len(waits), "retries": co.retries, "failures": co.failures}
+    for p in (50, 95, 99):
+        out[f"p{p}_ms"] = round(waits[min(len(waits) - 1, len(waits) * p // 100)] * 1000, 2) if waits else 0.0
+    out["max_ms"] = round(waits[-1] * 1000, 2) if waits else 0.0
+    return out
+
+
+def init_app(app: Flask):
+    app.config.setdefault("WRITE_GATE", os.getenv("WRITE_GATE", "retry"))
+    app.config.setdefault("WRITE_LOCK_TIMEOUT", float(os.getenv("WRITE_LOCK_TIMEOUT", WRITE_LOCK_TIMEOUT)))
+    app.config.setdefault("WRITE_BUSY_TIMEOUT_MS", int(os.getenv("WRITE_BUSY_TIMEOUT_MS", WRITE_BUSY_TIMEOUT_MS)))
+    mode = app.config["WRITE_GATE"]
+    if mode not in MODES:
+        raise ValueError(f"WRITE_GATE không hợp lệ: {mode} (có: {', '.join(MODES)})")
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != "sqlite" or "write_gate" in app.extensions:
+        return
+    path = engine.url.database
+    lock_path = f"{os.path.abspath(path)}-writelock" if path and path != ":memory:" else None
+    co = _Coordinator(mode, float(app.config["WRITE_LOCK_TIMEOUT"]), lock_path)
+    _install(engine, co, int(app.config["WRITE_BUSY_TIMEOUT_MS"]))
+    app.extensions["write_gate"] = co
@@ -0,0 +1,154 @@
+# backend/xlsx_stream.py
+# Ghi XLSX theo luồng: sheet XML được nén thẳng vào zip (zipfile ở chế độ không seek được, dùng data
+# descriptor) và trả ra từng khối bytes ngay khi có, nên byte đầu tiên tới client sau vài mili giây và
+# bộ nhớ không phụ thuộc số dòng. Chuỗi ghi dạng inlineStr (không cần sharedStrings giữ trong RAM);
+# datetime/date ghi dạng số serial Excel kèm định dạng ngày. Quá XLSX_MAX_ROWS dòng thì sang sheet mới.
+from __future__ import annotations
+import math
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Sequence
+from xml.sax.saxutils import escape
+
+XLSX_MAX_ROWS = 1_048_575      # 1.048.576 dòng/sheet của Excel trừ dòng tiêu đề
+FLUSH_ROWS = 1000
+_ILLEGAL_XML = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+_SHEET_NAME_BAD = re.compile(r"[\[\]:*?/\\]")
+_EPOCH = datetime(1899, 12, 30)
+_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG = "http://schemas.openxmlformats.org/package/2006/relationships"
+_HEAD = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# 0: mặc định, 1: ngày giờ (numFmt 22), 2: ngày (numFmt 14)
+_STYLES = (_HEAD + f'<styleSheet xmlns="{_NS}">'
+           '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+           '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+           '<fill><patternFill patternType="gray125"/></fill></fills>'
+           '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+           '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+           '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+           '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+           '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+           '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+           '</styleSheet>')
+
+
+class _Sink:
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def write(self, b) -> int:
+        self.parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        out = b"".join(self.parts)
+        self.parts = []
+        return out
+
+
+def _col(i: int) -> str:
+    s = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+
+def _cell(ref: str, v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return f'<c r="{ref}" t="b"><v>{int(v)}</v></c>'
+    if isinstance(v, (int, float, Decimal)):
+        return f'<c r="{ref}"><v>{v}</v></c>' if math.isfinite(v) else ""
+    if isinstance(v, datetime):
+        return f'<c r="{ref}" s="1"><v>{(v.replace(tzinfo=None) - _EPOCH).total_seconds() / 86400}</v></c>'
+    if isinstance(v, date):
+        return f'<c r="{ref}" s="2"><v>{(v - _EPOCH.date()).days}</v></c>'
+    s = escape(_ILLEGAL_XML.sub("", str(v)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{s}</t></is></c>'
+
+
+def _row(r: int, cols: Sequence[str], values: Sequence) -> str:
+    return f'<row r="{r}">' + "".join(_cell(f"{c}{r}", v) for c, v in zip(cols, values)) + "</row>"
+
+
+def _sheet_title(title: str, part: int) -> str:
+    title = _SHEET_NAME_BAD.sub("_", title or "Sheet")
+    suffix = f" ({part})" if part > 1 else ""
+    return title[:31 - len(suffix)] + suffix
+
+
+def _package(names: List[str]) -> List[tuple]:
+    sheets = "".join(f'<sheet name="{escape(n)}" sheetId="{i}" r:id="rId{i}"/>' for i, n in enumerate(names, 1))
+    rels = "".join(f'<Relationship Id="rId{i}" Type="{_NS_R}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                   for i in range(1, len(names) + 1))
+    n = len(names) + 1
+    rels += f'<Relationship Id="rId{n}" Type="{_NS_R}/styles" Target="styles.xml"/>'
+    overrides = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(names) + 1))
+    return [
+        ("[Content_Types].xml", _HEAD + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+         '<Default Extension="xml" ContentType="application/xml"/>'
+         '<Override PartName="/xl/workbook.xml" '
+         'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+         '<Override PartName="/xl/styles.xml" '
+         'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+         + overrides + '</Types>'),
+        ("_rels/.rels", _HEAD + f'<Relationships xmlns="{_NS_PKG}">'
+         f'<Relationship Id="rId1" Type="{_NS_R}/officeDocument" Target="xl/workbook.xml"/></Relationships>'),
+        ("xl/workbook.xml", _HEAD + f'<workbook xmlns="{_NS}" xmlns:r="{_NS_R}"><sheets>{sheets}</sheets></workbook>'),
+        ("xl/_rels/workbook.xml.rels", _HEAD + f'<Relationships xmlns="{_NS_PKG}">{rels}</Relationships>'),
+        ("xl/styles.xml", _STYLES),
+    ]
+
+
+def iter_xlsx(header: Sequence[str], rows: Iterable[Sequence], title: str = "Sheet",
+              max_rows: int = XLSX_MAX_ROWS) -> Iterator[bytes]:
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    cols = [_col(i) for i in range(len(header))]
+    names: List[str] = []
+    r = 0
+
+    def _open():
+        names.append(_sheet_title(title, len(names) + 1))
+        f = zf.open(f"xl/worksheets/sheet{len(names)}.xml", "w")
+        f.write((_HEAD + f'<worksheet xmlns="{_NS}"><sheetData>' + _row(1, cols, header)).encode("utf-8"))
+        return f
+
+    def _close(f):
+        f.write(b"</sheetData></worksheet>")
+        f.close()
+
+    fh = _open()
+    buf: List[str] = []
+    for values in rows:
+        if r == max_rows:
+            fh.write("".join(buf).encode("utf-8")); buf = []
+            _close(fh)
+            fh, r = _open(), 0
+        r += 1
+        buf.append(_row(r + 1, cols, values))
+        if len(buf) >= FLUSH_ROWS:
+            fh.write("".join(buf).encode("utf-8")); buf = []
+            out = sink.take()
+            if out:
+                yield out
+    fh.write("".join(buf).encode("utf-8"))
+    _close(fh)
+    for name, xml in _package(names):
+        zf.writestr(name, xml)
+    zf.close()
+    yield sink.take()